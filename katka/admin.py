@@ -1,3 +1,4 @@
+from django import forms
 from django.contrib import admin
 
 from katka.fields import username_on_model
@@ -62,8 +63,27 @@ class SCMRepositoryAdmin(WithUsernameAdminModel):
     list_display = ("pk", "scm_service", "organisation", "repository_name")
 
 
+class SCMPipelineRunAdminForm(forms.ModelForm):
+    # stored as a PipelineDefinition, so it is not a model field
+    pipeline_yaml = forms.CharField(widget=forms.Textarea, initial=SCMPipelineRun.DEFAULT_PIPELINE_YAML)
+
+    class Meta:
+        model = SCMPipelineRun
+        fields = "__all__"
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        if self.instance.pk is not None:
+            self.initial["pipeline_yaml"] = self.instance.pipeline_yaml
+
+    def save(self, commit=True):
+        self.instance.pipeline_yaml = self.cleaned_data["pipeline_yaml"]
+        return super().save(commit)
+
+
 @admin.register(SCMPipelineRun)
 class SCMPipelineRunAdmin(WithUsernameAdminModel):
+    form = SCMPipelineRunAdminForm
     fields = (
         "commit_hash",
         "first_parent_hash",
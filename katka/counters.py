@@ -0,0 +1,174 @@
+import logging
+
+from django.conf import settings
+from django.db.models import Count, F, Q
+from django.utils import timezone
+
+from katka.constants import STEP_FINAL_STATUSES
+from katka.fields import username_on_model
+from katka.models import SCMPipelineRun, SCMStepRun
+
+log = logging.getLogger("katka")
+
+# Previous status of a step that was not loaded from the database
+_UNKNOWN = object()
+
+
+def incremental_counters_enabled():
+    return getattr(settings, "INCREMENTAL_STEP_COUNTERS", False)
+
+
+def status_transition_deltas(previous_status, status):
+    """
+    Return the (steps_total, steps_completed) deltas for a step that moves from 'previous_status' to 'status'.
+    A 'previous_status' of None means that the step has just been created.
+    """
+    total_delta = 1 if previous_status is None else 0
+    completed_delta = int(status in STEP_FINAL_STATUSES) - int(previous_status in STEP_FINAL_STATUSES)
+    return total_delta, completed_delta
+
+
+def update_pipeline_from_step(step, created):
+    """
+    Update the step counters of the pipeline of 'step' after it has been saved.
+
+    By default all steps of the pipeline are counted again. With the INCREMENTAL_STEP_COUNTERS setting enabled the
+    counters are adjusted based on the status transition of the step instead, falling back to a recount when the
+    previous state of the step is unknown (e.g. when the step moved to another pipeline).
+    """
+    pipeline = step.scm_pipeline_run
+    loaded_state = getattr(step, "_loaded_counter_state", None)
+
+    if not incremental_counters_enabled():
+        updated = recount_step_counters(pipeline, step.modified_username)
+    elif created:
+        updated = apply_step_counter_deltas(
+            pipeline, *status_transition_deltas(None, step.status), username=step.modified_username
+        )
+    elif loaded_state is not None and loaded_state[0] == step.scm_pipeline_run_id:
+        updated = apply_step_counter_deltas(
+            pipeline, *status_transition_deltas(loaded_state[1], step.status), username=step.modified_username
+        )
+    else:
+        updated = recount_step_counters(pipeline, step.modified_username)
+        if loaded_state is not None:
+            previous_pipeline = SCMPipelineRun.objects.filter(pk=loaded_state[0]).first()
+            if previous_pipeline is not None:
+                recount_step_counters(previous_pipeline, step.modified_username)
+
+    step.remember_counter_state()
+    return updated
+
+
+def update_pipeline_from_bulk_steps(pipeline, steps, username, created):
+    """
+    Update the step counters of the pipeline once for 'steps', which were all created or updated in the same bulk query.
+
+    Bulk queries do not send the post_save signal, so this replaces the update per step of update_pipeline_from_step.
+    All steps have to belong to 'pipeline'.
+    """
+    previous_statuses = [None if created else _loaded_status(step) for step in steps]
+
+    if not incremental_counters_enabled() or (not created and _UNKNOWN in previous_statuses):
+        updated = recount_step_counters(pipeline, username)
+    else:
+        deltas = [status_transition_deltas(previous, step.status) for previous, step in zip(previous_statuses, steps)]
+        updated = apply_step_counter_deltas(
+            pipeline, sum(total for total, _ in deltas), sum(completed for _, completed in deltas), username=username
+        )
+
+    for step in steps:
+        step.remember_counter_state()
+
+    return updated
+
+
+def _loaded_status(step):
+    loaded_state = getattr(step, "_loaded_counter_state", None)
+    if loaded_state is None or loaded_state[0] != step.scm_pipeline_run_id:
+        return _UNKNOWN
+
+    return loaded_state[1]
+
+
+def recount_step_counters(pipeline, username):
+    """Count all steps of the pipeline and save the pipeline when the counters changed"""
+    pipeline_steps = SCMStepRun.objects.filter(scm_pipeline_run=pipeline)
+
+    before_steps_total = pipeline.steps_total
+    before_steps_completed = pipeline.steps_completed
+
+    pipeline.steps_total = pipeline_steps.count()
+    pipeline.steps_completed = pipeline_steps.filter(status__in=STEP_FINAL_STATUSES).count()
+
+    if pipeline.steps_completed == before_steps_completed and pipeline.steps_total == before_steps_total:
+        return False
+
+    with username_on_model(SCMPipelineRun, username):
+        pipeline.save()
+
+    return True
+
+
+def apply_step_counter_deltas(pipeline, total_delta, completed_delta, username):
+    """Atomically adjust the step counters of the pipeline, without counting its steps"""
+    if not total_delta and not completed_delta:
+        return False
+
+    SCMPipelineRun.objects.filter(pk=pipeline.pk).update(
+        steps_total=F("steps_total") + total_delta, steps_completed=F("steps_completed") + completed_delta
+    )
+    pipeline.refresh_from_db(fields=("steps_total", "steps_completed"))
+
+    with username_on_model(SCMPipelineRun, username):
+        # Only save the audit fields: the counters are already up to date in the database and writing them again
+        # could overwrite a concurrent update. Saving still triggers the post_save receivers of the pipeline.
+        pipeline.save(update_fields=("modified_at", "modified_username"))
+
+    return True
+
+
+def reconcile_step_counters(queryset=None, batch_size=500):
+    """
+    Recount the steps of all pipelines in 'queryset' and fix the counters that are out of sync, in batches.
+
+    This is a maintenance operation: the counters are written with a bulk update, so neither the audit fields nor
+    the signals of the pipelines are triggered. Returns the number of pipelines that were updated.
+    """
+    if queryset is None:
+        queryset = SCMPipelineRun.objects.all()
+
+    mismatches = (
+        queryset.order_by()
+        .annotate(
+            actual_total=Count("scmsteprun"),
+            actual_completed=Count("scmsteprun", filter=Q(scmsteprun__status__in=STEP_FINAL_STATUSES)),
+        )
+        .exclude(steps_total=F("actual_total"), steps_completed=F("actual_completed"))
+        .values_list("pk", "actual_total", "actual_completed")
+    )
+
+    batch = []
+    updated = 0
+    for pk, steps_total, steps_completed in mismatches.iterator():
+        batch.append(SCMPipelineRun(pk=pk, steps_total=steps_total, steps_completed=steps_completed))
+        if len(batch) >= batch_size:
+            updated += _save_counters(batch, batch_size)
+            batch = []
+
+    if batch:
+        updated += _save_counters(batch, batch_size)
+
+    log.info(f"Reconciled the step counters of {updated} pipeline(s)")
+    return updated
+
+
+def _save_counters(pipelines, batch_size):
+    # bulk_update does not set modified_at, which the changes feed relies on
+    now = timezone.now()
+    for pipeline in pipelines:
+        pipeline.modified_at = now
+    SCMPipelineRun.objects.bulk_update(
+        pipelines, ("steps_total", "steps_completed", "modified_at"), batch_size=batch_size
+    )
+    return len(pipelines)
@@ -0,0 +1,191 @@
+import json
+import logging
+import queue
+import threading
+import time
+from dataclasses import dataclass
+
+from django.conf import settings
+from django.db import transaction
+from django.utils.module_loading import import_string
+
+log = logging.getLogger("katka")
+
+_broker = None
+_broker_lock = threading.Lock()
+
+
+@dataclass(frozen=True)
+class Event:
+    type: str  # "pipeline" or "step"
+    team_id: object
+    data: dict
+
+    def encode(self):
+        """Return the event in the server-sent events format"""
+        return f"event: {self.type}\ndata: {json.dumps(self.data, separators=(',', ':'))}\n\n"
+
+
+class Subscription:
+    """
+    The events of the teams of a single client, in a bounded buffer
+
+    When the client does not keep up and the buffer is full, the oldest event is dropped, so a slow client cannot
+    exhaust the memory of the server. The number of dropped events is reported to the client, which can then
+    catch up with the changes feed.
+    """
+
+    def __init__(self, broker, team_ids, buffer_size):
+        self.broker = broker
+        self.team_ids = None if team_ids is None else frozenset(team_ids)  # None is subscribed to all teams
+        self.dropped = 0
+        self._queue = queue.Queue(maxsize=buffer_size)
+        self._put_lock = threading.Lock()
+
+    def wants(self, event):
+        return self.team_ids is None or event.team_id in self.team_ids
+
+    def put(self, event):
+        with self._put_lock:
+            while True:
+                try:
+                    self._queue.put_nowait(event)
+                    return
+                except queue.Full:
+                    try:
+                        self._queue.get_nowait()
+                        self.dropped += 1
+                    except queue.Empty:
+                        pass
+
+    def get(self, timeout):
+        """Return the next event, or None when no event arrived within the timeout"""
+        try:
+            return self._queue.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+    def close(self):
+        self.broker.unsubscribe(self)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+class InProcessBroker:
+    """
+    Delivers the events to the subscriptions of this process
+
+    With multiple processes, use a broker that subclasses this one: its publish() sends the event to the other
+    processes (e.g. with Redis pub/sub), and every process calls deliver() for the events it receives.
+    """
+
+    def __init__(self):
+        self._subscriptions = set()
+        self._lock = threading.Lock()
+
+    def subscribe(self, team_ids, buffer_size=None):
+        if buffer_size is None:
+            buffer_size = getattr(settings, "EVENTS_BUFFER_SIZE", 100)
+
+        subscription = Subscription(self, team_ids, buffer_size)
+        with self._lock:
+            self._subscriptions.add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            self._subscriptions.discard(subscription)
+
+    def publish(self, event):
+        self.deliver(event)
+
+    def deliver(self, event):
+        with self._lock:
+            subscriptions = list(self._subscriptions)
+
+        for subscription in subscriptions:
+            if subscription.wants(event):
+                subscription.put(event)
+
+
+def get_broker():
+    """Return the broker of the EVENTS_BROKER setting, which is created once per process"""
+    global _broker
+    if _broker is None:
+        with _broker_lock:
+            if _broker is None:
+                _broker = import_string(getattr(settings, "EVENTS_BROKER", "katka.events.InProcessBroker"))()
+    return _broker
+
+
+def publish_on_commit(event):
+    """Publish the event once the current transaction is committed, so clients never see changes that are undone"""
+
+    def publish():
+        try:
+            get_broker().publish(event)
+        except Exception:
+            log.exception("Failed to publish event")
+
+    transaction.on_commit(publish)
+
+
+def publish_pipeline_run(pipeline):
+    data = {
+        "public_identifier": str(pipeline.public_identifier),
+        "application": str(pipeline.application_id),
+        "status": pipeline.status,
+        "steps_total": pipeline.steps_total,
+        "steps_completed": pipeline.steps_completed,
+    }
+    publish_on_commit(Event("pipeline", pipeline.team_id, data))
+
+
+def publish_step_run(step):
+    data = {
+        "public_identifier": str(step.public_identifier),
+        "scm_pipeline_run": str(step.scm_pipeline_run_id),
+        "slug": step.slug,
+        "status": step.status,
+    }
+    publish_on_commit(Event("step", step.team_id, data))
+
+
+class EventStream:
+    """
+    The events of a subscription in the server-sent events format, until the timeout expires
+
+    A comment is sent when there were no events for a while, to keep proxies from closing the connection. Clients
+    reconnect after the stream ends, which also picks up changes to the teams of the user. The subscription is
+    closed when the response is closed, also when the client disconnected before the stream started.
+    """
+
+    def __init__(self, subscription, heartbeat_interval=None, timeout=None):
+        self.subscription = subscription
+        self.heartbeat_interval = heartbeat_interval or getattr(settings, "EVENTS_HEARTBEAT_INTERVAL", 15)
+        self.timeout = timeout or getattr(settings, "EVENTS_STREAM_TIMEOUT", 300)
+
+    def __iter__(self):
+        deadline = time.monotonic() + self.timeout
+        reported_dropped = 0
+        yield "retry: 1000\n\n"
+        while True:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return
+
+            event = self.subscription.get(timeout=min(self.heartbeat_interval, remaining))
+            dropped = self.subscription.dropped
+            if dropped != reported_dropped:
+                # tell the client it missed events, so it can catch up with the changes feed
+                yield f"event: dropped\ndata: {dropped - reported_dropped}\n\n"
+                reported_dropped = dropped
+
+            yield event.encode() if event is not None else ": keep-alive\n\n"
+
+    def close(self):
+        self.subscription.close()
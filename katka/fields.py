@@ -1,9 +1,15 @@
 from contextlib import contextmanager
+from contextvars import ContextVar
 
 from django.db import models
 
 from .exceptions import MissingUsername
 
+# The usernames set with 'username_on_model', per AutoUsernameField. The fields are keyed on their id, because fields
+# of models that inherit from the same abstract model compare equal. A context variable keeps the usernames of
+# concurrent requests apart, both in threads and in asyncio tasks.
+_usernames = ContextVar("katka_usernames", default={})
+
 
 @contextmanager
 def username_on_model(model, username):
@@ -27,14 +33,16 @@ def username_on_model(model, username):
     # https://docs.djangoproject.com/en/2.1/ref/models/meta/#retrieving-all-field-instances-of-a-model
     auto_username_fields = [field for field in model._meta.get_fields() if isinstance(field, AutoUsernameField)]
 
+    # Never modify the current mapping in place, it is shared with the outer context
+    usernames = dict(_usernames.get())
     for field in auto_username_fields:
-        field.set_username(username)
+        usernames[id(field)] = username
 
+    token = _usernames.set(usernames)
     try:
         yield
     finally:
-        for field in auto_username_fields:
-            field.reset_username()
+        _usernames.reset(token)
 
 
 class AutoUsernameField(models.CharField):
@@ -57,19 +65,16 @@ class AutoUsernameField(models.CharField):
             kwargs["max_length"] = 50
 
         self.only_on_create = only_on_create
-        self._username = None
-        self._prev_username = None
 
         super().__init__(*args, **kwargs)
 
-    def set_username(self, username):
-        self._prev_username, self._username = self._username, username
-
-    def reset_username(self):
-        self._username, self._prev_username = self._prev_username, None
+    def get_username(self):
+        """Return the username set by the innermost 'username_on_model' context of the current thread or task"""
+        return _usernames.get().get(id(self))
 
     def pre_save(self, model_instance, add):
-        if self._username is None:
+        username = self.get_username()
+        if username is None:
             class_name = model_instance.__class__.__name__
             raise MissingUsername(
                 f'No username set. Make sure the username is set with the "username_on_model({class_name}, username)" '
@@ -77,7 +82,7 @@ class AutoUsernameField(models.CharField):
             )
 
         if add or not self.only_on_create:
-            setattr(model_instance, self.attname, self._username)
+            setattr(model_instance, self.attname, username)
 
         return getattr(model_instance, self.attname)
 
@@ -0,0 +1,193 @@
+"""
+Per request performance metrics: database queries, serializer and pipeline runner time, and response size
+
+The serializer time is the time spent in the to_representation() of the KatkaSerializers, the pipeline runner time is
+the time of all requests of the PipelineRunnerClient, including retries.
+
+Enable it by adding InstrumentationMiddleware to the MIDDLEWARE setting. The metrics of every request are returned in
+the Server-Timing header and passed to the sink of the INSTRUMENTATION_SINK setting, tagged by viewset and action.
+"""
+import threading
+import time
+from contextlib import ExitStack, contextmanager
+from contextvars import ContextVar
+from dataclasses import dataclass, field
+
+from django.conf import settings
+from django.db import connections
+from django.utils.module_loading import import_string
+
+# The metrics of the current request, None outside of the InstrumentationMiddleware
+_current = ContextVar("katka_request_metrics", default=None)
+
+_sink = None
+_sink_lock = threading.Lock()
+
+
+@dataclass
+class RequestMetrics:
+    viewset: str = "unknown"
+    action: str = "unknown"
+    queries: int = 0
+    db_seconds: float = 0.0
+    serializer_seconds: float = 0.0
+    runner_requests: int = 0
+    runner_seconds: float = 0.0
+    response_bytes: int = None  # None for streaming responses
+    total_seconds: float = 0.0
+    _timing: set = field(default_factory=set, repr=False)  # the kinds that are being timed, see timed()
+
+    def server_timing(self):
+        """Return the value of the Server-Timing header"""
+        return ", ".join(
+            (
+                f'db;dur={self.db_seconds * 1000:.1f};desc="{self.queries} queries"',
+                f"serializer;dur={self.serializer_seconds * 1000:.1f}",
+                f'runner;dur={self.runner_seconds * 1000:.1f};desc="{self.runner_requests} requests"',
+                f"total;dur={self.total_seconds * 1000:.1f}",
+            )
+        )
+
+
+@contextmanager
+def timed(kind):
+    """
+    Add the time spent within the context to the '<kind>_seconds' of the metrics of the current request
+
+    Nested contexts of the same kind are only counted once, e.g. nested serializers.
+    """
+    metrics = _current.get()
+    if metrics is None or kind in metrics._timing:
+        yield
+        return
+
+    metrics._timing.add(kind)
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        attribute = f"{kind}_seconds"
+        setattr(metrics, attribute, getattr(metrics, attribute) + time.perf_counter() - start)
+        metrics._timing.discard(kind)
+
+
+def record_runner_request(seconds):
+    """Add a request to the pipeline runner to the metrics of the current request"""
+    metrics = _current.get()
+    if metrics is not None:
+        metrics.runner_requests += 1
+        metrics.runner_seconds += seconds
+
+
+class PrometheusSink:
+    """
+    Aggregates the metrics per viewset and action, and renders them in the Prometheus text format
+
+    The metrics are aggregated per process. With multiple processes, every process has to be scraped, or use a sink
+    that sends the metrics elsewhere: any class with a record(metrics) method.
+    """
+
+    COUNTERS = (
+        ("requests", "Number of requests", None),
+        ("request_seconds", "Total time spent on requests", "total_seconds"),
+        ("db_queries", "Number of database queries", "queries"),
+        ("db_seconds", "Total time spent on database queries", "db_seconds"),
+        ("serializer_seconds", "Total time spent on serializing objects", "serializer_seconds"),
+        ("runner_requests", "Number of requests to the pipeline runner", "runner_requests"),
+        ("runner_seconds", "Total time spent on requests to the pipeline runner", "runner_seconds"),
+        ("response_bytes", "Total size of the responses that are not streamed", "response_bytes"),
+    )
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._totals = {}
+
+    def record(self, metrics):
+        with self._lock:
+            totals = self._totals.setdefault(
+                (metrics.viewset, metrics.action), dict.fromkeys((name for name, _, _ in self.COUNTERS), 0)
+            )
+            for name, _, attribute in self.COUNTERS:
+                totals[name] += 1 if attribute is None else getattr(metrics, attribute) or 0
+
+    def render(self):
+        """Return the metrics in the Prometheus text format"""
+        with self._lock:
+            totals = {labels: dict(values) for labels, values in self._totals.items()}
+
+        lines = []
+        for name, description, _ in self.COUNTERS:
+            lines.append(f"# HELP katka_{name}_total {description}")
+            lines.append(f"# TYPE katka_{name}_total counter")
+            for (viewset, action), values in sorted(totals.items()):
+                lines.append(f'katka_{name}_total{{viewset="{viewset}",action="{action}"}} {values[name]:g}')
+
+        return "\n".join(lines) + "\n"
+
+
+def get_sink():
+    """Return the sink of the INSTRUMENTATION_SINK setting, which is created once per process"""
+    global _sink
+    if _sink is None:
+        with _sink_lock:
+            if _sink is None:
+                _sink = import_string(
+                    getattr(settings, "INSTRUMENTATION_SINK", "katka.instrumentation.PrometheusSink")
+                )()
+    return _sink
+
+
+class InstrumentationMiddleware:
+    """
+    Records the RequestMetrics of every request
+
+    The Server-Timing header can be disabled with the INSTRUMENTATION_SERVER_TIMING setting. The queries of streaming
+    responses are only counted until the response is returned, not while its content is streamed.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        metrics = RequestMetrics()
+        token = _current.set(metrics)
+        start = time.perf_counter()
+        try:
+            with ExitStack() as stack:
+                for connection in connections.all():
+                    stack.enter_context(connection.execute_wrapper(self._time_query))
+                response = self.get_response(request)
+        finally:
+            _current.reset(token)
+
+        metrics.total_seconds = time.perf_counter() - start
+        if not response.streaming:
+            metrics.response_bytes = len(response.content)
+        if getattr(settings, "INSTRUMENTATION_SERVER_TIMING", True):
+            response["Server-Timing"] = metrics.server_timing()
+
+        get_sink().record(metrics)
+        return response
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        metrics = _current.get()
+        if metrics is None:
+            return None
+
+        view_class = getattr(view_func, "cls", None)
+        metrics.viewset = view_class.__name__ if view_class is not None else view_func.__name__
+        actions = getattr(view_func, "actions", None)
+        method = request.method.lower()
+        metrics.action = actions.get(method, method) if actions else method
+        return None
+
+    @staticmethod
+    def _time_query(execute, sql, params, many, context):
+        metrics = _current.get()
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            if metrics is not None:
+                metrics.queries += 1
+                metrics.db_seconds += time.perf_counter() - start
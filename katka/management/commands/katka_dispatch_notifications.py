@@ -0,0 +1,30 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+
+from katka.notifications import dispatch_pending_notifications
+
+
+class Command(BaseCommand):
+    help = "Send the pending pipeline change notifications in the outbox to the pipeline runner"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--once", action="store_true", help="Dispatch the due notifications once and exit")
+        parser.add_argument(
+            "--interval", type=float, default=1.0, help="Seconds to wait between dispatch rounds (default: 1)",
+        )
+        parser.add_argument(
+            "--limit", type=int, default=100, help="Maximum number of notifications per round (default: 100)",
+        )
+
+    def handle(self, *args, **options):
+        while True:
+            sent = dispatch_pending_notifications(limit=options["limit"])
+            if options["once"]:
+                self.stdout.write(f"Sent {sent} notification(s)")
+                return
+
+            close_old_connections()
+            if sent < options["limit"]:
+                time.sleep(options["interval"])
@@ -0,0 +1,16 @@
+from django.core.management.base import BaseCommand
+
+from katka.counters import reconcile_step_counters
+
+
+class Command(BaseCommand):
+    help = "Recount the steps of all pipeline runs and fix the 'steps_total' and 'steps_completed' counters"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--batch-size", type=int, default=500, help="Number of pipeline runs to update per query (default: 500)",
+        )
+
+    def handle(self, *args, **options):
+        updated = reconcile_step_counters(batch_size=options["batch_size"])
+        self.stdout.write(f"Updated the step counters of {updated} pipeline run(s)")
@@ -0,0 +1,35 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from katka.seed import seed
+
+
+class Command(BaseCommand):
+    help = "Generate a synthetic dataset of teams, applications, pipeline runs, steps and releases for load testing"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--teams", type=int, default=10, help="Number of teams (default: 10)")
+        parser.add_argument(
+            "--applications", type=int, default=10, help="Number of applications per team (default: 10)",
+        )
+        parser.add_argument(
+            "--pipeline-runs", type=int, default=100, help="Number of pipeline runs per application (default: 100)",
+        )
+        parser.add_argument("--seed", type=int, default=0, help="Seed of the random generator (default: 0)")
+        parser.add_argument(
+            "--batch-size", type=int, default=1000, help="Number of objects to insert per query (default: 1000)",
+        )
+
+    def handle(self, *args, **options):
+        start = time.monotonic()
+        counts = seed(
+            teams=options["teams"],
+            applications_per_team=options["applications"],
+            pipeline_runs_per_application=options["pipeline_runs"],
+            seed=options["seed"],
+            batch_size=options["batch_size"],
+        )
+        for label, count in counts.items():
+            self.stdout.write(f"{label}: {count}")
+        self.stdout.write(f"Created {sum(counts.values())} object(s) in {time.monotonic() - start:.1f}s")
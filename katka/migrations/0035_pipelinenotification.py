@@ -0,0 +1,32 @@
+# Generated by Django 2.2.28 on 2026-10-17 17:59
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("katka", "0034_team_sys_users"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="PipelineNotification",
+            fields=[
+                (
+                    "scm_pipeline_run",
+                    models.OneToOneField(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        primary_key=True,
+                        serialize=False,
+                        to="katka.SCMPipelineRun",
+                    ),
+                ),
+                ("version", models.PositiveIntegerField(default=1)),
+                ("attempts", models.PositiveSmallIntegerField(default=0)),
+                ("next_attempt_at", models.DateTimeField(db_index=True)),
+                ("last_error", models.TextField(blank=True)),
+            ],
+        ),
+    ]
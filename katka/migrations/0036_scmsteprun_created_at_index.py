@@ -0,0 +1,16 @@
+# Generated by Django 2.2.28 on 2026-10-17 18:01
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("katka", "0035_pipelinenotification"),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name="scmsteprun", index=models.Index(fields=["-created_at"], name="katka_scmst_created_6d343d_idx"),
+        ),
+    ]
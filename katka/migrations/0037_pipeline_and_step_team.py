@@ -0,0 +1,36 @@
+# Generated by Django 2.2.28 on 2026-10-17 18:08
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("katka", "0036_scmsteprun_created_at_index"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="scmpipelinerun",
+            name="team",
+            field=models.ForeignKey(
+                editable=False,
+                null=True,
+                on_delete=django.db.models.deletion.PROTECT,
+                related_name="+",
+                to="katka.Team",
+            ),
+        ),
+        migrations.AddField(
+            model_name="scmsteprun",
+            name="team",
+            field=models.ForeignKey(
+                editable=False,
+                null=True,
+                on_delete=django.db.models.deletion.PROTECT,
+                related_name="+",
+                to="katka.Team",
+            ),
+        ),
+    ]
@@ -0,0 +1,36 @@
+from django.db import migrations
+
+BATCH_SIZE = 1000
+
+
+def _update_in_batches(queryset, team_id):
+    while True:
+        pks = list(queryset.filter(team__isnull=True).values_list("pk", flat=True)[:BATCH_SIZE])
+        if not pks:
+            return
+
+        queryset.model.objects.filter(pk__in=pks).update(team_id=team_id)
+
+
+def backfill_team(apps, schema_editor):
+    Application = apps.get_model("katka", "Application")
+    SCMPipelineRun = apps.get_model("katka", "SCMPipelineRun")
+    SCMStepRun = apps.get_model("katka", "SCMStepRun")
+
+    applications = Application.objects.order_by("pk").values_list("pk", "project__team_id")
+    for application_id, team_id in list(applications):
+        _update_in_batches(SCMPipelineRun.objects.filter(application_id=application_id), team_id)
+        _update_in_batches(SCMStepRun.objects.filter(scm_pipeline_run__application_id=application_id), team_id)
+
+
+class Migration(migrations.Migration):
+    # Commit every batch separately, instead of locking the tables for the whole backfill
+    atomic = False
+
+    dependencies = [
+        ("katka", "0037_pipeline_and_step_team"),
+    ]
+
+    operations = [
+        migrations.RunPython(backfill_team, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,25 @@
+# Generated by Django 2.2.28 on 2026-10-17 18:13
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("katka", "0038_backfill_pipeline_and_step_team"),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name="scmpipelinerun",
+            index=models.Index(fields=["application", "first_parent_hash"], name="pipeline_first_parent_idx"),
+        ),
+        migrations.AddIndex(
+            model_name="scmpipelinerun",
+            index=models.Index(
+                condition=models.Q(("deleted", False), ("status", "queued")),
+                fields=["-created_at"],
+                name="queued_pipeline_idx",
+            ),
+        ),
+    ]
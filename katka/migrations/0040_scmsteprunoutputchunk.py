@@ -0,0 +1,42 @@
+# Generated by Django 2.2.28 on 2026-10-17 18:19
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("katka", "0039_pipeline_queue_indexes"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="SCMStepRunOutputChunk",
+            fields=[
+                ("id", models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name="ID")),
+                ("sequence", models.PositiveIntegerField()),
+                ("offset", models.BigIntegerField()),
+                ("end_offset", models.BigIntegerField()),
+                ("compressed", models.BooleanField(default=False)),
+                ("data", models.BinaryField()),
+                ("created_at", models.DateTimeField(auto_now_add=True)),
+                (
+                    "scm_step_run",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE, related_name="output_chunks", to="katka.SCMStepRun"
+                    ),
+                ),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name="scmsteprunoutputchunk",
+            index=models.Index(fields=["scm_step_run", "end_offset"], name="katka_scmst_scm_ste_733728_idx"),
+        ),
+        migrations.AddConstraint(
+            model_name="scmsteprunoutputchunk",
+            constraint=models.UniqueConstraint(
+                fields=("scm_step_run", "sequence"), name="unique sequence per step run output"
+            ),
+        ),
+    ]
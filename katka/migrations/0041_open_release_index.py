@@ -0,0 +1,19 @@
+# Generated by Django 2.2.28 on 2026-10-17 18:23
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("katka", "0040_scmsteprunoutputchunk"),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name="scmrelease",
+            index=models.Index(
+                condition=models.Q(status="in progress"), fields=["-created_at"], name="open_release_idx"
+            ),
+        ),
+    ]
@@ -0,0 +1,33 @@
+# Generated by Django 2.2.28 on 2026-10-17 18:32
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("katka", "0041_open_release_index"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="PipelineDefinition",
+            fields=[
+                ("hash", models.CharField(editable=False, max_length=64, primary_key=True, serialize=False)),
+                ("data", models.BinaryField()),
+                ("created_at", models.DateTimeField(auto_now_add=True)),
+            ],
+        ),
+        migrations.AddField(
+            model_name="scmpipelinerun",
+            name="definition",
+            field=models.ForeignKey(
+                editable=False,
+                null=True,
+                on_delete=django.db.models.deletion.PROTECT,
+                related_name="+",
+                to="katka.PipelineDefinition",
+            ),
+        ),
+    ]
@@ -0,0 +1,63 @@
+import hashlib
+import zlib
+
+from django.db import migrations
+
+BATCH_SIZE = 1000
+
+
+def _hash(pipeline_yaml):
+    return hashlib.sha256(pipeline_yaml.encode()).hexdigest()
+
+
+def deduplicate_pipeline_yaml(apps, schema_editor):
+    PipelineDefinition = apps.get_model("katka", "PipelineDefinition")
+    SCMPipelineRun = apps.get_model("katka", "SCMPipelineRun")
+
+    pipeline_runs = SCMPipelineRun.objects.filter(definition__isnull=True).order_by("pk")
+    while True:
+        batch = list(pipeline_runs.values_list("pk", "pipeline_yaml")[:BATCH_SIZE])
+        if not batch:
+            return
+
+        pks_per_hash = {}
+        yaml_per_hash = {}
+        for pk, pipeline_yaml in batch:
+            digest = _hash(pipeline_yaml)
+            pks_per_hash.setdefault(digest, []).append(pk)
+            yaml_per_hash[digest] = pipeline_yaml
+
+        existing = set(PipelineDefinition.objects.filter(hash__in=yaml_per_hash).values_list("hash", flat=True))
+        PipelineDefinition.objects.bulk_create(
+            [
+                PipelineDefinition(hash=digest, data=zlib.compress(pipeline_yaml.encode()))
+                for digest, pipeline_yaml in yaml_per_hash.items()
+                if digest not in existing
+            ],
+            ignore_conflicts=True,
+        )
+
+        for digest, pks in pks_per_hash.items():
+            SCMPipelineRun.objects.filter(pk__in=pks).update(definition_id=digest)
+
+
+def restore_pipeline_yaml(apps, schema_editor):
+    PipelineDefinition = apps.get_model("katka", "PipelineDefinition")
+    SCMPipelineRun = apps.get_model("katka", "SCMPipelineRun")
+
+    for definition in PipelineDefinition.objects.iterator():
+        pipeline_yaml = zlib.decompress(bytes(definition.data)).decode()
+        SCMPipelineRun.objects.filter(definition_id=definition.pk).update(pipeline_yaml=pipeline_yaml)
+
+
+class Migration(migrations.Migration):
+    # Commit every batch separately, instead of locking the pipeline runs for the whole migration
+    atomic = False
+
+    dependencies = [
+        ("katka", "0042_pipelinedefinition"),
+    ]
+
+    operations = [
+        migrations.RunPython(deduplicate_pipeline_yaml, restore_pipeline_yaml),
+    ]
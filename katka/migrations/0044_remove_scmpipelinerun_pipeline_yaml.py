@@ -0,0 +1,14 @@
+# Generated by Django 2.2.28 on 2026-10-17 18:33
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("katka", "0043_deduplicate_pipeline_yaml"),
+    ]
+
+    operations = [
+        migrations.RemoveField(model_name="scmpipelinerun", name="pipeline_yaml",),
+    ]
@@ -0,0 +1,25 @@
+# Generated by Django 2.2.28 on 2026-10-17 18:41
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("katka", "0044_remove_scmpipelinerun_pipeline_yaml"),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name="scmpipelinerun",
+            index=models.Index(fields=["modified_at", "public_identifier"], name="katka_scmpi_modifie_b8170e_idx"),
+        ),
+        migrations.AddIndex(
+            model_name="scmrelease",
+            index=models.Index(fields=["modified_at", "public_identifier"], name="katka_scmre_modifie_de8956_idx"),
+        ),
+        migrations.AddIndex(
+            model_name="scmsteprun",
+            index=models.Index(fields=["modified_at", "public_identifier"], name="katka_scmst_modifie_0459e0_idx"),
+        ),
+    ]
@@ -1,13 +1,18 @@
+import hashlib
 import uuid
+import zlib
 
+from django.conf import settings
 from django.contrib.auth.models import Group, User
-from django.db import models
+from django.db import models, transaction
+from django.utils.functional import cached_property
 
 from encrypted_model_fields.fields import EncryptedCharField
 from katka.auditedmodel import AuditedModel
 from katka.constants import (
     PIPELINE_STATUS_CHOICES,
     PIPELINE_STATUS_INITIALIZING,
+    PIPELINE_STATUS_QUEUED,
     RELEASE_STATUS_CHOICES,
     RELEASE_STATUS_IN_PROGRESS,
     STEP_STATUS_CHOICES,
@@ -39,6 +44,13 @@ class Project(AuditedModel):
     def __str__(self):  # pragma: no cover
         return f"{self.name}"
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # Remember the loaded team, to detect when the team of the pipeline and step runs has to be updated
+        instance._loaded_team_id = instance.__dict__.get("team_id")
+        return instance
+
 
 class Credential(AuditedModel):
     public_identifier = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
@@ -107,6 +119,39 @@ class Application(AuditedModel):
     def __str__(self):  # pragma: no cover
         return f"{self.name}"
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # Remember the loaded project, to detect when the team of the pipeline and step runs has to be updated
+        instance._loaded_project_id = instance.__dict__.get("project_id")
+        return instance
+
+
+class PipelineDefinition(models.Model):
+    """
+    Pipeline definition (YAML) of pipeline runs, stored once for all pipeline runs with the same definition.
+
+    The primary key is the SHA-256 hash of the YAML, and the YAML is stored compressed with zlib.
+    """
+
+    hash = models.CharField(max_length=64, primary_key=True, editable=False)
+    data = models.BinaryField()
+    created_at = models.DateTimeField(auto_now_add=True, editable=False)
+
+    @classmethod
+    def for_yaml(cls, pipeline_yaml):
+        """Return the stored definition with the given YAML, which is created when it does not exist yet"""
+        encoded = pipeline_yaml.encode()
+        definition, _ = cls.objects.get_or_create(
+            hash=hashlib.sha256(encoded).hexdigest(), defaults={"data": zlib.compress(encoded)}
+        )
+        definition.__dict__["yaml"] = pipeline_yaml  # no need to decompress it again
+        return definition
+
+    @cached_property
+    def yaml(self):
+        return zlib.decompress(bytes(self.data)).decode()
+
 
 # Pipeline run results
 class SCMPipelineRun(AuditedModel):
@@ -117,7 +162,20 @@ class SCMPipelineRun(AuditedModel):
             models.UniqueConstraint(fields=("commit_hash", "application"), name="unique commits per application"),
         )
         ordering = ["-created_at"]
-        indexes = [models.Index(fields=["-created_at"])]
+        indexes = [
+            models.Index(fields=["-created_at"]),
+            # Finds the next pipeline run of a commit when a pipeline run is finished
+            models.Index(fields=["application", "first_parent_hash"], name="pipeline_first_parent_idx"),
+            # Only covers the queued pipeline runs, so it stays small as the history grows and the queue can be read
+            # in order without sorting. Backends without partial indexes ignore the condition and index all runs.
+            models.Index(
+                fields=["-created_at"],
+                name="queued_pipeline_idx",
+                condition=models.Q(status=PIPELINE_STATUS_QUEUED, deleted=False),
+            ),
+            # The changes feed reads the runs in order of modification, see ChangesFeedMixin
+            models.Index(fields=["modified_at", "public_identifier"]),
+        ]
 
     public_identifier = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
     commit_hash = models.CharField(max_length=64)  # A SHA-1 hash is 40 characters, SHA-256 is 64 characters
@@ -130,15 +188,60 @@ class SCMPipelineRun(AuditedModel):
     status = models.CharField(max_length=30, choices=PIPELINE_STATUS_CHOICES, default=PIPELINE_STATUS_INITIALIZING)
     steps_total = models.PositiveSmallIntegerField(default=0)
     steps_completed = models.PositiveSmallIntegerField(default=0)
-    pipeline_yaml = models.TextField(default="---")
     application = models.ForeignKey(Application, on_delete=models.PROTECT)
     output = models.TextField(blank=True)
+    # Denormalized team of the application, so permissions can be checked without joining the application and project.
+    # Kept in sync by the signal handlers in katka.signals.
+    team = models.ForeignKey(Team, on_delete=models.PROTECT, null=True, editable=False, related_name="+")
+    # The pipeline definition is shared by all pipeline runs with the same 'pipeline_yaml', see PipelineDefinition.
+    # It is set from 'pipeline_yaml' by the signal handlers in katka.signals.
+    definition = models.ForeignKey(
+        PipelineDefinition, on_delete=models.PROTECT, null=True, editable=False, related_name="+"
+    )
+
+    DEFAULT_PIPELINE_YAML = "---"
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # Remember the loaded application, to detect when the team has to be updated
+        instance._loaded_application_id = instance.__dict__.get("application_id")
+        return instance
+
+    @property
+    def pipeline_yaml(self):
+        pending_pipeline_yaml = self.__dict__.get("_pending_pipeline_yaml")
+        if pending_pipeline_yaml is not None:
+            return pending_pipeline_yaml
+
+        if self.definition_id is None:
+            return self.DEFAULT_PIPELINE_YAML
+
+        return self.definition.yaml
+
+    @pipeline_yaml.setter
+    def pipeline_yaml(self, value):
+        # stored as a pipeline definition when the pipeline run is saved
+        self._pending_pipeline_yaml = value
+
+    def store_pipeline_definition(self):
+        pipeline_yaml = self.__dict__.pop("_pending_pipeline_yaml", None)
+        if pipeline_yaml is None and self.definition_id is None:
+            pipeline_yaml = self.DEFAULT_PIPELINE_YAML
+
+        if pipeline_yaml is not None:
+            self.definition = PipelineDefinition.for_yaml(pipeline_yaml)
 
 
 class SCMStepRun(AuditedModel):
     class Meta:
         verbose_name = "SCM step"
         verbose_name_plural = "SCM steps"
+        indexes = [
+            models.Index(fields=["-created_at"]),
+            # The changes feed reads the steps in order of modification, see ChangesFeedMixin
+            models.Index(fields=["modified_at", "public_identifier"]),
+        ]
 
     step_type = models.CharField(max_length=100, null=True)
     public_identifier = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
@@ -163,6 +266,43 @@ class SCMStepRun(AuditedModel):
     tags = models.TextField(blank=True)
     started_at = models.DateTimeField(blank=True, null=True)
     ended_at = models.DateTimeField(blank=True, null=True)
+    # Denormalized team of the pipeline run, see SCMPipelineRun.team
+    team = models.ForeignKey(Team, on_delete=models.PROTECT, null=True, editable=False, related_name="+")
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance.remember_counter_state()
+        return instance
+
+    def refresh_from_db(self, using=None, fields=None):
+        super().refresh_from_db(using=using, fields=fields)
+        self.remember_counter_state()
+
+    def save(self, *args, **kwargs):
+        if self._state.adding or not getattr(settings, "INCREMENTAL_STEP_COUNTERS", False):
+            super().save(*args, **kwargs)
+            return
+
+        # The incremental counters are adjusted based on the status transition, so read the stored status again and
+        # lock the row until the counters are adjusted. Otherwise two concurrent updates from the same loaded status
+        # (e.g. a repeated request) would both count the transition.
+        with transaction.atomic():
+            stored = SCMStepRun.objects.select_for_update().filter(pk=self.pk)
+            stored_state = stored.values_list("scm_pipeline_run_id", "status").first()
+            if stored_state is not None and getattr(self, "_loaded_counter_state", None) is not None:
+                self._loaded_counter_state = stored_state
+            super().save(*args, **kwargs)
+
+    def remember_counter_state(self):
+        """
+        Remember the pipeline and status as they are stored in the database, so the step counters of the pipeline
+        can be updated based on the status transition instead of counting all steps again (see katka.counters).
+        """
+        if {"scm_pipeline_run_id", "status"} & self.get_deferred_fields():
+            self._loaded_counter_state = None
+        else:
+            self._loaded_counter_state = (self.scm_pipeline_run_id, self.status)
 
 
 # SCM Releases, comprises a range of commits that are released
@@ -171,7 +311,15 @@ class SCMRelease(AuditedModel):
         verbose_name = "SCM release"
         verbose_name_plural = "SCM releases"
         ordering = ["-created_at"]
-        indexes = [models.Index(fields=["-created_at"])]
+        indexes = [
+            models.Index(fields=["-created_at"]),
+            # The open releases, newest first, to find the current release of an application
+            models.Index(
+                fields=["-created_at"], name="open_release_idx", condition=models.Q(status=RELEASE_STATUS_IN_PROGRESS),
+            ),
+            # The changes feed reads the releases in order of modification, see ChangesFeedMixin
+            models.Index(fields=["modified_at", "public_identifier"]),
+        ]
 
     public_identifier = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
     name = models.CharField(max_length=255)
@@ -191,3 +339,42 @@ class ApplicationMetadata(AuditedModel):
 
     def __str__(self):  # pragma: no cover
         return f"{self.application.name}/{self.key}"
+
+
+class PipelineNotification(models.Model):
+    """
+    Outbox of pipeline change notifications that still have to be sent to the pipeline runner.
+
+    There is at most one pending notification per pipeline run, so multiple changes of the same pipeline run are
+    coalesced into a single notification. The version is increased on every change, which allows the dispatcher to
+    detect that a new change was requested while it was sending the notification.
+    """
+
+    scm_pipeline_run = models.OneToOneField(SCMPipelineRun, on_delete=models.CASCADE, primary_key=True)
+    version = models.PositiveIntegerField(default=1)
+    attempts = models.PositiveSmallIntegerField(default=0)
+    next_attempt_at = models.DateTimeField(db_index=True)
+    last_error = models.TextField(blank=True)
+
+
+class SCMStepRunOutputChunk(models.Model):
+    """
+    Append-only output of a step run, stored in chunks so appending does not rewrite the output that is already stored.
+
+    The offsets are in characters of the complete output, so clients can read the output from where they stopped.
+    Chunks are optionally compressed with zlib, see katka.step_output.
+    """
+
+    class Meta:
+        constraints = (
+            models.UniqueConstraint(fields=("scm_step_run", "sequence"), name="unique sequence per step run output"),
+        )
+        indexes = [models.Index(fields=["scm_step_run", "end_offset"])]
+
+    scm_step_run = models.ForeignKey(SCMStepRun, on_delete=models.CASCADE, related_name="output_chunks")
+    sequence = models.PositiveIntegerField()
+    offset = models.BigIntegerField()
+    end_offset = models.BigIntegerField()
+    compressed = models.BooleanField(default=False)
+    data = models.BinaryField()
+    created_at = models.DateTimeField(auto_now_add=True, editable=False)
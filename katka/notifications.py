@@ -0,0 +1,181 @@
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import IntegrityError, connection, transaction
+from django.db.models import F
+from django.utils import timezone
+
+from katka.exceptions import PipelineRunnerError
+from katka.models import PipelineNotification
+from katka.runner import get_client
+from requests import HTTPError, RequestException
+
+log = logging.getLogger("katka")
+
+_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="katka-notifications")
+_dispatch_lock = threading.Lock()
+_dispatch_pending = False
+# the timer of the next retry, there is at most one per process
+_dispatch_timer = None
+_dispatch_timer_at = None
+
+
+def outbox_enabled():
+    return getattr(settings, "PIPELINE_NOTIFICATION_OUTBOX", False)
+
+
+def notify_pipeline_runner(pipeline):
+    """
+    Notify the pipeline runner that the pipeline changed.
+
+    By default the notification is sent right away. With the PIPELINE_NOTIFICATION_OUTBOX setting enabled, the
+    notification is stored in the outbox within the current transaction instead, and sent by a background
+    dispatcher after the transaction has been committed.
+    """
+    if not outbox_enabled():
+        try:
+            _post_notification(pipeline.public_identifier).raise_for_status()
+        except (HTTPError, PipelineRunnerError):
+            log.exception("Failed to notify pipeline runner")
+        return
+
+    enqueue_notification(pipeline)
+    if getattr(settings, "PIPELINE_NOTIFICATION_DISPATCH_ON_COMMIT", True):
+        transaction.on_commit(schedule_dispatch)
+
+
+def enqueue_notification(pipeline):
+    now = timezone.now()
+    outbox = PipelineNotification.objects.filter(scm_pipeline_run=pipeline)
+    if outbox.update(version=F("version") + 1, attempts=0, next_attempt_at=now):
+        return  # coalesced with a notification that was still pending
+
+    try:
+        with transaction.atomic():
+            PipelineNotification.objects.create(scm_pipeline_run=pipeline, next_attempt_at=now)
+    except IntegrityError:
+        # created concurrently by another request
+        outbox.update(version=F("version") + 1, attempts=0, next_attempt_at=now)
+
+
+def dispatch_pending_notifications(limit=100):
+    """
+    Send the notifications in the outbox that are due and return the number of notifications sent.
+
+    Notifications are sent at least once: they are only removed from the outbox after the pipeline runner accepted
+    them, and only if no new change was requested for the same pipeline in the meantime. Every notification is
+    claimed before it is sent, by moving its next attempt PIPELINE_NOTIFICATION_CLAIM_TIMEOUT seconds ahead, so
+    concurrent dispatchers (of other processes or the command) do not send it as well. When the dispatcher stops
+    before the notification was sent, it is sent after the claim timed out.
+    """
+    now = timezone.now()
+    claimed_until = now + timedelta(seconds=getattr(settings, "PIPELINE_NOTIFICATION_CLAIM_TIMEOUT", 60))
+    due = PipelineNotification.objects.filter(next_attempt_at__lte=now).order_by("next_attempt_at")
+    sent = 0
+    for notification in due[:limit]:
+        claimed = PipelineNotification.objects.filter(
+            pk=notification.pk, version=notification.version, next_attempt_at=notification.next_attempt_at
+        ).update(next_attempt_at=claimed_until)
+        if not claimed:
+            continue  # claimed by another dispatcher, or changed since it was read
+
+        try:
+            _post_notification(notification.scm_pipeline_run_id).raise_for_status()
+        except (RequestException, PipelineRunnerError) as e:
+            _retry_later(notification, e)
+            continue
+
+        PipelineNotification.objects.filter(pk=notification.pk, version=notification.version).delete()
+        sent += 1
+
+    return sent
+
+
+def schedule_dispatch(delay=None):
+    """
+    Dispatch the pending notifications in a background thread, unless a dispatch is already waiting to run
+
+    With a delay, the dispatch is scheduled on the timer of the process, which is moved forward when it would fire
+    later, but never postponed.
+    """
+    global _dispatch_pending, _dispatch_timer, _dispatch_timer_at
+
+    if delay:
+        at = time.monotonic() + delay
+        with _dispatch_lock:
+            if _dispatch_timer is not None:
+                if _dispatch_timer_at <= at:
+                    return
+                _dispatch_timer.cancel()
+
+            _dispatch_timer = threading.Timer(delay, _dispatch_on_timer)
+            _dispatch_timer.daemon = True
+            _dispatch_timer_at = at
+            _dispatch_timer.start()
+        return
+
+    with _dispatch_lock:
+        if _dispatch_pending:
+            return
+        _dispatch_pending = True
+
+    _executor.submit(_dispatch_in_background)
+
+
+def _dispatch_on_timer():
+    global _dispatch_timer, _dispatch_timer_at
+
+    with _dispatch_lock:
+        if _dispatch_timer is not threading.current_thread():
+            return  # cancelled, but already firing
+        _dispatch_timer = _dispatch_timer_at = None
+
+    schedule_dispatch()
+
+
+def _dispatch_in_background():
+    global _dispatch_pending
+
+    with _dispatch_lock:
+        _dispatch_pending = False
+
+    try:
+        dispatch_pending_notifications()
+        next_attempt_at = PipelineNotification.objects.order_by("next_attempt_at").values_list(
+            "next_attempt_at", flat=True
+        )[:1]
+        for attempt_at in next_attempt_at:
+            schedule_dispatch(delay=max((attempt_at - timezone.now()).total_seconds(), 0.1))
+    except Exception:
+        log.exception("Failed to dispatch pipeline notifications")
+    finally:
+        # this thread is not managed by Django, so close its database connection explicitly
+        connection.close()
+
+
+def _retry_later(notification, error):
+    attempts = notification.attempts + 1
+    max_attempts = getattr(settings, "PIPELINE_NOTIFICATION_MAX_ATTEMPTS", 10)
+    outbox = PipelineNotification.objects.filter(pk=notification.pk, version=notification.version)
+    if attempts >= max_attempts:
+        log.error(f"Giving up notifying pipeline runner of pipeline {notification.pk} after {attempts} attempts")
+        outbox.delete()
+        return
+
+    log.warning(f"Failed to notify pipeline runner of pipeline {notification.pk}, attempt {attempts}: {error}")
+    base_delay = getattr(settings, "PIPELINE_NOTIFICATION_RETRY_DELAY", 5)
+    max_delay = getattr(settings, "PIPELINE_NOTIFICATION_MAX_RETRY_DELAY", 300)
+    delay = min(base_delay * 2 ** (attempts - 1), max_delay)
+    outbox.update(
+        attempts=attempts, next_attempt_at=timezone.now() + timedelta(seconds=delay), last_error=str(error)[:1000]
+    )
+
+
+def _post_notification(public_identifier):
+    return get_client().post(
+        settings.PIPELINE_CHANGE_NOTIFICATION_EP, json={"public_identifier": str(public_identifier)}
+    )
@@ -0,0 +1,183 @@
+import base64
+import binascii
+import json
+from collections import OrderedDict
+from datetime import timedelta
+
+from django.conf import settings
+from django.db.models import Q
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from rest_framework.exceptions import NotFound, ValidationError
+from rest_framework.pagination import BasePagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import replace_query_param
+
+
+def encode_cursor(position, pk, reverse=False):
+    data = {"p": position.isoformat(), "pk": str(pk)}
+    if reverse:
+        data["r"] = 1
+    return base64.urlsafe_b64encode(json.dumps(data, separators=(",", ":")).encode()).decode()
+
+
+def decode_cursor(encoded):
+    """Return the (position, pk, reverse) tuple of an encoded cursor, or raise NotFound when it is not valid"""
+    try:
+        data = json.loads(base64.urlsafe_b64decode(encoded.encode()).decode())
+        position = parse_datetime(data["p"])
+        pk = data["pk"]
+        reverse = bool(data.get("r", False))
+    except (TypeError, ValueError, KeyError, binascii.Error, UnicodeDecodeError):
+        position = None
+
+    if position is None:
+        raise NotFound("Invalid cursor")
+
+    return position, pk, reverse
+
+
+class KeysetCursorPagination(BasePagination):
+    """
+    Keyset pagination on the creation date, newest first, with the primary key as a tie-breaker.
+
+    Every page is a single indexed range query: the cursor holds the creation date and primary key of the last
+    object of the previous page, so no OFFSET and no COUNT(*) is needed, regardless of the size of the table.
+
+    Pagination is only applied when the client asks for it with the 'cursor' or 'page_size' query parameter, so
+    clients that expect a plain list keep working.
+    """
+
+    cursor_query_param = "cursor"
+    page_size_query_param = "page_size"
+    page_size = 100
+    max_page_size = 1000
+    ordering_field = "created_at"
+
+    def paginate_queryset(self, queryset, request, view=None):
+        params = request.query_params
+        if self.cursor_query_param not in params and self.page_size_query_param not in params:
+            return None
+
+        self.request = request
+        self.page_size = self.get_page_size(request)
+        encoded_cursor = params.get(self.cursor_query_param)
+        position, pk, reverse = decode_cursor(encoded_cursor) if encoded_cursor else (None, None, False)
+
+        field = self.ordering_field
+        if position is not None:
+            if reverse:
+                after = Q(**{f"{field}__gt": position}) | Q(**{field: position, "pk__gt": pk})
+            else:
+                after = Q(**{f"{field}__lt": position}) | Q(**{field: position, "pk__lt": pk})
+            queryset = queryset.filter(after)
+
+        ordering = (field, "pk") if reverse else (f"-{field}", "-pk")
+        results = list(queryset.order_by(*ordering)[: self.page_size + 1])
+        has_more = len(results) > self.page_size
+        results = results[: self.page_size]
+        if reverse:
+            results.reverse()
+
+        self.has_next = has_more if not reverse else True
+        self.has_previous = has_more if reverse else position is not None
+        self.page = results
+        return results
+
+    def get_page_size(self, request):
+        try:
+            page_size = int(request.query_params[self.page_size_query_param])
+        except (KeyError, ValueError):
+            return self.page_size
+
+        if page_size <= 0:
+            return self.page_size
+
+        return min(page_size, self.max_page_size)
+
+    def get_next_link(self):
+        if not self.has_next or not self.page:
+            return None
+
+        last = self.page[-1]
+        return self._link(encode_cursor(getattr(last, self.ordering_field), last.pk))
+
+    def get_previous_link(self):
+        if not self.has_previous or not self.page:
+            return None
+
+        first = self.page[0]
+        return self._link(encode_cursor(getattr(first, self.ordering_field), first.pk, reverse=True))
+
+    def get_paginated_response(self, data):
+        return Response(
+            OrderedDict([("next", self.get_next_link()), ("previous", self.get_previous_link()), ("results", data)])
+        )
+
+    def _link(self, encoded_cursor):
+        url = self.request.build_absolute_uri()
+        url = replace_query_param(url, self.page_size_query_param, self.page_size)
+        return replace_query_param(url, self.cursor_query_param, encoded_cursor)
+
+
+class ChangesCursorPagination(KeysetCursorPagination):
+    """
+    Keyset pagination on the modification date, oldest first, for feeds of changed objects.
+
+    The response holds a cursor to the last returned object, that the client passes to get the objects modified
+    after it. A first request can start at a date with the 'modified_since' query parameter.
+
+    The modification date is set when an object is saved, not when its transaction commits, so a transaction that is
+    still running can commit an object with a modification date before the cursor. The objects modified in the last
+    CHANGES_FEED_DELAY seconds are therefore left for a next request. The feed only contains every change when no
+    transaction takes longer than the delay: set it to at least the longest transaction the database allows (e.g. the
+    statement and idle in transaction timeouts of PostgreSQL). Changes of transactions that take longer can be
+    skipped, a client that cannot miss them has to read the feed again from an earlier 'modified_since' now and then.
+    """
+
+    ordering_field = "modified_at"
+    modified_since_query_param = "modified_since"
+
+    def paginate_queryset(self, queryset, request, view=None):
+        params = request.query_params
+        self.request = request
+        self.page_size = self.get_page_size(request)
+        self.cursor = params.get(self.cursor_query_param) or None
+
+        field = self.ordering_field
+        if self.cursor is not None:
+            position, pk, _ = decode_cursor(self.cursor)
+            queryset = queryset.filter(Q(**{f"{field}__gt": position}) | Q(**{field: position, "pk__gt": pk}))
+        elif self.modified_since_query_param in params:
+            queryset = queryset.filter(**{f"{field}__gt": self._get_modified_since(params)})
+
+        delay = getattr(settings, "CHANGES_FEED_DELAY", 30)
+        if delay:
+            queryset = queryset.filter(**{f"{field}__lte": timezone.now() - timedelta(seconds=delay)})
+
+        results = list(queryset.order_by(field, "pk")[: self.page_size + 1])
+        self.has_next = len(results) > self.page_size
+        self.page = results[: self.page_size]
+        if self.page:
+            last = self.page[-1]
+            self.cursor = encode_cursor(getattr(last, field), last.pk)
+
+        return self.page
+
+    def get_paginated_response(self, data):
+        return Response(OrderedDict([("cursor", self.cursor), ("has_more", self.has_next), ("results", data)]))
+
+    def _get_modified_since(self, params):
+        try:
+            modified_since = parse_datetime(params[self.modified_since_query_param])
+        except ValueError:
+            modified_since = None
+
+        if modified_since is None:
+            raise ValidationError({self.modified_since_query_param: ["Enter a valid date/time."]})
+
+        if timezone.is_naive(modified_since):
+            modified_since = timezone.make_aware(modified_since, timezone.utc)
+
+        return modified_since
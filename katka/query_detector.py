@@ -0,0 +1,104 @@
+"""
+Detects slow and duplicate queries of the katka views, to find queries that can be removed or need an index
+
+Enable it with the QUERY_DETECTOR setting. Queries that take longer than QUERY_DETECTOR_SLOW_MS are logged right
+away, identical queries (same SQL and parameters) that are executed more than once are logged at the end of the
+request. Both are logged with the viewset and action, and where the query was made: the serializer field that was
+being serialized or validated, or otherwise the katka code that made it.
+
+Finding where a query was made inspects the call stack of every query, so only enable it to debug.
+"""
+import logging
+import os
+import sys
+import time
+from contextlib import ExitStack, contextmanager
+
+from django.conf import settings
+from django.db import connections
+
+from katka import instrumentation
+from rest_framework.fields import Field
+from rest_framework.serializers import Serializer
+
+log = logging.getLogger("katka")
+
+_KATKA_DIR = os.path.dirname(os.path.abspath(__file__))
+# The execute wrappers of katka, which are not where queries are made
+_WRAPPER_FILES = {__file__, instrumentation.__file__}
+
+
+def query_detector_enabled():
+    return getattr(settings, "QUERY_DETECTOR", False)
+
+
+class QueryDetector:
+    """The execute_wrapper that keeps track of the queries of a single request of 'view'"""
+
+    def __init__(self, view):
+        self.view = view
+        self.slow_seconds = getattr(settings, "QUERY_DETECTOR_SLOW_MS", 100) / 1000
+        self.executed = {}  # (SQL, parameters) -> [number of executions, origins]
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            seconds = time.perf_counter() - start
+            origin = find_origin()
+            executed = self.executed.setdefault((sql, repr(params)), [0, []])
+            executed[0] += 1
+            if origin not in executed[1]:
+                executed[1].append(origin)
+
+            if seconds >= self.slow_seconds:
+                log.warning(f"Slow query of {seconds * 1000:.1f} ms in {self.view_name}, from {origin}: {sql}")
+
+    @property
+    def view_name(self):
+        return f"{type(self.view).__name__}.{getattr(self.view, 'action', None) or 'unknown'}"
+
+    def duplicates(self):
+        """Return the (SQL, number of executions, origins) of the queries that were executed more than once"""
+        return [(sql, count, origins) for (sql, _), (count, origins) in self.executed.items() if count > 1]
+
+    def report(self):
+        for sql, count, origins in self.duplicates():
+            log.warning(f"Identical query executed {count} times in {self.view_name}, from {', '.join(origins)}: {sql}")
+
+
+@contextmanager
+def detect_queries(view):
+    """Detect the slow and duplicate queries that are executed within the context, on all database connections"""
+    detector = QueryDetector(view)
+    with ExitStack() as stack:
+        for connection in connections.all():
+            stack.enter_context(connection.execute_wrapper(detector))
+        yield detector
+
+    detector.report()
+
+
+def find_origin():
+    """
+    Return where the current query was made
+
+    That is the innermost serializer field that is being serialized or validated, e.g. "SCMPipelineRunSerializer.
+    application", or otherwise the innermost function of katka, e.g. "katka.utils.get_team_ids:12".
+    """
+    katka_function = None
+    frame = sys._getframe(1)
+    while frame is not None:
+        # compare the types, isinstance() would evaluate lazy objects like request.user
+        field = frame.f_locals.get("field")
+        if issubclass(type(frame.f_locals.get("self")), Serializer) and issubclass(type(field), Field):
+            return f"{type(field.parent).__name__}.{field.field_name}"
+
+        filename = frame.f_code.co_filename
+        if katka_function is None and filename.startswith(_KATKA_DIR) and filename not in _WRAPPER_FILES:
+            katka_function = f"{frame.f_globals.get('__name__')}.{frame.f_code.co_name}:{frame.f_lineno}"
+
+        frame = frame.f_back
+
+    return katka_function or "unknown"
@@ -1,14 +1,25 @@
 import json
 import logging
+import threading
+from collections import OrderedDict
 from dataclasses import dataclass
 from datetime import datetime
 
+from django.conf import settings
+
 from katka import constants
 from katka.fields import username_on_model
 from katka.models import SCMPipelineRun, SCMRelease, SCMStepRun
 
 log = logging.getLogger("katka")
 
+# The release versions in the step outputs per step primary key, as (modified_at, release version) tuples, least
+# recently used first. Only the version is kept, as outputs can be several megabytes.
+_release_versions = OrderedDict()
+_release_versions_lock = threading.Lock()
+_INVALID_OUTPUT = object()
+_NO_RELEASE_VERSION = object()
+
 
 @dataclass
 class StepsPreConditions:
@@ -70,52 +81,102 @@ def close_release_if_pipeline_finished(pipeline: SCMPipelineRun):
 
 
 def _gather_steps_pre_conditions(pipeline):
-    steps = SCMStepRun.objects.filter(scm_pipeline_run=pipeline).order_by("sequence_id")
+    steps = (
+        SCMStepRun.objects.filter(scm_pipeline_run=pipeline, status__in=constants.STEP_EXECUTED_STATUSES)
+        .order_by("sequence_id")
+        .values_list("pk", "modified_at", "status", "tags", "started_at", "ended_at")
+    )
     prod_start_date = None
     prod_end_date = None
     success_status_between_start_end = []
-    pipeline_output = {}
-    for step in steps:
-        if step.status not in constants.STEP_EXECUTED_STATUSES:
-            continue
-        _add_output(pipeline_output=pipeline_output, step_output=step.output)
-        if constants.TAG_PRODUCTION_CHANGE_STARTED in step.tags.split(" "):
-            prod_start_date = step.started_at
+    executed_steps = []
+    for pk, modified_at, status, tags, started_at, ended_at in steps:
+        executed_steps.append((pk, modified_at))
+        tags = tags.split(" ")
+        if constants.TAG_PRODUCTION_CHANGE_STARTED in tags:
+            prod_start_date = started_at
 
         if prod_start_date is not None:
-            success_status_between_start_end.append(step.status == constants.STEP_STATUS_SUCCESS)
+            success_status_between_start_end.append(status == constants.STEP_STATUS_SUCCESS)
 
-        if constants.TAG_PRODUCTION_CHANGE_ENDED in step.tags.split(" "):
-            prod_end_date = step.ended_at
+        if constants.TAG_PRODUCTION_CHANGE_ENDED in tags:
+            prod_end_date = ended_at
             break
 
+    # the version in the output of the last step that has one
+    version_number = None
+    for release_version in _get_release_versions(executed_steps):
+        if release_version is _INVALID_OUTPUT:
+            log.warning("Invalid JSON in step output")
+        elif release_version is not _NO_RELEASE_VERSION:
+            version_number = release_version
+
     return StepsPreConditions(
-        pipeline_output.get("release.version"),
+        version_number,
         success_status_between_start_end,
         prod_change_start_date=prod_start_date,
         prod_change_end_date=prod_end_date,
     )
 
 
-def _add_output(pipeline_output: dict, step_output: str) -> None:
+def _get_release_versions(steps):
+    """
+    Return the release versions in the outputs of the (pk, modified_at) steps, in the same order.
+
+    The versions are cached per step until the step is modified, so the outputs of a pipeline are not loaded and
+    parsed again every time the release is checked. Only the outputs that are not cached are loaded.
+    """
+    outputs = {}
+    with _release_versions_lock:
+        for pk, modified_at in steps:
+            cached = _release_versions.get(pk)
+            if cached is not None and cached[0] == modified_at:
+                _release_versions.move_to_end(pk)
+                outputs[pk] = cached[1]
+
+    missing = [(pk, modified_at) for pk, modified_at in steps if pk not in outputs]
+    if missing:
+        modified_at_per_step = dict(missing)
+        loaded = SCMStepRun.objects.filter(pk__in=modified_at_per_step).values_list("pk", "output")
+        max_size = getattr(settings, "RELEASE_OUTPUT_CACHE_SIZE", 10000)
+        with _release_versions_lock:
+            for pk, output in loaded:
+                outputs[pk] = _parse_release_version(output)
+                _release_versions[pk] = (modified_at_per_step[pk], outputs[pk])
+                _release_versions.move_to_end(pk)
+
+            while len(_release_versions) > max_size:
+                _release_versions.popitem(last=False)
+
+    return [outputs[pk] for pk, _ in steps if pk in outputs]
+
+
+def _parse_release_version(step_output):
     if not step_output:
-        return
+        return _NO_RELEASE_VERSION
     try:
-        pipeline_output.update(json.loads(step_output))
+        output = json.loads(step_output)
     except json.JSONDecodeError:
-        log.warning("Invalid JSON in step output")
+        return _INVALID_OUTPUT
+
+    if not isinstance(output, dict):
+        return _INVALID_OUTPUT
+    return output.get("release.version", _NO_RELEASE_VERSION)
 
 
 def _get_current_release(pipeline):
-    releases = SCMRelease.objects.filter(
-        status=constants.RELEASE_STATUS_IN_PROGRESS, scm_pipeline_runs__application=pipeline.application
+    # A single query for at most two releases is enough to detect multiple open releases, no matter how many there are
+    releases = list(
+        SCMRelease.objects.filter(
+            status=constants.RELEASE_STATUS_IN_PROGRESS, scm_pipeline_runs__application_id=pipeline.application_id
+        )
+        .distinct()
+        .order_by("-created_at")[:2]
     )
-    release = None
     if len(releases) == 0:
-        log.debug(f"No open releases found for application {pipeline.application.pk}")
-    elif len(releases) > 1:
-        log.error(f"Multiple open releases found for application {pipeline.application.pk}, picking newest")
-        release = releases.order_by("-created_at").first()
-    else:
-        release = releases[0]
-    return release
+        log.debug(f"No open releases found for application {pipeline.application_id}")
+        return None
+
+    if len(releases) > 1:
+        log.error(f"Multiple open releases found for application {pipeline.application_id}, picking newest")
+    return releases[0]
@@ -0,0 +1,237 @@
+import bisect
+import logging
+import random
+import threading
+import time
+import weakref
+from dataclasses import dataclass, field
+from urllib.parse import urljoin
+
+from django.conf import settings
+
+from katka.exceptions import PipelineRunnerError
+from katka.instrumentation import record_runner_request
+from requests import ConnectionError, RequestException, Session
+from requests.adapters import HTTPAdapter
+
+log = logging.getLogger("katka")
+
+# Responses that mean the pipeline runner is (temporarily) unavailable, the request is retried. Other server errors
+# are returned right away, as the runner may have processed the request (also on a gateway timeout).
+RETRY_STATUS_CODES = frozenset({502, 503})
+SERVER_ERROR_STATUS_CODES = range(500, 600)
+
+# Upper bounds in seconds of the latency histogram buckets, the last bucket holds the slower requests
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+_client = None
+_client_lock = threading.Lock()
+
+
+@dataclass
+class EndpointMetrics:
+    requests: int = 0
+    failures: int = 0  # requests that raised an error or returned a server error
+    total_seconds: float = 0.0
+    max_seconds: float = 0.0
+    buckets: list = field(default_factory=lambda: [0] * (len(LATENCY_BUCKETS) + 1))
+
+    def observe(self, seconds, failed):
+        self.requests += 1
+        self.failures += failed
+        self.total_seconds += seconds
+        self.max_seconds = max(self.max_seconds, seconds)
+        self.buckets[bisect.bisect_left(LATENCY_BUCKETS, seconds)] += 1
+
+
+class CircuitBreaker:
+    """
+    Fails fast while the pipeline runner is down, instead of letting every request wait for the timeouts
+
+    The circuit opens after a number of consecutive failed calls. While it is open, calls fail right away. After the
+    reset timeout a single call is let through: when it succeeds the circuit closes, otherwise it opens again.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.failures = 0
+        self.opened_at = None
+
+    def allow(self):
+        with self._lock:
+            if self.opened_at is None:
+                return True
+
+            now = time.monotonic()
+            if now - self.opened_at < getattr(settings, "PIPELINE_RUNNER_CIRCUIT_BREAKER_RESET", 30):
+                return False
+
+            # let this call through as a trial, the others keep failing fast until it finished
+            self.opened_at = now
+            return True
+
+    def record_success(self):
+        with self._lock:
+            self.failures = 0
+            self.opened_at = None
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self.failures >= getattr(settings, "PIPELINE_RUNNER_CIRCUIT_BREAKER_THRESHOLD", 5):
+                if self.opened_at is None:
+                    log.error(f"Pipeline runner failed {self.failures} times in a row, failing fast for a while")
+                self.opened_at = time.monotonic()
+
+
+class PipelineRunnerClient:
+    """
+    Sends requests to the pipeline runner with timeouts, retries and a circuit breaker
+
+    Uses the PIPELINE_RUNNER_SESSION setting when it is set, otherwise its own session. A requests session gets a
+    connection pool of PIPELINE_RUNNER_POOL_SIZE connections, keeping the retry configuration of its adapters.
+    """
+
+    def __init__(self):
+        self.circuit_breaker = CircuitBreaker()
+        self._metrics = {}
+        self._metrics_lock = threading.Lock()
+        self._session = None
+        self._session_lock = threading.Lock()
+        self._pooled_sessions = weakref.WeakSet()  # the sessions with a connection pool of the pool size
+
+    @property
+    def session(self):
+        session = getattr(settings, "PIPELINE_RUNNER_SESSION", None)
+        if session is None:
+            if self._session is None:
+                self._session = Session()
+            session = self._session
+
+        if isinstance(session, Session) and session not in self._pooled_sessions:
+            with self._session_lock:
+                if session not in self._pooled_sessions:
+                    _mount_pool(session, getattr(settings, "PIPELINE_RUNNER_POOL_SIZE", 10))
+                    self._pooled_sessions.add(session)
+
+        return session
+
+    def post(self, endpoint, json):
+        """
+        Post to the endpoint of the pipeline runner and return the response
+
+        Connection errors (including connect timeouts) and the RETRY_STATUS_CODES are retried PIPELINE_RUNNER_RETRIES
+        times. Read timeouts are not retried: the runner may have received the request, and the requests are not
+        idempotent. Raises PipelineRunnerError when the circuit is open or when no response was received. Other error
+        responses are returned, so the caller can handle them with raise_for_status(). All server errors count as a
+        failure for the circuit breaker.
+        """
+        if not self.circuit_breaker.allow():
+            raise PipelineRunnerError
+
+        url = urljoin(settings.PIPELINE_RUNNER_BASE_URL, endpoint)
+        timeout = (
+            getattr(settings, "PIPELINE_RUNNER_CONNECT_TIMEOUT", 3.05),
+            getattr(settings, "PIPELINE_RUNNER_READ_TIMEOUT", 10),
+        )
+        retries = getattr(settings, "PIPELINE_RUNNER_RETRIES", 2)
+        response = error = None
+        for attempt in range(retries + 1):
+            if attempt:
+                self._sleep_before_retry(attempt)
+
+            start = time.monotonic()
+            try:
+                response, error = self.session.post(url, json=json, timeout=timeout), None
+            except RequestException as e:
+                response, error = None, e
+
+            failed = error is not None or response.status_code in SERVER_ERROR_STATUS_CODES
+            self._observe(endpoint, time.monotonic() - start, failed)
+            if not failed:
+                self.circuit_breaker.record_success()
+                return response
+
+            log.warning(f"Request to pipeline runner {endpoint} failed, attempt {attempt + 1}: {error or response}")
+            if not self._retryable(response, error):
+                break
+
+        self.circuit_breaker.record_failure()
+        if response is None:
+            raise PipelineRunnerError from error
+
+        return response
+
+    def metrics(self):
+        """Return a snapshot of the EndpointMetrics per endpoint"""
+        with self._metrics_lock:
+            return {
+                endpoint: EndpointMetrics(
+                    metrics.requests,
+                    metrics.failures,
+                    metrics.total_seconds,
+                    metrics.max_seconds,
+                    list(metrics.buckets),
+                )
+                for endpoint, metrics in self._metrics.items()
+            }
+
+    def _observe(self, endpoint, seconds, failed):
+        record_runner_request(seconds)
+        with self._metrics_lock:
+            self._metrics.setdefault(endpoint, EndpointMetrics()).observe(seconds, failed)
+
+    @staticmethod
+    def _retryable(response, error):
+        if response is None:
+            return isinstance(error, ConnectionError)
+
+        return response.status_code in RETRY_STATUS_CODES
+
+    @staticmethod
+    def _sleep_before_retry(attempt):
+        # exponential backoff with full jitter, so retrying workers do not hit a recovering runner all at once
+        backoff = getattr(settings, "PIPELINE_RUNNER_RETRY_BACKOFF", 0.2)
+        time.sleep(random.uniform(0, backoff * 2 ** (attempt - 1)))
+
+
+def _mount_pool(session, pool_size):
+    """Mount adapters with a connection pool of pool_size connections, keeping the retries of the current adapters"""
+    for prefix in ("http://", "https://"):
+        current = session.get_adapter(prefix)
+        max_retries = current.max_retries if isinstance(current, HTTPAdapter) else 0
+        session.mount(prefix, HTTPAdapter(pool_connections=1, pool_maxsize=pool_size, max_retries=max_retries))
+
+
+def render_prometheus(metrics):
+    """Return the EndpointMetrics per endpoint as a histogram in the Prometheus text format"""
+    name = "katka_runner_request_duration_seconds"
+    metrics = sorted(metrics.items(), key=lambda item: str(item[0]))
+    lines = [
+        f"# HELP {name} Duration of the requests to the pipeline runner per endpoint",
+        f"# TYPE {name} histogram",
+    ]
+    for endpoint, endpoint_metrics in metrics:
+        count = 0
+        for upper_bound, bucket in zip((*LATENCY_BUCKETS, "+Inf"), endpoint_metrics.buckets):
+            count += bucket
+            lines.append(f'{name}_bucket{{endpoint="{endpoint}",le="{upper_bound}"}} {count}')
+        lines.append(f'{name}_sum{{endpoint="{endpoint}"}} {endpoint_metrics.total_seconds:g}')
+        lines.append(f'{name}_count{{endpoint="{endpoint}"}} {endpoint_metrics.requests}')
+
+    lines.append("# HELP katka_runner_request_failures_total Number of failed requests to the pipeline runner")
+    lines.append("# TYPE katka_runner_request_failures_total counter")
+    for endpoint, endpoint_metrics in metrics:
+        lines.append(f'katka_runner_request_failures_total{{endpoint="{endpoint}"}} {endpoint_metrics.failures}')
+
+    return "\n".join(lines) + "\n"
+
+
+def get_client():
+    """Return the pipeline runner client, which is shared by all threads of the process"""
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                _client = PipelineRunnerClient()
+    return _client
@@ -0,0 +1,318 @@
+"""
+Generate a synthetic dataset of realistic size, to reproduce the load of production locally
+
+All objects are inserted with bulk_create in batches, so millions of rows are created in minutes. The dataset only
+depends on the seed and the sizes: generating it again with the same arguments in an empty database creates the same
+rows, with the same primary keys and audit timestamps.
+"""
+import json
+import random
+import uuid
+from contextlib import ExitStack
+from datetime import datetime, timedelta, timezone
+
+from django.contrib.auth.models import Group
+from django.db import connection, transaction
+
+from katka import constants, models
+from katka.auditedmodel import AuditedModel
+from katka.fields import username_on_model
+
+# All generated timestamps are relative to this moment, so they do not depend on the time of seeding
+EPOCH = datetime(2020, 1, 1, tzinfo=timezone.utc)
+
+# (stage, step slug, step type) of the steps of a pipeline run, the deploy steps are production changes
+STEPS = (
+    ("prepare", "checkout", "git"),
+    ("prepare", "dependencies", "shell"),
+    ("build", "compile", "docker"),
+    ("test", "unit-tests", "shell"),
+    ("test", "integration-tests", "shell"),
+    ("deploy", "deploy-acceptance", "deploy"),
+    ("deploy", "deploy-production", "deploy"),
+    ("verify", "smoke-tests", "shell"),
+)
+
+PIPELINE_YAMLS = tuple(
+    "stages:\n" + "".join(f"  - {stage}\n" for stage in stages)
+    for stages in (
+        ("prepare", "build", "test", "deploy"),
+        ("prepare", "build", "test", "deploy", "verify"),
+        ("build", "deploy"),
+    )
+)
+
+SEEDED_MODELS = (
+    models.Team,
+    models.Project,
+    models.Credential,
+    models.CredentialSecret,
+    models.SCMService,
+    models.SCMRepository,
+    models.Application,
+    models.ApplicationMetadata,
+    models.SCMPipelineRun,
+    models.SCMStepRun,
+    models.SCMRelease,
+    models.SCMRelease.scm_pipeline_runs.through,
+)
+
+
+class _BulkWriter:
+    """
+    Buffers new objects and inserts them with bulk_create once a buffer is full
+
+    All buffers are flushed together, in the order of SEEDED_MODELS, so objects are always inserted after the objects
+    they refer to. bulk_create sets the audit timestamps to the current time, so the timestamps of the objects are
+    written again after inserting them.
+    """
+
+    def __init__(self, batch_size):
+        self.batch_size = batch_size
+        self.buffers = {model: [] for model in SEEDED_MODELS}
+        self.counts = {model: 0 for model in SEEDED_MODELS}
+
+    def add(self, obj):
+        if isinstance(obj, AuditedModel) and obj.created_at is None:
+            # objects without a time of their own exist from the start of the schedule
+            obj.created_at = obj.modified_at = EPOCH
+        buffer = self.buffers[type(obj)]
+        buffer.append(obj)
+        if len(buffer) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        for model, objects in self.buffers.items():
+            if objects:
+                # Django 2.2 does not limit the batch size to what the database supports, e.g. 500 rows in SQLite
+                batch_size = max(connection.ops.bulk_batch_size(model._meta.concrete_fields, objects), 1)
+                batch_size = min(self.batch_size, batch_size)
+                if issubclass(model, AuditedModel):
+                    self._create_audited(model, objects, batch_size)
+                else:
+                    model.objects.bulk_create(objects, batch_size=batch_size)
+                self.counts[model] += len(objects)
+                objects.clear()
+
+    def _create_audited(self, model, objects, batch_size):
+        timestamps = [(obj.created_at, obj.modified_at) for obj in objects]
+        model.objects.bulk_create(objects, batch_size=batch_size)
+        for obj, (created_at, modified_at) in zip(objects, timestamps):
+            obj.created_at, obj.modified_at = created_at, modified_at
+        self._set_primary_keys(model, objects)
+        model.objects.bulk_update(objects, ("created_at", "modified_at"), batch_size=batch_size)
+
+    @staticmethod
+    def _set_primary_keys(model, objects):
+        """Look up the generated primary keys by the unique fields, bulk_create does not set them on all databases"""
+        objects = [obj for obj in objects if obj.pk is None]
+        if not objects:
+            return
+
+        attnames = [model._meta.get_field(name).attname for name in model._meta.unique_together[0]]
+        lookups = {f"{attname}__in": {getattr(obj, attname) for obj in objects} for attname in attnames}
+        pks = {tuple(row[1:]): row[0] for row in model.objects.filter(**lookups).values_list("pk", *attnames)}
+        for obj in objects:
+            obj.pk = pks[tuple(getattr(obj, attname) for attname in attnames)]
+
+
+class _Generator:
+    def __init__(self, writer, seed):
+        self.writer = writer
+        self.rng = random.Random(seed)
+        self.definitions = [models.PipelineDefinition.for_yaml(pipeline_yaml) for pipeline_yaml in PIPELINE_YAMLS]
+        self.scm_service = models.SCMService(
+            public_identifier=self.uuid(), scm_service_type="bitbucket", server_url="https://scm.example.com"
+        )
+        self.writer.add(self.scm_service)
+
+    def uuid(self):
+        return uuid.UUID(int=self.rng.getrandbits(128), version=4)
+
+    def commit_hash(self):
+        return f"{self.rng.getrandbits(160):040x}"
+
+    def team(self, number, applications, pipeline_runs_per_application):
+        # the group is inserted right away, bulk_create does not set the generated primary keys on all databases
+        group = Group.objects.create(name=f"seed-group-{number}")
+        team = models.Team(public_identifier=self.uuid(), slug=f"TEAM{number}", name=f"Team {number}", group=group)
+        project = models.Project(public_identifier=self.uuid(), slug="PRJ", name="Project", team=team)
+        credential = models.Credential(
+            public_identifier=self.uuid(), name="System user", credential_type="username_password", team=team
+        )
+        for obj in (team, project, credential):
+            self.writer.add(obj)
+        self.writer.add(models.CredentialSecret(key="access_token", value=self.uuid().hex, credential=credential))
+
+        for number in range(applications):
+            self.application(team, project, credential, number, pipeline_runs_per_application)
+
+    def application(self, team, project, credential, number, pipeline_runs):
+        repository = models.SCMRepository(
+            public_identifier=self.uuid(),
+            scm_service=self.scm_service,
+            credential=credential,
+            organisation=f"org-{team.slug.lower()}",
+            repository_name=f"repo-{number}",
+        )
+        application = models.Application(
+            public_identifier=self.uuid(),
+            project=project,
+            scm_repository=repository,
+            name=f"Application {number}",
+            slug=f"APP{number}",
+        )
+        self.writer.add(repository)
+        self.writer.add(application)
+        self.writer.add(
+            models.ApplicationMetadata(
+                key="language", value=self.rng.choice(("python", "java", "go")), application=application
+            )
+        )
+
+        started_at = EPOCH + timedelta(minutes=self.rng.randrange(60 * 24 * 30))
+        first_parent_hash = None
+        released = []
+        release_number = 0
+        for number in range(pipeline_runs):
+            last = number == pipeline_runs - 1
+            pipeline_run, ended_at = self.pipeline_run(team, application, first_parent_hash, started_at, last)
+            first_parent_hash = pipeline_run.commit_hash
+            released.append(pipeline_run)
+            if last or (pipeline_run.status == constants.PIPELINE_STATUS_SUCCESS and self.rng.random() < 0.2):
+                release_number += 1
+                self.release(released, release_number, started_at, ended_at, open_=last)
+                released = []
+
+            started_at = ended_at + timedelta(minutes=self.rng.randrange(5, 24 * 60))
+
+    def pipeline_run(self, team, application, first_parent_hash, started_at, in_progress):
+        """Add a pipeline run and its steps, return the pipeline run and the time its last step ended"""
+        pipeline_run = models.SCMPipelineRun(
+            public_identifier=self.uuid(),
+            commit_hash=self.commit_hash(),
+            first_parent_hash=first_parent_hash,
+            application=application,
+            team=team,
+            definition=self.rng.choice(self.definitions),
+            steps_total=len(STEPS),
+        )
+
+        # the last pipeline run of an application is still running, some others fail
+        if in_progress:
+            failing_step = None
+            running_step = self.rng.randrange(len(STEPS))
+        else:
+            failing_step = self.rng.randrange(len(STEPS)) if self.rng.random() < 0.1 else None
+            running_step = None
+
+        steps = []
+        status = constants.STEP_STATUS_SUCCESS
+        ended_at = started_at
+        for number, (stage, slug, step_type) in enumerate(STEPS):
+            if number == running_step:
+                status = constants.STEP_STATUS_IN_PROGRESS
+            elif number == failing_step:
+                status = constants.STEP_STATUS_FAILED
+            elif status != constants.STEP_STATUS_SUCCESS:
+                status = constants.STEP_STATUS_NOT_STARTED if in_progress else constants.STEP_STATUS_SKIPPED
+
+            step_started_at = step_ended_at = None
+            if status in (constants.STEP_STATUS_IN_PROGRESS, *constants.STEP_EXECUTED_STATUSES):
+                step_started_at = ended_at
+            if status in constants.STEP_EXECUTED_STATUSES:
+                step_ended_at = ended_at = step_started_at + timedelta(seconds=self.rng.randrange(5, 600))
+
+            steps.append(
+                models.SCMStepRun(
+                    public_identifier=self.uuid(),
+                    scm_pipeline_run=pipeline_run,
+                    team=team,
+                    slug=slug,
+                    name=slug.replace("-", " ").capitalize(),
+                    stage=stage,
+                    step_type=step_type,
+                    sequence_id=f"{number + 1}.1-1",
+                    status=status,
+                    tags=self.tags(slug),
+                    output=self.output(pipeline_run, slug, status),
+                    started_at=step_started_at,
+                    ended_at=step_ended_at,
+                    created_at=started_at,
+                    modified_at=step_ended_at or step_started_at or started_at,
+                )
+            )
+            if status in constants.STEP_FINAL_STATUSES:
+                pipeline_run.steps_completed += 1
+
+        if in_progress:
+            pipeline_run.status = constants.PIPELINE_STATUS_IN_PROGRESS
+        elif failing_step is not None:
+            pipeline_run.status = constants.PIPELINE_STATUS_FAILED
+        else:
+            pipeline_run.status = constants.PIPELINE_STATUS_SUCCESS
+        pipeline_run.created_at = started_at
+        pipeline_run.modified_at = ended_at
+
+        for obj in (pipeline_run, *steps):
+            self.writer.add(obj)
+        return pipeline_run, ended_at
+
+    @staticmethod
+    def tags(slug):
+        if slug == "deploy-production":
+            return f"{constants.TAG_PRODUCTION_CHANGE_STARTED} {constants.TAG_PRODUCTION_CHANGE_ENDED}"
+        return ""
+
+    def output(self, pipeline_run, slug, status):
+        if status not in constants.STEP_EXECUTED_STATUSES:
+            return ""
+        if slug == "compile":
+            return json.dumps({"image": f"registry.example.com/app:{pipeline_run.commit_hash[:8]}"})
+        if slug == "deploy-production":
+            return json.dumps({"release.version": f"1.{self.rng.randrange(100)}.{self.rng.randrange(1000)}"})
+        return "\n".join(f"[{slug}] line {line}" for line in range(self.rng.randrange(1, 20)))
+
+    def release(self, pipeline_runs, number, started_at, ended_at, open_):
+        release = models.SCMRelease(
+            public_identifier=self.uuid(),
+            name=f"Version 1.{number}.0",
+            status=constants.RELEASE_STATUS_IN_PROGRESS if open_ else constants.RELEASE_STATUS_SUCCESS,
+            started_at=None if open_ else started_at,
+            ended_at=None if open_ else ended_at,
+            created_at=started_at,
+            modified_at=ended_at,
+        )
+        self.writer.add(release)
+        through = models.SCMRelease.scm_pipeline_runs.through
+        for pipeline_run in pipeline_runs:
+            self.writer.add(through(scmrelease=release, scmpipelinerun=pipeline_run))
+
+
+def seed(
+    teams=10,
+    applications_per_team=10,
+    pipeline_runs_per_application=100,
+    seed=0,
+    batch_size=1000,
+    username="katka_seed",
+):
+    """
+    Generate the dataset and return the number of created objects per model
+
+    Every application gets a linear chain of pipeline runs, linked by their first parent hash. The pipeline runs are
+    grouped in releases and the last pipeline run of every application is still in progress, in the still open
+    release of the application. The slugs and names of the teams are numbered from 0, so the dataset has to be
+    generated in a database without teams.
+    """
+    writer = _BulkWriter(batch_size)
+    with transaction.atomic(), ExitStack() as stack:
+        for model in SEEDED_MODELS:
+            stack.enter_context(username_on_model(model, username))
+
+        generator = _Generator(writer, seed)
+        for number in range(teams):
+            generator.team(number, applications_per_team, pipeline_runs_per_application)
+        writer.flush()
+
+    return {Group._meta.label: teams, **{model._meta.label: count for model, count in writer.counts.items()}}
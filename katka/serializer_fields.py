@@ -1,6 +1,6 @@
 from katka.auth import has_full_access_scope
 from katka.models import Application, Credential, Project, SCMPipelineRun, SCMRepository, SCMService, Team
-from katka.utils import get_teams
+from katka.utils import get_team_ids
 from rest_framework import serializers
 from rest_framework.exceptions import NotFound, PermissionDenied
 from rest_framework.relations import PrimaryKeyRelatedField
@@ -39,7 +39,7 @@ class TeamRelatedField(PrimaryKeyRelated403Field):
         request = self.context["request"]
         queryset = Team.objects.filter(deleted=False)
         if not has_full_access_scope(request):
-            queryset = queryset & get_teams(request.user)  # get intersection of querysets
+            queryset = queryset.filter(pk__in=get_team_ids(request.user))
 
         return queryset
 
@@ -51,7 +51,7 @@ class ProjectRelatedField(PrimaryKeyRelated403Field):
         request = self.context["request"]
         queryset = Project.objects.filter(team__deleted=False, deleted=False)
         if not has_full_access_scope(request):
-            queryset = queryset.filter(team__in=get_teams(request.user))
+            queryset = queryset.filter(team__in=get_team_ids(request.user))
 
         return queryset
 
@@ -63,7 +63,7 @@ class CredentialRelatedField(PrimaryKeyRelated403Field):
         request = self.context["request"]
         queryset = Credential.objects.filter(team__deleted=False, deleted=False)
         if not has_full_access_scope(request):
-            queryset = queryset.filter(team__in=get_teams(request.user))
+            queryset = queryset.filter(team__in=get_team_ids(request.user))
 
         return queryset
 
@@ -89,7 +89,7 @@ class ApplicationRelatedField(PrimaryKeyRelated403Field):
         request = self.context["request"]
         queryset = Application.objects.filter(project__team__deleted=False, project__deleted=False, deleted=False,)
         if not has_full_access_scope(request):
-            queryset = queryset.filter(project__team__in=get_teams(request.user))
+            queryset = queryset.filter(project__team__in=get_team_ids(request.user))
 
         return queryset
 
@@ -106,6 +106,17 @@ class SCMPipelineRunRelatedField(PrimaryKeyRelated403Field):
             deleted=False,
         )
         if not has_full_access_scope(request):
-            queryset = queryset.filter(application__project__team__in=get_teams(request.user))
+            queryset = queryset.filter(team__in=get_team_ids(request.user))
 
         return queryset
+
+    def to_internal_value(self, data):
+        # the field is shared by all items of a list, e.g. the steps of a bulk create, which mostly belong to the same
+        # pipeline run, so every pipeline run is only looked up once
+        if not isinstance(data, str):
+            return super().to_internal_value(data)
+
+        pipeline_runs = self.__dict__.setdefault("_pipeline_runs", {})
+        if data not in pipeline_runs:
+            pipeline_runs[data] = super().to_internal_value(data)
+        return pipeline_runs[data]
@@ -1,7 +1,10 @@
 from django.contrib.auth.models import Group
+from django.db.models import Prefetch
 
 from katka.auth import has_full_access_scope
 from katka.constants import BUILD_RESULT_CHOICES, STEP_STATUS_CHOICES
+from katka.counters import update_pipeline_from_bulk_steps
+from katka.instrumentation import timed
 from katka.models import (
     Application,
     ApplicationMetadata,
@@ -27,15 +30,112 @@ from katka.serializer_fields import (
 )
 from rest_framework import serializers
 from rest_framework.exceptions import PermissionDenied
+from rest_framework.permissions import SAFE_METHODS
 
 
 class KatkaSerializer(serializers.ModelSerializer):
-    pass
+    # Relations that have to be loaded to serialize a field, per serializer field name. These are loaded upfront for
+    # all objects in the queryset, to prevent one or more queries per object when serializing a list.
+    select_related_fields = {}
+    prefetch_related_fields = {}
+
+    # Query parameters to only include, or to leave out, a comma separated list of fields in the response of a GET
+    fields_query_param = "fields"
+    omit_query_param = "omit"
+
+    @classmethod
+    def setup_eager_loading(cls, queryset, field_names=None):
+        """
+        Load the relations needed to serialize the fields upfront.
+
+        When 'field_names' is given, only the relations of those fields are loaded and the columns of the other
+        fields are deferred, so large columns are not read from the database when they are not requested.
+        """
+        select_related = [
+            lookup for name, lookup in cls.select_related_fields.items() if field_names is None or name in field_names
+        ]
+        if select_related:
+            queryset = queryset.select_related(*select_related)
+
+        prefetch_related = [
+            lookup for name, lookup in cls.prefetch_related_fields.items() if field_names is None or name in field_names
+        ]
+        if prefetch_related:
+            queryset = queryset.prefetch_related(*prefetch_related)
+
+        if field_names is not None:
+            deferred = [column for name, column in cls._get_model_columns().items() if name not in field_names]
+            if deferred:
+                queryset = queryset.defer(*deferred)
+
+        return queryset
+
+    @classmethod
+    def get_requested_field_names(cls, request):
+        """
+        Return the names of the fields selected with the 'fields' and 'omit' query parameters of a GET request, or None
+        when all fields are requested.
+        """
+        if request is None or request.method not in SAFE_METHODS:
+            return None
+
+        query_params = request.query_params
+        if cls.fields_query_param not in query_params and cls.omit_query_param not in query_params:
+            return None
+
+        field_names = set(cls._get_field_names())
+        if cls.fields_query_param in query_params:
+            field_names &= _split_query_param(query_params, cls.fields_query_param)
+
+        return field_names - _split_query_param(query_params, cls.omit_query_param)
+
+    @classmethod
+    def _get_field_names(cls):
+        field_names = cls.__dict__.get("_field_names")
+        if field_names is None:
+            field_names = cls._field_names = tuple(cls().fields)
+
+        return field_names
+
+    @classmethod
+    def _get_model_columns(cls):
+        """Return the model field per serializer field that can be deferred, i.e. fields with a database column"""
+        model_columns = cls.__dict__.get("_model_columns")
+        if model_columns is None:
+            model = cls.Meta.model
+            columns = {field.name for field in model._meta.concrete_fields if not field.primary_key}
+            model_columns = cls._model_columns = {
+                name: field.source for name, field in cls().fields.items() if field.source in columns
+            }
+
+        return model_columns
+
+    def get_fields(self):
+        fields = super().get_fields()
+
+        # Only the top-level serializer of a response is trimmed, not serializers nested in it
+        root = self.parent.parent if isinstance(self.parent, serializers.ListSerializer) else self.parent
+        if root is None:
+            field_names = self.get_requested_field_names(self.context.get("request"))
+            if field_names is not None:
+                fields = {name: field for name, field in fields.items() if name in field_names}
+
+        return fields
+
+    def to_representation(self, instance):
+        with timed("serializer"):
+            return super().to_representation(instance)
+
+
+def _split_query_param(query_params, name):
+    return {field_name.strip() for value in query_params.getlist(name) for field_name in value.split(",")}
 
 
 class TeamSerializer(KatkaSerializer):
     group = GroupNameField(queryset=Group.objects.all())
 
+    select_related_fields = {"group": "group"}
+
     class Meta:
         model = Team
         fields = ("public_identifier", "slug", "name", "group")
@@ -108,6 +208,14 @@ class SCMRepositorySerializer(KatkaSerializer):
 
 class SCMPipelineRunSerializer(KatkaSerializer):
     application = ApplicationRelatedField()
+    # stored as a PipelineDefinition, so it has to be declared explicitly
+    pipeline_yaml = serializers.CharField(required=False, style={"base_template": "textarea.html"})
+
+    select_related_fields = {"pipeline_yaml": "definition"}
+    # only the primary keys of the releases are serialized, the modified_at is part of the validators of the viewset
+    prefetch_related_fields = {
+        "scmrelease_set": Prefetch("scmrelease_set", queryset=SCMRelease.objects.only("pk", "modified_at"))
+    }
 
     class Meta:
         model = SCMPipelineRun
@@ -126,11 +234,36 @@ class SCMPipelineRunSerializer(KatkaSerializer):
         read_only_fields = ("scmrelease_set",)
 
 
+class SCMStepRunListSerializer(serializers.ListSerializer):
+    def create(self, validated_data):
+        """
+        Insert all steps with a single query and update the counters of their pipelines once.
+
+        Make sure the username is set with username_on_model(SCMStepRun, username) and run this in a transaction.
+        """
+        steps = [SCMStepRun(**attrs) for attrs in validated_data]
+        for step in steps:
+            # bulk_create does not send the pre_save signal that sets the team
+            step.team_id = step.scm_pipeline_run.team_id
+
+        SCMStepRun.objects.bulk_create(steps)
+
+        steps_per_pipeline = {}
+        for step in steps:
+            steps_per_pipeline.setdefault(step.scm_pipeline_run, []).append(step)
+
+        for pipeline, pipeline_steps in steps_per_pipeline.items():
+            update_pipeline_from_bulk_steps(pipeline, pipeline_steps, pipeline_steps[0].modified_username, created=True)
+
+        return steps
+
+
 class SCMStepRunSerializer(KatkaSerializer):
     scm_pipeline_run = SCMPipelineRunRelatedField()
 
     class Meta:
         model = SCMStepRun
+        list_serializer_class = SCMStepRunListSerializer
         fields = (
             "public_identifier",
             "step_type",
@@ -147,6 +280,34 @@ class SCMStepRunSerializer(KatkaSerializer):
         )
 
 
+class SCMStepRunBulkUpdateListSerializer(serializers.ListSerializer):
+    def validate(self, attrs):
+        identifiers = [item["public_identifier"] for item in attrs]
+        if len(set(identifiers)) != len(identifiers):
+            raise serializers.ValidationError("A step can only be updated once per request")
+
+        return attrs
+
+
+class SCMStepRunBulkUpdateSerializer(serializers.Serializer):
+    public_identifier = serializers.UUIDField()
+    status = serializers.ChoiceField(required=False, choices=STEP_STATUS_CHOICES)
+    ended_at = serializers.DateTimeField(required=False, allow_null=True)
+    output = serializers.CharField(required=False, allow_blank=True, trim_whitespace=False)
+
+    class Meta:
+        list_serializer_class = SCMStepRunBulkUpdateListSerializer
+
+
+class SCMStepRunOutputAppendSerializer(serializers.Serializer):
+    data = serializers.CharField(trim_whitespace=False)
+
+
+class SCMStepRunOutputReadSerializer(serializers.Serializer):
+    offset = serializers.IntegerField(min_value=0, default=0)
+    limit = serializers.IntegerField(min_value=1, required=False)
+
+
 class SCMStepRunUpdateSerializer(KatkaSerializer):
     # it seems redundant to declare this field here as it is declared in the model, but in this
     # context it's a required field and in the model it's optional, thus the duplication.
@@ -179,6 +340,11 @@ class SCMStepRunAppendBuildInfoSerializer(KatkaSerializer):
 class SCMReleaseSerializer(KatkaSerializer):
     scm_pipeline_runs = SCMPipelineRunRelatedField(required=False, read_only=True, many=True)
 
+    # only the primary keys of the pipeline runs are serialized
+    prefetch_related_fields = {
+        "scm_pipeline_runs": Prefetch("scm_pipeline_runs", queryset=SCMPipelineRun.objects.only("pk"))
+    }
+
     class Meta:
         model = SCMRelease
         fields = ("public_identifier", "name", "started_at", "ended_at", "scm_pipeline_runs", "status")
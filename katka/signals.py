@@ -1,9 +1,9 @@
 import logging
-from urllib.parse import urljoin
 
-from django.conf import settings
-from django.db.models.signals import post_save
+from django.contrib.auth.models import User
+from django.db.models.signals import m2m_changed, post_delete, post_save, pre_save
 from django.dispatch import receiver
+from django.utils import timezone
 
 from katka.constants import (
     PIPELINE_STATUS_FAILED,
@@ -11,33 +11,80 @@ from katka.constants import (
     PIPELINE_STATUS_INITIALIZING,
     PIPELINE_STATUS_QUEUED,
     PIPELINE_STATUS_SKIPPED,
-    STEP_FINAL_STATUSES,
 )
-from katka.fields import username_on_model
-from katka.models import SCMPipelineRun, SCMStepRun
+from katka.counters import update_pipeline_from_step
+from katka.events import publish_pipeline_run, publish_step_run
+from katka.models import Application, Project, SCMPipelineRun, SCMStepRun, Team
+from katka.notifications import notify_pipeline_runner
 from katka.releases import close_release_if_pipeline_finished, create_release_if_necessary
-from requests import HTTPError
+from katka.utils import invalidate_team_ids
 
 log = logging.getLogger("katka")
 
 
+@receiver(pre_save, sender=SCMPipelineRun)
+def set_pipeline_team(sender, instance, **kwargs):
+    if instance.team_id is None or instance.application_id != getattr(instance, "_loaded_application_id", None):
+        applications = Application.objects.filter(pk=instance.application_id)
+        instance.team_id = applications.values_list("project__team_id", flat=True).first()
+        instance._loaded_application_id = instance.application_id
+        instance._team_changed = True
+
+
+@receiver(post_save, sender=SCMPipelineRun)
+def update_team_of_pipeline_steps(sender, instance, created, **kwargs):
+    """Keep the denormalized team of the steps in sync when the pipeline run moves to another application"""
+    if instance.__dict__.pop("_team_changed", False) and not created:
+        # update() does not set modified_at, which the changes feed relies on
+        SCMStepRun.objects.filter(scm_pipeline_run=instance).exclude(team_id=instance.team_id).update(
+            team_id=instance.team_id, modified_at=timezone.now()
+        )
+
+
+@receiver(pre_save, sender=SCMPipelineRun)
+def set_pipeline_definition(sender, instance, **kwargs):
+    instance.store_pipeline_definition()
+
+
+@receiver(pre_save, sender=SCMStepRun)
+def set_step_team(sender, instance, **kwargs):
+    loaded_state = getattr(instance, "_loaded_counter_state", None)
+    if instance.team_id is None or loaded_state is None or loaded_state[0] != instance.scm_pipeline_run_id:
+        instance.team_id = instance.scm_pipeline_run.team_id
+
+
+@receiver(post_save, sender=Application)
+def update_team_of_application_runs(sender, instance, created, **kwargs):
+    """Keep the denormalized team of the pipeline and step runs in sync when an application moves to another project"""
+    if not created and instance.project_id != getattr(instance, "_loaded_project_id", None):
+        _update_team_of_runs(instance.project.team_id, application=instance)
+    instance._loaded_project_id = instance.project_id
+
+
+@receiver(post_save, sender=Project)
+def update_team_of_project_runs(sender, instance, created, **kwargs):
+    """Keep the denormalized team of the pipeline and step runs in sync when a project moves to another team"""
+    if not created and instance.team_id != getattr(instance, "_loaded_team_id", None):
+        _update_team_of_runs(instance.team_id, application__project=instance)
+    instance._loaded_team_id = instance.team_id
+
+
+def _update_team_of_runs(team_id, **application_lookup):
+    # update() does not set modified_at, which the changes feed relies on
+    now = timezone.now()
+    SCMPipelineRun.objects.filter(**application_lookup).exclude(team_id=team_id).update(
+        team_id=team_id, modified_at=now
+    )
+    step_lookup = {f"scm_pipeline_run__{lookup}": value for lookup, value in application_lookup.items()}
+    SCMStepRun.objects.filter(**step_lookup).exclude(team_id=team_id).update(team_id=team_id, modified_at=now)
+
+
 @receiver(post_save, sender=SCMStepRun)
 def update_pipeline_from_steps(sender, **kwargs):
     """
     Update the pipeline 'steps_completed' and 'steps_total' in case they changed whenever a step is updated/added
     """
-    pipeline = kwargs["instance"].scm_pipeline_run
-    pipeline_steps = SCMStepRun.objects.filter(scm_pipeline_run=pipeline)
-
-    before_steps_total = pipeline.steps_total
-    before_steps_completed = pipeline.steps_completed
-
-    pipeline.steps_total = pipeline_steps.count()
-    pipeline.steps_completed = pipeline_steps.filter(status__in=STEP_FINAL_STATUSES).count()
-
-    if pipeline.steps_completed != before_steps_completed or pipeline.steps_total != before_steps_total:
-        with username_on_model(SCMPipelineRun, kwargs["instance"].modified_username):
-            pipeline.save()
+    update_pipeline_from_step(kwargs["instance"], created=kwargs["created"])
 
 
 @receiver(post_save, sender=SCMPipelineRun)
@@ -56,14 +103,17 @@ def send_pipeline_change_notification(sender, **kwargs):
         # being run, do not notify.
         return
 
-    session = settings.PIPELINE_RUNNER_SESSION
-    url = urljoin(settings.PIPELINE_RUNNER_BASE_URL, settings.PIPELINE_CHANGE_NOTIFICATION_EP)
-    response = session.post(url, json={"public_identifier": str(pipeline.public_identifier)})
+    notify_pipeline_runner(pipeline)
+
 
-    try:
-        response.raise_for_status()
-    except HTTPError:
-        log.exception("Failed to notify pipeline runner")
+@receiver(post_save, sender=SCMPipelineRun)
+def publish_pipeline_event(sender, instance, **kwargs):
+    publish_pipeline_run(instance)
+
+
+@receiver(post_save, sender=SCMStepRun)
+def publish_step_event(sender, instance, **kwargs):
+    publish_step_run(instance)
 
 
 @receiver(post_save, sender=SCMPipelineRun)
@@ -83,3 +133,24 @@ def create_close_releases(sender, **kwargs):
         create_release_if_necessary(pipeline)
     else:
         close_release_if_pipeline_finished(pipeline)
+
+
+@receiver(post_save, sender=Team)
+@receiver(post_delete, sender=Team)
+def invalidate_team_ids_on_team_change(sender, **kwargs):
+    # The group of the team may have changed, which affects all members of the old and new group
+    invalidate_team_ids()
+
+
+@receiver(m2m_changed, sender=Team.sys_users.through)
+@receiver(m2m_changed, sender=User.groups.through)
+def invalidate_team_ids_on_membership_change(sender, instance, action, reverse, pk_set, **kwargs):
+    if action not in ("post_add", "post_remove", "post_clear"):
+        return
+
+    if isinstance(instance, User):
+        invalidate_team_ids([instance])
+    elif pk_set:
+        invalidate_team_ids(pk_set)
+    else:
+        invalidate_team_ids()  # members were cleared, so it is unknown which users were affected
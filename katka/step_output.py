@@ -0,0 +1,78 @@
+import zlib
+
+from django.conf import settings
+from django.db import transaction
+
+from katka.models import SCMStepRun, SCMStepRunOutputChunk
+
+
+def append_output(step, text):
+    """
+    Append 'text' to the chunked output of the step and return the new chunk.
+
+    Only the last chunk is looked up, so appending does not get slower as the output grows. With the
+    STEP_OUTPUT_COMPRESSION setting enabled, chunks of at least STEP_OUTPUT_COMPRESSION_MIN_SIZE bytes are compressed
+    with zlib when that makes them smaller.
+    """
+    data, compressed = _encode(text)
+
+    with transaction.atomic():
+        # Lock the step, so concurrent appends get consecutive sequence numbers and offsets
+        SCMStepRun.objects.select_for_update().only("pk").get(pk=step.pk)
+        last_chunk = step.output_chunks.order_by("-sequence").values_list("sequence", "end_offset").first()
+        sequence, offset = (last_chunk[0] + 1, last_chunk[1]) if last_chunk else (0, 0)
+
+        return SCMStepRunOutputChunk.objects.create(
+            scm_step_run=step,
+            sequence=sequence,
+            offset=offset,
+            end_offset=offset + len(text),
+            compressed=compressed,
+            data=data,
+        )
+
+
+def read_output(step, offset=0, limit=None):
+    """
+    Return the output of the step from 'offset' on, at most 'limit' characters, and the offset to continue reading from.
+
+    Only the chunks that end after 'offset' are loaded, so clients can follow the output of a running step by passing
+    the returned offset on the next read.
+    """
+    chunks = step.output_chunks.filter(end_offset__gt=offset).order_by("sequence")
+    parts = []
+    length = 0
+    for chunk_offset, compressed, data in chunks.values_list("offset", "compressed", "data").iterator():
+        text = _decode(data, compressed)[max(offset - chunk_offset, 0) :]
+        if limit is not None:
+            text = text[: limit - length]
+
+        parts.append(text)
+        length += len(text)
+        if limit is not None and length >= limit:
+            break
+
+    return "".join(parts), offset + length
+
+
+def _encode(text):
+    data = text.encode()
+    if not getattr(settings, "STEP_OUTPUT_COMPRESSION", False):
+        return data, False
+
+    if len(data) < getattr(settings, "STEP_OUTPUT_COMPRESSION_MIN_SIZE", 1024):
+        return data, False
+
+    compressed_data = zlib.compress(data)
+    if len(compressed_data) >= len(data):
+        return data, False
+
+    return compressed_data, True
+
+
+def _decode(data, compressed):
+    data = bytes(data)  # some database backends return a memoryview
+    if compressed:
+        data = zlib.decompress(data)
+
+    return data.decode()
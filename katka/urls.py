@@ -19,6 +19,8 @@ router.register("scm-pipeline-runs", views.SCMPipelineRunViewSet, basename="scm-
 router.register("queued-scm-pipeline-runs", views.QueuedSCMPipelineRunViewSet, basename="queued-scm-pipeline-runs")
 router.register("scm-step-runs", views.SCMStepRunViewSet, basename="scm-step-runs")
 router.register("scm-releases", views.SCMReleaseViewSet, basename="scm-releases")
+router.register("events", views.EventStreamViewSet, basename="events")
+router.register("metrics", views.MetricsViewSet, basename="metrics")
 router.register("update-scm-step-run", views.SCMStepRunUpdateStatusView, basename="update-scm-step-run")
 router.register(
     "append-build-info-scm-step-run", views.SCMStepRunAppendBuildInfoView, basename="append-build-info-scm-step-run"
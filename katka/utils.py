@@ -1,9 +1,72 @@
+from django.conf import settings
+from django.core.cache import cache
 from django.db.models import Q
 
 from katka.models import Team
 
+TEAM_IDS_GENERATION_CACHE_KEY = "katka:team-ids:generation"
+
 
 def get_teams(user):
     # Only show teams that are linked to a group that the user is part of
     # or that is connected directly to the team as a system user
-    return Team.objects.filter(Q(group__in=user.groups.all()) | Q(sys_users=user))
+    return Team.objects.filter(pk__in=get_team_ids(user))
+
+
+def get_team_ids(user):
+    """
+    Return a list with the primary keys of the teams of the user.
+
+    The list is memoized on the user object, which lives as long as the request. When the TEAMS_CACHE_TIMEOUT setting
+    is set, the list is also kept in the Django cache for that many seconds. The signal handlers in katka.signals
+    invalidate the cache whenever teams or memberships change.
+    """
+    team_ids = getattr(user, "_katka_team_ids", None)
+    if team_ids is not None:
+        return team_ids
+
+    if user.is_anonymous:
+        return []
+
+    timeout = getattr(settings, "TEAMS_CACHE_TIMEOUT", None)
+    cache_key = _team_ids_cache_key(user.pk) if timeout else None
+    if cache_key:
+        team_ids = cache.get(cache_key)
+
+    if team_ids is None:
+        teams = Team.objects.filter(Q(group__in=user.groups.all()) | Q(sys_users=user))
+        team_ids = list(teams.order_by().distinct().values_list("pk", flat=True))
+        if cache_key:
+            cache.set(cache_key, team_ids, timeout)
+
+    user._katka_team_ids = team_ids
+    return team_ids
+
+
+def invalidate_team_ids(users=None):
+    """
+    Invalidate the cached teams of the given users, or of all users when no users are given.
+
+    Users can be passed as user objects or primary keys; the memoized teams are cleared as well for user objects.
+    """
+    if users is not None:
+        for user in users:
+            if hasattr(user, "_katka_team_ids"):
+                del user._katka_team_ids
+
+    if not getattr(settings, "TEAMS_CACHE_TIMEOUT", None):
+        return
+
+    if users is None:
+        try:
+            cache.incr(TEAM_IDS_GENERATION_CACHE_KEY)
+        except ValueError:
+            cache.set(TEAM_IDS_GENERATION_CACHE_KEY, 1, None)
+        return
+
+    cache.delete_many([_team_ids_cache_key(getattr(user, "pk", user)) for user in users])
+
+
+def _team_ids_cache_key(user_pk):
+    generation = cache.get(TEAM_IDS_GENERATION_CACHE_KEY, 0)
+    return f"katka:team-ids:{generation}:{user_pk}"
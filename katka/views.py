@@ -1,10 +1,12 @@
 import json
 import logging
-from urllib.parse import urljoin
 
 from django.conf import settings
-from django.db import IntegrityError
+from django.db import IntegrityError, transaction
+from django.http import StreamingHttpResponse
+from django.utils import timezone
 
+from katka.auth import AuthType
 from katka.constants import (
     PIPELINE_FINAL_STATUSES,
     PIPELINE_STATUS_IN_PROGRESS,
@@ -12,7 +14,11 @@ from katka.constants import (
     PIPELINE_STATUS_QUEUED,
     PIPELINE_STATUS_SKIPPED,
 )
+from katka.counters import update_pipeline_from_bulk_steps
+from katka.events import EventStream, get_broker, publish_step_run
 from katka.exceptions import AlreadyExists, OutputNotValidError, ParentCommitMissing, PipelineRunnerError
+from katka.fields import username_on_model
+from katka.instrumentation import get_sink
 from katka.models import (
     Application,
     ApplicationMetadata,
@@ -26,6 +32,9 @@ from katka.models import (
     SCMStepRun,
     Team,
 )
+from katka.pagination import KeysetCursorPagination
+from katka.releases import close_release_if_pipeline_finished
+from katka.runner import get_client as get_runner_client, render_prometheus as render_runner_metrics
 from katka.serializers import (
     ApplicationMetadataSerializer,
     ApplicationSerializer,
@@ -37,13 +46,30 @@ from katka.serializers import (
     SCMRepositorySerializer,
     SCMServiceSerializer,
     SCMStepRunAppendBuildInfoSerializer,
+    SCMStepRunBulkUpdateSerializer,
+    SCMStepRunOutputAppendSerializer,
+    SCMStepRunOutputReadSerializer,
     SCMStepRunSerializer,
     SCMStepRunUpdateSerializer,
     TeamSerializer,
 )
-from katka.utils import get_teams
-from katka.viewsets import AuditViewSet, FilterViewMixin, ReadOnlyAuditMixin, UpdateAuditMixin
+from katka.step_output import append_output, read_output
+from katka.utils import get_team_ids, get_teams
+from katka.viewsets import (
+    AuditViewSet,
+    ChangesFeedMixin,
+    ConditionalGetMixin,
+    FilterViewMixin,
+    ReadOnlyAuditMixin,
+    UpdateAuditMixin,
+    UserOrScopeViewSet,
+)
 from requests import HTTPError
+from rest_framework import status
+from rest_framework.decorators import action
+from rest_framework.exceptions import NotFound
+from rest_framework.renderers import BaseRenderer, JSONRenderer
+from rest_framework.response import Response
 
 log = logging.getLogger(__name__)
 
@@ -64,7 +90,7 @@ class ProjectViewSet(FilterViewMixin, AuditViewSet):
     serializer_class = ProjectSerializer
 
     def get_user_restricted_queryset(self, queryset):
-        user_teams = get_teams(self.request.user)
+        user_teams = get_team_ids(self.request.user)
         return queryset.filter(team__in=user_teams)
 
 
@@ -73,7 +99,7 @@ class ApplicationViewSet(FilterViewMixin, AuditViewSet):
     serializer_class = ApplicationSerializer
 
     def get_user_restricted_queryset(self, queryset):
-        user_teams = get_teams(self.request.user)
+        user_teams = get_team_ids(self.request.user)
         return queryset.filter(project__team__in=user_teams)
 
 
@@ -82,7 +108,7 @@ class CredentialViewSet(FilterViewMixin, AuditViewSet):
     serializer_class = CredentialSerializer
 
     def get_user_restricted_queryset(self, queryset):
-        user_teams = get_teams(self.request.user)
+        user_teams = get_team_ids(self.request.user)
         return queryset.filter(team__in=user_teams)
 
 
@@ -100,7 +126,7 @@ class CredentialSecretsViewSet(AuditViewSet):
         return super().get_queryset().filter(**kwargs)
 
     def get_user_restricted_queryset(self, queryset):
-        user_teams = get_teams(self.request.user)
+        user_teams = get_team_ids(self.request.user)
         return queryset.filter(credential__team__in=user_teams)
 
 
@@ -117,13 +143,16 @@ class SCMRepositoryViewSet(FilterViewMixin, AuditViewSet):
     serializer_class = SCMRepositorySerializer
 
     def get_user_restricted_queryset(self, queryset):
-        user_teams = get_teams(self.request.user)
+        user_teams = get_team_ids(self.request.user)
         return queryset.filter(credential__team__in=user_teams)
 
 
-class SCMPipelineRunViewSet(FilterViewMixin, AuditViewSet):
+class SCMPipelineRunViewSet(ConditionalGetMixin, ChangesFeedMixin, FilterViewMixin, AuditViewSet):
     model = SCMPipelineRun
     serializer_class = SCMPipelineRunSerializer
+    pagination_class = KeysetCursorPagination
+    # the releases are serialized, adding a pipeline run to a release does not change the pipeline run
+    conditional_related = "scmrelease"
 
     parameter_lookup_map = {
         "scmrelease": "scmrelease",
@@ -215,28 +244,167 @@ class SCMPipelineRunViewSet(FilterViewMixin, AuditViewSet):
         next_pipeline.save()
 
     def get_user_restricted_queryset(self, queryset):
-        user_teams = get_teams(self.request.user)
-        return queryset.filter(application__project__team__in=user_teams)
+        user_teams = get_team_ids(self.request.user)
+        return queryset.filter(team__in=user_teams)
 
 
-class QueuedSCMPipelineRunViewSet(FilterViewMixin, ReadOnlyAuditMixin):
+class QueuedSCMPipelineRunViewSet(ConditionalGetMixin, FilterViewMixin, ReadOnlyAuditMixin):
     model = SCMPipelineRun
     serializer_class = SCMPipelineRunSerializer
+    pagination_class = KeysetCursorPagination
 
     def get_user_restricted_queryset(self, queryset):
-        user_teams = get_teams(self.request.user)
-        return queryset.filter(
-            application__project__team__in=user_teams, status=PIPELINE_STATUS_QUEUED, scmrelease__isnull=True
-        )
+        user_teams = get_team_ids(self.request.user)
+        return queryset.filter(team__in=user_teams, status=PIPELINE_STATUS_QUEUED, scmrelease__isnull=True)
 
 
-class SCMStepRunViewSet(FilterViewMixin, AuditViewSet):
+class SCMStepRunViewSet(ConditionalGetMixin, ChangesFeedMixin, FilterViewMixin, AuditViewSet):
     model = SCMStepRun
     serializer_class = SCMStepRunSerializer
+    pagination_class = KeysetCursorPagination
 
     def get_user_restricted_queryset(self, queryset):
-        user_teams = get_teams(self.request.user)
-        return queryset.filter(scm_pipeline_run__application__project__team__in=user_teams)
+        user_teams = get_team_ids(self.request.user)
+        return queryset.filter(team__in=user_teams)
+
+    @action(detail=False, methods=["post"], url_path="bulk")
+    def bulk_create(self, request):
+        """Create a list of steps at once, e.g. all steps of a pipeline that is initializing"""
+        serializer = self.get_serializer(data=request.data, many=True)
+        serializer.is_valid(raise_exception=True)
+
+        with username_on_model(self.model, request.katka_user_identifier), transaction.atomic():
+            steps = serializer.save()
+            for step in steps:
+                # bulk_create does not send the post_save signal that publishes the event
+                publish_step_run(step)
+
+        return Response(serializer.data, status=status.HTTP_201_CREATED)
+
+    @bulk_create.mapping.patch
+    def bulk_update(self, request):
+        """Update the status, end date and output of a list of steps at once, e.g. the steps of parallel stages"""
+        serializer = SCMStepRunBulkUpdateSerializer(data=request.data, many=True)
+        serializer.is_valid(raise_exception=True)
+        updates = {attrs.pop("public_identifier"): attrs for attrs in serializer.validated_data}
+
+        with transaction.atomic():
+            # lock the steps in a consistent order, so concurrent bulk updates of the same steps do not deadlock and
+            # the step counters are adjusted based on the stored statuses. Only the steps are locked: a step update
+            # locks its step before updating the counters of the pipeline run, like this bulk update.
+            steps = self.get_queryset().select_related("scm_pipeline_run").filter(pk__in=updates)
+            steps = list(steps.select_for_update(of=("self",)).order_by("pk"))
+            missing = set(updates) - {step.pk for step in steps}
+            if missing:
+                raise NotFound(f"Step run(s) not found: {', '.join(sorted(str(pk) for pk in missing))}")
+
+            self._bulk_update_steps(steps, updates, request.katka_user_identifier)
+
+        return Response(self.get_serializer(steps, many=True).data)
+
+    @action(detail=True, methods=["get", "post"], url_path="output")
+    def output_chunks(self, request, pk=None):
+        """
+        Read the chunked output of the step from an offset on (GET), or append a chunk to it (POST).
+
+        The response of both contains the 'next_offset' to read the output from next.
+        """
+        step = self.get_object()
+        if request.method == "POST":
+            serializer = SCMStepRunOutputAppendSerializer(data=request.data)
+            serializer.is_valid(raise_exception=True)
+            chunk = append_output(step, serializer.validated_data["data"])
+            data = {"sequence": chunk.sequence, "offset": chunk.offset, "next_offset": chunk.end_offset}
+            return Response(data, status=status.HTTP_201_CREATED)
+
+        serializer = SCMStepRunOutputReadSerializer(data=request.query_params)
+        serializer.is_valid(raise_exception=True)
+        offset = serializer.validated_data["offset"]
+        max_limit = getattr(settings, "STEP_OUTPUT_READ_LIMIT", 1000000)
+        limit = min(serializer.validated_data.get("limit", max_limit), max_limit)
+        output, next_offset = read_output(step, offset=offset, limit=limit)
+        return Response({"offset": offset, "next_offset": next_offset, "data": output})
+
+    def _bulk_update_steps(self, steps, updates, username):
+        now = timezone.now()
+        fields = {"modified_at", "modified_username"}
+        for step in steps:
+            for field, value in updates[step.pk].items():
+                setattr(step, field, value)
+                fields.add(field)
+
+            # bulk_update does not set the audit fields
+            step.modified_at = now
+            step.modified_username = username
+
+        self.model.objects.bulk_update(steps, fields)
+        for step in steps:
+            # bulk_update does not send the post_save signal that publishes the event
+            publish_step_run(step)
+
+        steps_per_pipeline = {}
+        for step in steps:
+            steps_per_pipeline.setdefault(step.scm_pipeline_run_id, []).append(step)
+
+        for pipeline_steps in steps_per_pipeline.values():
+            pipeline = pipeline_steps[0].scm_pipeline_run
+            if not update_pipeline_from_bulk_steps(pipeline, pipeline_steps, username, created=False):
+                # The pipeline was not saved, so its post_save receivers did not check whether the release is finished
+                close_release_if_pipeline_finished(pipeline)
+
+
+class EventStreamRenderer(BaseRenderer):
+    media_type = "text/event-stream"
+    format = "event-stream"
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        # only used for error responses, the events are streamed
+        return json.dumps(data).encode()
+
+
+class EventStreamViewSet(UserOrScopeViewSet):
+    """
+    Streams the changes of the pipeline and step runs of the teams of the user, as server-sent events
+
+    Every connection holds a worker for as long as it is open, see EVENTS_STREAM_TIMEOUT.
+    """
+
+    renderer_classes = [EventStreamRenderer, JSONRenderer]
+
+    def list(self, request):
+        team_ids = None if request.katka_auth_type is AuthType.SCOPES else get_team_ids(request.user)
+        response = StreamingHttpResponse(
+            EventStream(get_broker().subscribe(team_ids)), content_type="text/event-stream"
+        )
+        response["Cache-Control"] = "no-cache"
+        response["X-Accel-Buffering"] = "no"  # prevent nginx from buffering the events
+        return response
+
+
+class PrometheusRenderer(BaseRenderer):
+    media_type = "text/plain"
+    format = "prometheus"
+    charset = "utf-8"
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if isinstance(data, str):
+            return data.encode()
+
+        return json.dumps(data).encode()  # error responses
+
+
+class MetricsViewSet(UserOrScopeViewSet):
+    """The metrics of the InstrumentationMiddleware and the pipeline runner client, in the Prometheus text format"""
+
+    renderer_classes = [PrometheusRenderer, JSONRenderer]
+
+    def list(self, request):
+        sink = get_sink()
+        if not hasattr(sink, "render"):
+            raise NotFound("The INSTRUMENTATION_SINK does not render metrics")
+
+        metrics = sink.render() + render_runner_metrics(get_runner_client().metrics())
+        return Response(metrics, content_type="text/plain; version=0.0.4; charset=utf-8")
 
 
 class SCMStepRunUpdateStatusView(UpdateAuditMixin):
@@ -255,9 +423,7 @@ class SCMStepRunUpdateStatusView(UpdateAuditMixin):
                 "status": serializer.validated_data["status"],
             },
         }
-        session = settings.PIPELINE_RUNNER_SESSION
-        url = urljoin(settings.PIPELINE_RUNNER_BASE_URL, settings.PIPELINE_UPDATE_STEP_EP)
-        response = session.post(url, json=data)
+        response = get_runner_client().post(settings.PIPELINE_UPDATE_STEP_EP, json=data)
 
         try:
             response.raise_for_status()
@@ -267,7 +433,7 @@ class SCMStepRunUpdateStatusView(UpdateAuditMixin):
 
     def get_user_restricted_queryset(self, queryset):
         user_groups = self.request.user.groups.all()
-        return queryset.filter(scm_pipeline_run__application__project__team__group__in=user_groups)
+        return queryset.filter(team__group__in=user_groups)
 
 
 class SCMStepRunAppendBuildInfoView(UpdateAuditMixin):
@@ -306,9 +472,7 @@ class SCMStepRunAppendBuildInfoView(UpdateAuditMixin):
     def call_endpoint(self, serializer):
 
         data = self._build_data_params(serializer)
-        session = settings.PIPELINE_RUNNER_SESSION
-        url = urljoin(settings.PIPELINE_RUNNER_BASE_URL, settings.PIPELINE_UPDATE_STEP_EP)
-        response = session.post(url, json=data)
+        response = get_runner_client().post(settings.PIPELINE_UPDATE_STEP_EP, json=data)
 
         try:
             response.raise_for_status()
@@ -317,18 +481,19 @@ class SCMStepRunAppendBuildInfoView(UpdateAuditMixin):
             raise PipelineRunnerError
 
     def get_user_restricted_queryset(self, queryset):
-        user_teams = get_teams(self.request.user)
-        return queryset.filter(scm_pipeline_run__application__project__team__in=user_teams)
+        user_teams = get_team_ids(self.request.user)
+        return queryset.filter(team__in=user_teams)
 
 
-class SCMReleaseViewSet(FilterViewMixin, ReadOnlyAuditMixin):
+class SCMReleaseViewSet(ChangesFeedMixin, FilterViewMixin, ReadOnlyAuditMixin):
     model = SCMRelease
     serializer_class = SCMReleaseSerializer
+    pagination_class = KeysetCursorPagination
 
     parameter_lookup_map = {"application": "scm_pipeline_runs__application", "pipeline_run": "scm_pipeline_runs"}
 
     def get_user_restricted_queryset(self, queryset):
-        user_teams = get_teams(self.request.user)
+        user_teams = get_team_ids(self.request.user)
         # Do select distinct because of the many to many relationship
         return queryset.distinct().filter(scm_pipeline_runs__application__project__team__in=user_teams)
 
@@ -349,5 +514,5 @@ class ApplicationMetadataViewSet(AuditViewSet):
         return super().get_queryset().filter(**kwargs)
 
     def get_user_restricted_queryset(self, queryset):
-        user_teams = get_teams(self.request.user)
+        user_teams = get_team_ids(self.request.user)
         return queryset.filter(application__project__team__in=user_teams)
@@ -1,7 +1,19 @@
+import hashlib
+from dataclasses import dataclass
+
+from django.core.exceptions import ValidationError as DjangoValidationError
+from django.db.models import BooleanField, Count, Field, Max
+from django.db.models.constants import LOOKUP_SEP
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date, quote_etag
+
 from katka.auth import AuthType, has_full_access_scope
 from katka.fields import username_on_model
+from katka.pagination import ChangesCursorPagination
+from katka.query_detector import detect_queries, query_detector_enabled
 from rest_framework import mixins, status
-from rest_framework.exceptions import PermissionDenied
+from rest_framework.decorators import action
+from rest_framework.exceptions import NotFound, PermissionDenied, ValidationError
 from rest_framework.response import Response
 from rest_framework.viewsets import GenericViewSet
 
@@ -11,6 +23,13 @@ from .permissions import HasFullScope, IsGroupAuthenticated
 class UserOrScopeViewSet(GenericViewSet):
     permission_classes = [IsGroupAuthenticated | HasFullScope]
 
+    def dispatch(self, request, *args, **kwargs):
+        if not query_detector_enabled():
+            return super().dispatch(request, *args, **kwargs)
+
+        with detect_queries(self):
+            return super().dispatch(request, *args, **kwargs)
+
     def perform_authentication(self, request):
         super().perform_authentication(request)
         auth_type = AuthType.ANONYMOUS
@@ -42,9 +61,21 @@ class UserOrScopeViewSet(GenericViewSet):
 
 class ReadOnlyAuditMixin(mixins.RetrieveModelMixin, mixins.ListModelMixin, UserOrScopeViewSet):
     model = None
+    include_deleted = False  # only enabled for the routes that return tombstones, like ChangesFeedMixin.changes
 
     def get_queryset(self):
-        return super().get_queryset().exclude(deleted=True)
+        queryset = super().get_queryset()
+        if not self.include_deleted:
+            # Filter rather than exclude, so the condition matches the partial indexes on deleted=False
+            queryset = queryset.filter(deleted=False)
+
+        # Load the relations the serializer needs upfront, to prevent a query per object
+        serializer_class = self.get_serializer_class()
+        if hasattr(serializer_class, "setup_eager_loading"):
+            field_names = serializer_class.get_requested_field_names(self.request)
+            queryset = serializer_class.setup_eager_loading(queryset, field_names=field_names)
+
+        return queryset
 
 
 class UpdateAuditMixin(mixins.UpdateModelMixin, UserOrScopeViewSet):
@@ -76,36 +107,259 @@ class AuditViewSet(CreateAuditMixin, UpdateAuditMixin, DestroyAuditMixin, ReadOn
     pass
 
 
+class ConditionalGetMixin:
+    """
+    Adds ETag and Last-Modified headers to list and detail responses, and answers conditional requests
+    (If-None-Match, If-Modified-Since) with 304 Not Modified before anything is serialized
+
+    The validators are derived from the modified_at and the number of the objects. A conditional request is checked
+    with a single MAX(modified_at)/COUNT query, other requests use the objects that are loaded anyway. Pages are
+    always checked against the loaded page, which is a limited query. Changes to related objects do not change the
+    validators, except for the objects of the 'conditional_related' relation: their modified_at and number are
+    included. When the objects are loaded anyway, the related objects are taken from the prefetched objects, or
+    otherwise aggregated with one more query.
+    """
+
+    # A many-to-many relation whose objects are part of the representation, e.g. "scmrelease"
+    conditional_related = None
+
+    def list(self, request, *args, **kwargs):
+        queryset = self.filter_queryset(self.get_queryset())
+
+        page = self.paginate_queryset(queryset)
+        if page is not None:
+            # the links to the other pages are part of the representation too
+            links = (self.paginator.get_next_link(), self.paginator.get_previous_link())
+            validators = self._get_validators(request, *self._summarize(page), *links)
+            return self._conditional_response(
+                request, validators, lambda: self.get_paginated_response(self.get_serializer(page, many=True).data)
+            )
+
+        objects = None
+        if _is_conditional(request):
+            validators = self._get_validators(request, *self._aggregate_summary(queryset))
+        else:
+            objects = list(queryset)
+            validators = self._get_validators(request, *self._summarize(objects))
+
+        return self._conditional_response(
+            request,
+            validators,
+            lambda: Response(self.get_serializer(queryset if objects is None else objects, many=True).data),
+        )
+
+    def retrieve(self, request, *args, **kwargs):
+        if _is_conditional(request):
+            lookup_url_kwarg = self.lookup_url_kwarg or self.lookup_field
+            queryset = self.filter_queryset(self.get_queryset())
+            try:
+                summary = self._aggregate_summary(queryset.filter(**{self.lookup_field: self.kwargs[lookup_url_kwarg]}))
+            except (DjangoValidationError, TypeError, ValueError):
+                summary = None  # the regular 404 response follows
+
+            if summary is not None and summary[1]:
+                validators = self._get_validators(request, *summary)
+                response = get_conditional_response(request, etag=validators[0], last_modified=validators[1])
+                if response is not None:
+                    return self._set_validators(response, validators)
+
+        instance = self.get_object()
+        validators = self._get_validators(request, *self._summarize([instance]))
+        return self._conditional_response(request, validators, lambda: Response(self.get_serializer(instance).data))
+
+    def _aggregate_summary(self, queryset):
+        """Return the (last modified_at, count, ...) of the objects of the queryset with a single aggregate query"""
+        if self.conditional_related is None:
+            summary = queryset.aggregate(last_modified=Max("modified_at"), count=Count("pk"))
+            return summary["last_modified"], summary["count"]
+
+        summary = queryset.aggregate(
+            last_modified=Max("modified_at"), count=Count("pk", distinct=True), **self._related_aggregates()
+        )
+        return (
+            _latest(summary["last_modified"], summary["related_last_modified"]),
+            summary["count"],
+            summary["related_count"],
+        )
+
+    def _summarize(self, objects):
+        """Return the same as _aggregate_summary() for the loaded objects"""
+        last_modified = max((obj.modified_at for obj in objects), default=None)
+        if self.conditional_related is None:
+            return last_modified, len(objects)
+
+        related = self._get_prefetched_related(objects)
+        if related is None:
+            summary = self.model.objects.filter(pk__in=[obj.pk for obj in objects]).aggregate(
+                **self._related_aggregates()
+            )
+            related_last_modified, related_count = summary["related_last_modified"], summary["related_count"]
+        else:
+            related_last_modified = max((obj.modified_at for obj in related), default=None)
+            related_count = len({obj.pk for obj in related})
+
+        return _latest(last_modified, related_last_modified), len(objects), related_count
+
+    def _get_prefetched_related(self, objects):
+        """Return the related objects when they were prefetched with their modified_at, otherwise None"""
+        related = []
+        for obj in objects:
+            # many-to-many relations are prefetched by their lookup name
+            prefetched = getattr(obj, "_prefetched_objects_cache", {}).get(self.conditional_related)
+            if prefetched is None:
+                return None
+            related.extend(prefetched)
+
+        if any("modified_at" in obj.get_deferred_fields() for obj in related):
+            return None
+        return related
+
+    def _related_aggregates(self):
+        return {
+            "related_last_modified": Max(f"{self.conditional_related}{LOOKUP_SEP}modified_at"),
+            "related_count": Count(self.conditional_related, distinct=True),
+        }
+
+    def _get_validators(self, request, last_modified, count, *extra):
+        """Return the (etag, last_modified timestamp) of the representation"""
+        # The representation also depends on the query parameters (filters, fields) and the requested format
+        key = [request.get_full_path(), request.accepted_media_type, count, last_modified, *extra]
+        etag = quote_etag(hashlib.sha1(repr(key).encode()).hexdigest())
+        return etag, int(last_modified.timestamp()) if last_modified is not None else None
+
+    def _conditional_response(self, request, validators, get_response):
+        response = get_conditional_response(request, etag=validators[0], last_modified=validators[1])
+        if response is None:
+            response = get_response()
+
+        return self._set_validators(response, validators)
+
+    @staticmethod
+    def _set_validators(response, validators):
+        etag, last_modified = validators
+        response["ETag"] = etag
+        if last_modified is not None:
+            response["Last-Modified"] = http_date(last_modified)
+
+        return response
+
+
+def _is_conditional(request):
+    return "HTTP_IF_NONE_MATCH" in request.META or "HTTP_IF_MODIFIED_SINCE" in request.META
+
+
+def _latest(*dates):
+    return max((date for date in dates if date is not None), default=None)
+
+
+class ChangesFeedMixin:
+    """
+    Adds a 'changes' route, that returns the objects modified after a cursor, oldest first
+
+    Deleted objects are included with "deleted": true, so clients can keep a local copy up to date incrementally
+    instead of downloading the complete list again. See ChangesCursorPagination for the cursor.
+    """
+
+    @action(detail=False, methods=["get"], url_path="changes", include_deleted=True)
+    def changes(self, request):
+        paginator = ChangesCursorPagination()
+        page = paginator.paginate_queryset(self.filter_queryset(self.get_queryset()), request, view=self)
+        data = self.get_serializer(page, many=True).data
+        for obj, representation in zip(page, data):
+            representation["deleted"] = obj.deleted
+
+        return paginator.get_paginated_response(data)
+
+
+@dataclass(frozen=True)
+class FilterLookup:
+    lookup: str
+    field: Field  # the field to convert query parameter values with
+    many: bool  # whether the lookup follows a multi-valued relation, which can duplicate rows
+
+    def to_python(self, value):
+        if isinstance(self.field, BooleanField):
+            value = BOOLEAN_QUERY_VALUES.get(value.lower(), value)
+
+        return self.field.to_python(value)
+
+
+BOOLEAN_QUERY_VALUES = {"true": True, "false": False}
+
+
+def resolve_filter_lookup(model, lookup):
+    many = False
+    field = None
+    for name in lookup.split(LOOKUP_SEP):
+        field = model._meta.get_field(name)
+        if field.is_relation:
+            many = many or field.many_to_many or field.one_to_many
+            model = field.related_model
+
+    # filtering on a relation compares the primary key of the related model
+    return FilterLookup(lookup, model._meta.pk if field.is_relation else field, many)
+
+
 class FilterViewMixin:
     parameter_lookup_map = None
 
     """
     Uses the Serializer fields to construct GET Parameter filtering
+
+    Every model field can be filtered on with '?field=value', or on a list of values with '?field__in=value1,value2'.
+    The values are converted with the model field, invalid values result in a 400 response.
     """
 
+    @classmethod
+    def get_filter_map(cls):
+        """Return the FilterLookup per query parameter, which is only computed once per viewset class"""
+        filter_map = cls.__dict__.get("_filter_map")
+        if filter_map is None:
+            # Allow filtering on any field of the model, and also support a mapping from query parameter to django
+            # query field. The order of the keys is the order in which the filters are applied.
+            lookups = {field.name: field.name for field in cls.model._meta.get_fields()}
+            lookups.update(cls.parameter_lookup_map or {})
+            filter_map = {
+                query_param: resolve_filter_lookup(cls.model, lookup) for query_param, lookup in lookups.items()
+            }
+            cls._filter_map = filter_map
+
+        return filter_map
+
     def get_queryset(self):
         queryset = super().get_queryset()
 
-        # Allow filtering on any field in serializer
-        all_fields = self.model._meta.get_fields()
-        filter_fields_lookup = {field.name: field.name for field in all_fields}
-        filter_fields_keys = list(field.name for field in all_fields)
+        # Collect the values first, a later query parameter overrides an earlier one with the same lookup
+        query_params = self.request.query_params
+        values = {}
+        for query_param, filter_lookup in self.get_filter_map().items():
+            value = query_params.get(query_param, None)
+            if value is not None:
+                values[filter_lookup.lookup] = (query_param, filter_lookup, value)
 
-        # Also support a mapping from query parameter to django query field
-        if self.parameter_lookup_map:
-            filter_fields_keys += self.parameter_lookup_map.keys()
-            filter_fields_lookup.update(self.parameter_lookup_map)
+            in_query_param = f"{query_param}__in"
+            if in_query_param in query_params:
+                in_values = [value for value in ",".join(query_params.getlist(in_query_param)).split(",") if value]
+                values[f"{filter_lookup.lookup}__in"] = (in_query_param, filter_lookup, in_values)
 
-        # Loop through the keys to maintain proper order
         filters = {}
-        for query_param in filter_fields_keys:
-            django_lookup_field = filter_fields_lookup[query_param]
-            value = self.request.query_params.get(query_param, None)
-            if value is not None:
-                filters[django_lookup_field] = value
+        for lookup, (query_param, filter_lookup, value) in values.items():
+            try:
+                if isinstance(value, list):
+                    filters[lookup] = [filter_lookup.to_python(item) for item in value]
+                else:
+                    filters[lookup] = filter_lookup.to_python(value)
+            except DjangoValidationError as e:
+                if getattr(self, "detail", False):
+                    raise NotFound()  # an invalid value can never match the requested object
+
+                raise ValidationError({query_param: e.messages})
 
         if filters:
-            # Fetch distinct for all model fields, to prevent duplications due to SQL Joins
-            queryset = queryset.distinct().filter(**filters)
+            queryset = queryset.filter(**filters)
+
+        if any(filter_lookup.many for _, filter_lookup, _ in values.values()):
+            # Only needed to prevent duplicates due to the joins of multi-valued relations, since it is expensive
+            queryset = queryset.distinct()
 
         return queryset
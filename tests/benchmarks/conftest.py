@@ -0,0 +1,77 @@
+import os
+from dataclasses import dataclass
+
+from django.contrib.auth.models import Group, User
+from django.db import transaction
+
+import pytest
+from katka import constants, models
+from katka.seed import seed
+
+TEAMS = 4
+
+
+@dataclass
+class Dataset:
+    user: User
+    team: models.Team
+    project: models.Project
+    credential: models.Credential
+    scm_service: models.SCMService
+    scm_repository: models.SCMRepository
+    application: models.Application
+    pipeline_run: models.SCMPipelineRun
+    step_run: models.SCMStepRun
+    release: models.SCMRelease
+
+
+def benchmark_scale():
+    """The size of the dataset, 1 is quick enough for every test run, 100 is about the size of production"""
+    return int(os.environ.get("KATKA_BENCHMARK_SCALE", "1"))
+
+
+def load_dataset():
+    """
+    Return the objects of the seeded dataset that the benchmarks use
+
+    Follows the same conventions as the fixtures in tests/integration/conftest.py: a user "test_user" that is a member
+    of half of the teams, while the other teams are not accessible for that user.
+    """
+    user = User.objects.create_user(username="test_user")
+    user.groups.set(Group.objects.filter(name__in=[f"seed-group-{number}" for number in range(TEAMS // 2)]))
+
+    team = models.Team.objects.select_related("group").get(slug="TEAM0")
+    application = models.Application.objects.select_related("project", "scm_repository").get(
+        project__team=team, slug="APP0"
+    )
+    pipeline_run = (
+        models.SCMPipelineRun.objects.filter(application=application, status=constants.PIPELINE_STATUS_SUCCESS)
+        .order_by("pk")
+        .first()
+    )
+    return Dataset(
+        user=user,
+        team=team,
+        project=application.project,
+        credential=models.Credential.objects.get(team=team),
+        scm_service=application.scm_repository.scm_service,
+        scm_repository=application.scm_repository,
+        application=application,
+        pipeline_run=pipeline_run,
+        step_run=pipeline_run.scmsteprun_set.get(slug="compile"),  # with JSON output, to append build info to
+        release=pipeline_run.scmrelease_set.get(),
+    )
+
+
+@pytest.fixture(scope="module")
+def dataset(django_db_setup, django_db_blocker):
+    """
+    The dataset is seeded once per module and rolled back afterwards, so it does not leak into other tests
+
+    The tests themselves run in a savepoint inside the transaction of the dataset, as usual.
+    """
+    with django_db_blocker.unblock():
+        with transaction.atomic():
+            seed(teams=TEAMS, applications_per_team=5 * benchmark_scale(), pipeline_runs_per_application=50)
+            yield load_dataset()
+            transaction.set_rollback(True)
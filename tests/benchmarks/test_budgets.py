@@ -0,0 +1,215 @@
+"""
+Query and latency budgets of every route, to catch changes that make an endpoint more expensive
+
+The query budgets do not depend on the size of the dataset: an endpoint that needs more queries for more objects
+fails. The latency budgets depend on the machine, so they are only checked when KATKA_BENCHMARK_LATENCY is set. They
+are for the default dataset size, use KATKA_BENCHMARK_LATENCY_FACTOR to allow for slower machines or larger datasets
+(KATKA_BENCHMARK_SCALE). Creating and deleting objects cannot be repeated, so those have no latency budget.
+"""
+import math
+import os
+import time
+from dataclasses import dataclass, field
+
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+
+import pytest
+from katka.urls import app_metadata_router, router, secrets_router
+
+
+@dataclass(frozen=True)
+class Budget:
+    method: str
+    url: str  # formatted with the dataset
+    queries: int  # including the session and user lookups of the authentication
+    p95_ms: float = 50
+    data: object = field(default=None, hash=False)  # the string values are formatted with the dataset
+
+
+# fmt: off
+BUDGETS = {
+    "teams": [
+        Budget("get", "/teams/", 4),
+        Budget("get", "/teams/{d.team.pk}/", 4),
+        Budget("post", "/teams/", 6, data={"slug": "NEW", "name": "New team", "group": "{d.team.group.name}"}),
+        Budget("delete", "/teams/{d.team.pk}/", 5),
+    ],
+    "projects": [
+        Budget("get", "/projects/", 4),
+        Budget("get", "/projects/{d.project.pk}/", 4),
+        Budget("post", "/projects/", 6, data={"slug": "NEW", "name": "New project", "team": "{d.team.pk}"}),
+        Budget("delete", "/projects/{d.project.pk}/", 7),
+    ],
+    "applications": [
+        Budget("get", "/applications/", 4, p95_ms=100),
+        Budget("get", "/applications/{d.application.pk}/", 4),
+        Budget("delete", "/applications/{d.application.pk}/", 8),
+    ],
+    "metadata": [
+        Budget("get", "/applications/{d.application.pk}/metadata/", 4),
+        Budget("get", "/applications/{d.application.pk}/metadata/language/", 4),
+        Budget("post", "/applications/{d.application.pk}/metadata/", 6, data={"key": "owner", "value": "me"}),
+        Budget("delete", "/applications/{d.application.pk}/metadata/language/", 5),
+    ],
+    "credentials": [
+        Budget("get", "/credentials/", 4),
+        Budget("get", "/credentials/{d.credential.pk}/", 4),
+        Budget("post", "/credentials/", 6, data={"name": "New credential", "team": "{d.team.pk}"}),
+        Budget("delete", "/credentials/{d.credential.pk}/", 5),
+    ],
+    "secrets": [
+        Budget("get", "/credentials/{d.credential.pk}/secrets/", 4),
+        Budget("get", "/credentials/{d.credential.pk}/secrets/access_token/", 4),
+        Budget("post", "/credentials/{d.credential.pk}/secrets/", 6, data={"key": "username", "value": "me"}),
+        Budget("delete", "/credentials/{d.credential.pk}/secrets/access_token/", 5),
+    ],
+    "scm-services": [
+        Budget("get", "/scm-services/", 3),
+        Budget("get", "/scm-services/{d.scm_service.pk}/", 3),
+    ],
+    "scm-repositories": [
+        Budget("get", "/scm-repositories/", 4, p95_ms=100),
+        Budget("get", "/scm-repositories/{d.scm_repository.pk}/", 4),
+        Budget(
+            "post", "/scm-repositories/", 6,
+            data={
+                "organisation": "new", "repository_name": "new", "credential": "{d.credential.pk}",
+                "scm_service": "{d.scm_service.pk}",
+            },
+        ),
+        Budget("delete", "/scm-repositories/{d.scm_repository.pk}/", 5),
+    ],
+    # Saving a finished pipeline run, also when a step is added or updated, closes the open release of the application
+    "scm-pipeline-runs": [
+        Budget("get", "/scm-pipeline-runs/?page_size=100", 5, p95_ms=250),
+        Budget("get", "/scm-pipeline-runs/?application={d.application.pk}", 5, p95_ms=250),
+        Budget("get", "/scm-pipeline-runs/{d.pipeline_run.pk}/", 5),
+        Budget("patch", "/scm-pipeline-runs/{d.pipeline_run.pk}/", 11, data={"output": "{{}}"}),
+        Budget(
+            "post", "/scm-pipeline-runs/", 11,
+            data={"commit_hash": "f" * 40, "application": "{d.application.pk}", "pipeline_yaml": "stages: [build]"},
+        ),
+        Budget("delete", "/scm-pipeline-runs/{d.pipeline_run.pk}/", 9),
+        Budget("get", "/scm-pipeline-runs/changes/?page_size=100", 5, p95_ms=250),
+    ],
+    "queued-scm-pipeline-runs": [
+        Budget("get", "/queued-scm-pipeline-runs/", 4),
+    ],
+    "scm-step-runs": [
+        Budget("get", "/scm-step-runs/?page_size=100", 4, p95_ms=250),
+        Budget("get", "/scm-step-runs/?scm_pipeline_run={d.pipeline_run.pk}", 4),
+        Budget("get", "/scm-step-runs/{d.step_run.pk}/", 4),
+        Budget("patch", "/scm-step-runs/{d.step_run.pk}/", 8, data={"status": "success"}),
+        Budget(
+            "post", "/scm-step-runs/", 11,
+            data={"slug": "new", "name": "new", "stage": "build", "scm_pipeline_run": "{d.pipeline_run.pk}"},
+        ),
+        Budget("delete", "/scm-step-runs/{d.step_run.pk}/", 8),
+        Budget(
+            "post", "/scm-step-runs/bulk/", 13,
+            data=[
+                {"slug": f"new-{i}", "name": "new", "stage": "build", "scm_pipeline_run": "{d.pipeline_run.pk}"}
+                for i in range(10)
+            ],
+        ),
+        Budget(
+            "patch", "/scm-step-runs/bulk/", 13,
+            data=[{"public_identifier": "{d.step_run.pk}", "status": "success", "output": "done"}],
+        ),
+        Budget("post", "/scm-step-runs/{d.step_run.pk}/output/", 9, data={"data": "line\n"}),
+        Budget("get", "/scm-step-runs/changes/?page_size=100", 4, p95_ms=250),
+    ],
+    "scm-releases": [
+        Budget("get", "/scm-releases/?page_size=100", 5, p95_ms=250),
+        Budget("get", "/scm-releases/?application={d.application.pk}", 5, p95_ms=100),
+        Budget("get", "/scm-releases/{d.release.pk}/", 5),
+    ],
+    "update-scm-step-run": [
+        Budget("patch", "/update-scm-step-run/{d.step_run.pk}/", 3, data={"status": "success"}),
+    ],
+    "append-build-info-scm-step-run": [
+        Budget(
+            "patch", "/append-build-info-scm-step-run/{d.step_run.pk}/", 4,
+            data={"status": "success", "build_number": 1, "build_result": "success", "comment": "built"},
+        ),
+    ],
+    "events": [
+        Budget("get", "/events/", 3),
+    ],
+    "metrics": [
+        Budget("get", "/metrics/", 3),
+    ],
+}
+# fmt: on
+
+
+def router_basenames():
+    return {basename for r in (router, secrets_router, app_metadata_router) for _, _, basename in r.registry}
+
+
+def p95(durations):
+    ordered = sorted(durations)
+    return ordered[math.ceil(0.95 * len(ordered)) - 1]
+
+
+def format_data(data, dataset):
+    if isinstance(data, str):
+        return data.format(d=dataset)
+    if isinstance(data, dict):
+        return {key: format_data(value, dataset) for key, value in data.items()}
+    if isinstance(data, list):
+        return [format_data(value, dataset) for value in data]
+    return data
+
+
+def request(client, budget, dataset):
+    url = budget.url.format(d=dataset)
+    if budget.data is None:
+        response = getattr(client, budget.method)(url)
+    else:
+        data = format_data(budget.data, dataset)
+        response = getattr(client, budget.method)(url, data, content_type="application/json")
+    response.close()  # ends the event stream
+    return response
+
+
+def test_every_route_has_a_budget():
+    assert set(BUDGETS) == router_basenames()
+
+
+def budget_id(budget):
+    return f"{budget.method.upper()} {budget.url}"
+
+
+@pytest.mark.django_db
+@pytest.mark.parametrize("budget", [budget for budgets in BUDGETS.values() for budget in budgets], ids=budget_id)
+def test_query_budget(client, dataset, budget):
+    client.force_login(dataset.user)
+
+    with CaptureQueriesContext(connection) as queries:
+        response = request(client, budget, dataset)
+    assert response.status_code < 300, response.content
+    assert len(queries) <= budget.queries, "\n".join(query["sql"] for query in queries)
+
+
+@pytest.mark.skipif(not os.environ.get("KATKA_BENCHMARK_LATENCY"), reason="KATKA_BENCHMARK_LATENCY is not set")
+@pytest.mark.django_db
+@pytest.mark.parametrize(
+    "budget",
+    [budget for budgets in BUDGETS.values() for budget in budgets if budget.method not in ("post", "delete")],
+    ids=budget_id,
+)
+def test_latency_budget(client, dataset, budget):
+    client.force_login(dataset.user)
+    assert request(client, budget, dataset).status_code < 300
+
+    rounds = int(os.environ.get("KATKA_BENCHMARK_ROUNDS", "20"))
+    durations = []
+    for _ in range(rounds):
+        start = time.perf_counter()
+        request(client, budget, dataset)
+        durations.append((time.perf_counter() - start) * 1000)
+
+    factor = float(os.environ.get("KATKA_BENCHMARK_LATENCY_FACTOR", "1"))
+    assert p95(durations) <= budget.p95_ms * factor, f"p95 latency of {p95(durations):.1f} ms"
@@ -0,0 +1,114 @@
+"""
+End-to-end throughput of complete pipeline lifecycles, driven by the fake pipeline runner
+
+Every pipeline run is created through the API, after which the fake runner creates its steps, runs them and finishes
+it, like the real runner does. The throughput depends on the machine, so it is only measured when
+KATKA_BENCHMARK_THROUGHPUT is set. Run with '--log-cli-level=INFO' to see it.
+"""
+import hashlib
+import logging
+import os
+import time
+
+from django.test import override_settings
+
+import pytest
+from katka import constants
+from katka.models import Application, SCMPipelineRun, SCMStepRun
+from tests.utils.fake_runner import DEFAULT_STEPS, FakeRunner
+
+log = logging.getLogger(__name__)
+
+
+def commits_per_application():
+    return int(os.environ.get("KATKA_BENCHMARK_COMMITS", "5"))
+
+
+@pytest.fixture
+def runner(client, dataset):
+    client.force_login(dataset.user)
+    runner = FakeRunner(client, step_failure_rate=0, seed=1)
+    with override_settings(
+        PIPELINE_RUNNER_SESSION=runner,
+        PIPELINE_RUNNER_BASE_URL="http://runner/",
+        PIPELINE_CHANGE_NOTIFICATION_EP="notify/",
+        PIPELINE_UPDATE_STEP_EP="update-step/",
+    ):
+        yield runner
+
+
+def push_commits(client, dataset, commits):
+    """Create a chain of 'commits' new pipeline runs for every application of the team, return the pipeline runs"""
+    pipeline_runs = []
+    for application in Application.objects.filter(project__team=dataset.team):
+        first_parent_hash = None
+        for number in range(commits):
+            commit_hash = hashlib.sha1(f"{application.pk}-{number}".encode()).hexdigest()
+            data = {
+                "commit_hash": commit_hash,
+                "first_parent_hash": first_parent_hash,
+                "application": str(application.pk),
+                "pipeline_yaml": "stages:\n  - build",
+            }
+            response = client.post("/scm-pipeline-runs/", data, content_type="application/json")
+            assert response.status_code == 201, response.content
+            pipeline_runs.append(response.json()["public_identifier"])
+            first_parent_hash = commit_hash
+
+    return pipeline_runs
+
+
+def report(runner, pipeline_runs, seconds):
+    stats = runner.stats
+    log.info(
+        f"{len(pipeline_runs)} pipeline runs in {seconds:.2f}s ({len(pipeline_runs) / seconds:.1f}/s), "
+        f"{stats.api_calls} API calls ({stats.api_seconds / max(stats.api_calls, 1) * 1000:.1f}ms on average), "
+        f"{stats.notifications} notifications"
+    )
+
+
+@pytest.mark.django_db
+class TestThroughput:
+    @pytest.mark.skipif(
+        not os.environ.get("KATKA_BENCHMARK_THROUGHPUT"), reason="KATKA_BENCHMARK_THROUGHPUT is not set"
+    )
+    def test_pipeline_lifecycles(self, client, dataset, runner):
+        start = time.monotonic()
+        pipeline_runs = push_commits(client, dataset, commits_per_application())
+        runner.run_until_idle()
+        report(runner, pipeline_runs, time.monotonic() - start)
+
+        assert runner.stats.finished == {constants.PIPELINE_STATUS_SUCCESS: len(pipeline_runs)}
+        finished = SCMPipelineRun.objects.filter(pk__in=pipeline_runs, status=constants.PIPELINE_STATUS_SUCCESS)
+        assert finished.count() == len(pipeline_runs)
+        steps = SCMStepRun.objects.filter(scm_pipeline_run__in=pipeline_runs)
+        assert steps.filter(status=constants.STEP_STATUS_SUCCESS).count() == len(pipeline_runs) * len(DEFAULT_STEPS)
+        assert not finished.exclude(steps_completed=len(DEFAULT_STEPS)).exists()
+
+    def test_failing_steps(self, client, dataset, runner):
+        runner.step_failure_rate = 0.2
+        pipeline_runs = push_commits(client, dataset, 3)
+        runner.run_until_idle()
+
+        assert runner.stats.finished_total == len(pipeline_runs)
+        assert runner.stats.finished[constants.PIPELINE_STATUS_FAILED] > 0
+        for pipeline_run in SCMPipelineRun.objects.filter(pk__in=pipeline_runs):
+            statuses = list(pipeline_run.scmsteprun_set.order_by("sequence_id").values_list("status", flat=True))
+            if pipeline_run.status == constants.PIPELINE_STATUS_FAILED:
+                failed_at = statuses.index(constants.STEP_STATUS_FAILED)
+                assert set(statuses[failed_at + 1 :]) <= {constants.STEP_STATUS_SKIPPED}
+            else:
+                assert set(statuses) == {constants.STEP_STATUS_SUCCESS}
+
+    @override_settings(
+        PIPELINE_NOTIFICATION_OUTBOX=True,
+        PIPELINE_NOTIFICATION_DISPATCH_ON_COMMIT=False,
+        PIPELINE_NOTIFICATION_RETRY_DELAY=0,
+    )
+    def test_rejected_notifications_are_retried(self, client, dataset, runner):
+        runner.notification_failure_rate = 0.3
+        pipeline_runs = push_commits(client, dataset, 3)
+        runner.run_until_idle()
+
+        assert runner.stats.rejected_notifications > 0
+        assert runner.stats.finished == {constants.PIPELINE_STATUS_SUCCESS: len(pipeline_runs)}
@@ -1,5 +1,6 @@
 import contextlib
 import json
+from unittest import mock
 
 from django.contrib.auth.models import Group, User
 from django.test import Client, modify_settings, override_settings
@@ -9,6 +10,13 @@ from katka import constants, models
 from katka.fields import username_on_model
 
 
+@pytest.fixture(autouse=True)
+def runner_client():
+    """A new pipeline runner client for every test, so the state of its circuit breaker does not leak"""
+    with mock.patch("katka.runner._client", None):
+        yield
+
+
 @contextlib.contextmanager
 def anonymous_client():
     yield Client()
@@ -0,0 +1,126 @@
+from datetime import timedelta
+
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+
+import pytest
+from katka import models
+from katka.fields import username_on_model
+from katka.pagination import encode_cursor
+
+
+@pytest.fixture(autouse=True)
+def no_changes_feed_delay(settings):
+    settings.CHANGES_FEED_DELAY = 0
+
+
+@pytest.fixture
+def step_runs(my_scm_pipeline_run):
+    with username_on_model(models.SCMStepRun, "initial"):
+        return [
+            models.SCMStepRun.objects.create(
+                slug=f"step-{i}", name=f"Step {i}", stage="build", scm_pipeline_run=my_scm_pipeline_run
+            )
+            for i in range(5)
+        ]
+
+
+def identifiers(response):
+    return [item["public_identifier"] for item in response.json()["results"]]
+
+
+@pytest.mark.django_db
+class TestChangesFeed:
+    def test_oldest_first(self, client, logged_in_user, step_runs):
+        response = client.get("/scm-step-runs/changes/")
+
+        assert response.status_code == 200
+        parsed = response.json()
+        assert identifiers(response) == [str(step.pk) for step in step_runs]
+        assert parsed["has_more"] is False
+        assert parsed["cursor"] == encode_cursor(step_runs[-1].modified_at, step_runs[-1].pk)
+
+    def test_follow_cursor(self, client, logged_in_user, step_runs):
+        response = client.get("/scm-step-runs/changes/?page_size=2")
+        assert identifiers(response) == [str(step.pk) for step in step_runs[:2]]
+        assert response.json()["has_more"] is True
+
+        response = client.get(f"/scm-step-runs/changes/?page_size=2&cursor={response.json()['cursor']}")
+        assert identifiers(response) == [str(step.pk) for step in step_runs[2:4]]
+
+    def test_only_changes_after_cursor(self, client, logged_in_user, step_runs):
+        cursor = client.get("/scm-step-runs/changes/").json()["cursor"]
+
+        response = client.get(f"/scm-step-runs/changes/?cursor={cursor}")
+        assert response.json() == {"cursor": cursor, "has_more": False, "results": []}
+
+        step_runs[1].status = "in progress"
+        with username_on_model(models.SCMStepRun, "modified"):
+            step_runs[1].save()
+
+        response = client.get(f"/scm-step-runs/changes/?cursor={cursor}")
+        assert identifiers(response) == [str(step_runs[1].pk)]
+        assert response.json()["results"][0]["status"] == "in progress"
+
+    def test_tombstones(self, client, logged_in_user, step_runs):
+        cursor = client.get("/scm-step-runs/changes/").json()["cursor"]
+        assert client.delete(f"/scm-step-runs/{step_runs[0].public_identifier}/").status_code == 204
+
+        response = client.get(f"/scm-step-runs/changes/?cursor={cursor}")
+        results = response.json()["results"]
+        assert [(item["public_identifier"], item["deleted"]) for item in results] == [(str(step_runs[0].pk), True)]
+
+        # the regular list does not return deleted steps
+        response = client.get("/scm-step-runs/")
+        assert str(step_runs[0].pk) not in [step["public_identifier"] for step in response.json()]
+
+    def test_modified_since(self, client, logged_in_user, step_runs):
+        modified_since = step_runs[2].modified_at.isoformat()
+        response = client.get("/scm-step-runs/changes/", {"modified_since": modified_since})
+        assert identifiers(response) == [str(step.pk) for step in step_runs[3:]]
+
+    @pytest.mark.parametrize("modified_since", ["yesterday", "2020-13-01T00:00:00"])
+    def test_invalid_modified_since(self, client, logged_in_user, step_runs, modified_since):
+        response = client.get("/scm-step-runs/changes/", {"modified_since": modified_since})
+        assert response.status_code == 400
+        assert "modified_since" in response.json()
+
+    def test_invalid_cursor(self, client, logged_in_user, step_runs):
+        response = client.get("/scm-step-runs/changes/?cursor=not-a-cursor")
+        assert response.status_code == 404
+
+    def test_filters(self, client, logged_in_user, scm_step_run, another_scm_pipeline_run, another_scm_step_run):
+        response = client.get(f"/scm-step-runs/changes/?scm_pipeline_run={another_scm_pipeline_run.pk}")
+        assert identifiers(response) == [str(another_scm_step_run.pk)]
+
+    def test_only_accessible_objects(self, client, logged_in_user, scm_pipeline_run, not_my_scm_pipeline_run):
+        response = client.get("/scm-pipeline-runs/changes/")
+
+        assert response.status_code == 200
+        assert str(not_my_scm_pipeline_run.pk) not in identifiers(response)
+        assert len(identifiers(response)) > 0
+
+    def test_releases(self, client, logged_in_user, my_scm_release):
+        response = client.get("/scm-releases/changes/")
+
+        assert response.status_code == 200
+        assert str(my_scm_release.pk) in identifiers(response)
+
+    def test_recent_changes_delayed(self, client, logged_in_user, settings, step_runs):
+        settings.CHANGES_FEED_DELAY = 60
+        assert identifiers(client.get("/scm-step-runs/changes/")) == []
+
+        models.SCMStepRun.objects.filter(pk=step_runs[0].pk).update(modified_at=timezone.now() - timedelta(minutes=5))
+
+        assert identifiers(client.get("/scm-step-runs/changes/")) == [str(step_runs[0].pk)]
+
+    def test_range_query(self, client, logged_in_user, step_runs):
+        cursor = encode_cursor(step_runs[1].modified_at, step_runs[1].pk)
+        with CaptureQueriesContext(connection) as queries:
+            client.get(f"/scm-step-runs/changes/?cursor={cursor}&page_size=2")
+
+        sql = [query["sql"] for query in queries if 'FROM "katka_scmsteprun"' in query["sql"]]
+        assert len(sql) == 1
+        assert 'ORDER BY "katka_scmsteprun"."modified_at" ASC' in sql[0]
+        assert "LIMIT 3" in sql[0]
@@ -0,0 +1,169 @@
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+
+import pytest
+from katka import models
+from katka.fields import username_on_model
+
+
+def step_queries(queries):
+    return [query["sql"] for query in queries if 'FROM "katka_scmsteprun"' in query["sql"]]
+
+
+@pytest.mark.django_db
+class TestConditionalGetDetail:
+    def test_validators(self, client, logged_in_user, my_scm_step_run):
+        response = client.get(f"/scm-step-runs/{my_scm_step_run.public_identifier}/")
+
+        assert response.status_code == 200
+        assert response["ETag"].startswith('"')
+        assert "Last-Modified" in response
+
+    def test_not_modified(self, client, logged_in_user, my_scm_step_run):
+        url = f"/scm-step-runs/{my_scm_step_run.public_identifier}/"
+        etag = client.get(url)["ETag"]
+
+        with CaptureQueriesContext(connection) as queries:
+            response = client.get(url, HTTP_IF_NONE_MATCH=etag)
+
+        assert response.status_code == 304
+        assert response.content == b""
+        assert response["ETag"] == etag
+        # only the modified_at is aggregated
+        sql = step_queries(queries)
+        assert len(sql) == 1
+        assert sql[0].startswith('SELECT MAX("katka_scmsteprun"."modified_at")')
+
+    def test_modified(self, client, logged_in_user, my_scm_step_run):
+        url = f"/scm-step-runs/{my_scm_step_run.public_identifier}/"
+        etag = client.get(url)["ETag"]
+
+        my_scm_step_run.status = "in progress"
+        with username_on_model(models.SCMStepRun, "modified"):
+            my_scm_step_run.save()
+
+        response = client.get(url, HTTP_IF_NONE_MATCH=etag)
+        assert response.status_code == 200
+        assert response.json()["status"] == "in progress"
+        assert response["ETag"] != etag
+
+    def test_if_modified_since(self, client, logged_in_user, my_scm_step_run):
+        url = f"/scm-step-runs/{my_scm_step_run.public_identifier}/"
+        last_modified = client.get(url)["Last-Modified"]
+
+        response = client.get(url, HTTP_IF_MODIFIED_SINCE=last_modified)
+        assert response.status_code == 304
+
+        response = client.get(url, HTTP_IF_MODIFIED_SINCE="Thu, 01 Jan 2015 00:00:00 GMT")
+        assert response.status_code == 200
+
+    def test_representation_depends_on_query_parameters(self, client, logged_in_user, my_scm_step_run):
+        url = f"/scm-step-runs/{my_scm_step_run.public_identifier}/"
+        etag = client.get(url)["ETag"]
+
+        response = client.get(f"{url}?fields=status", HTTP_IF_NONE_MATCH=etag)
+        assert response.status_code == 200
+        assert response.json() == {"status": my_scm_step_run.status}
+
+    @pytest.mark.parametrize("identifier", ["not-a-uuid", "00000000-0000-0000-0000-000000000000"])
+    def test_not_found(self, client, logged_in_user, scm_step_run, identifier):
+        response = client.get(f"/scm-step-runs/{identifier}/", HTTP_IF_NONE_MATCH='"etag"')
+        assert response.status_code == 404
+
+    def test_not_accessible(self, client, logged_in_user, not_my_scm_step_run):
+        response = client.get(f"/scm-step-runs/{not_my_scm_step_run.public_identifier}/")
+        assert response.status_code == 404
+        assert "ETag" not in response
+
+    def test_pipeline_run_with_releases(self, client, logged_in_user, my_scm_pipeline_run, my_scm_release):
+        url = f"/scm-pipeline-runs/{my_scm_pipeline_run.public_identifier}/"
+        etag = client.get(url)["ETag"]
+
+        # the validators of the loaded and of the aggregated releases are the same
+        assert client.get(url, HTTP_IF_NONE_MATCH=etag).status_code == 304
+        assert (
+            client.get(
+                f"{url}?fields=status", HTTP_IF_NONE_MATCH=client.get(f"{url}?fields=status")["ETag"]
+            ).status_code
+            == 304
+        )
+
+    def test_pipeline_run_added_to_release(self, client, logged_in_user, my_scm_pipeline_run):
+        url = f"/scm-pipeline-runs/{my_scm_pipeline_run.public_identifier}/"
+        etag = client.get(url)["ETag"]
+        list_etag = client.get("/scm-pipeline-runs/")["ETag"]
+
+        # adding the pipeline run to a release does not change the pipeline run itself
+        with username_on_model(models.SCMRelease, "initial"):
+            release = models.SCMRelease.objects.create()
+            release.scm_pipeline_runs.add(my_scm_pipeline_run)
+            release.save()
+
+        response = client.get(url, HTTP_IF_NONE_MATCH=etag)
+        assert response.status_code == 200
+        assert response.json()["scmrelease_set"] == [str(release.pk)]
+
+        assert client.get("/scm-pipeline-runs/", HTTP_IF_NONE_MATCH=list_etag).status_code == 200
+
+
+@pytest.mark.django_db
+class TestConditionalGetList:
+    def test_not_modified(self, client, logged_in_user, my_scm_pipeline_run, scm_step_run):
+        url = f"/scm-step-runs/?scm_pipeline_run={my_scm_pipeline_run.pk}"
+        response = client.get(url)
+        assert response.status_code == 200
+        etag = response["ETag"]
+
+        with CaptureQueriesContext(connection) as queries:
+            response = client.get(url, HTTP_IF_NONE_MATCH=etag)
+
+        assert response.status_code == 304
+        # a single aggregate query instead of loading the steps
+        sql = step_queries(queries)
+        assert len(sql) == 1
+        assert "MAX(" in sql[0]
+
+    def test_no_extra_query_without_conditional_headers(
+        self, client, logged_in_user, my_scm_pipeline_run, scm_step_run
+    ):
+        with CaptureQueriesContext(connection) as queries:
+            response = client.get(f"/scm-step-runs/?scm_pipeline_run={my_scm_pipeline_run.pk}")
+
+        assert response.status_code == 200
+        assert "ETag" in response
+        assert not [query for query in queries if "MAX(" in query["sql"]]
+
+    def test_new_step(self, client, logged_in_user, my_scm_pipeline_run, scm_step_run):
+        url = f"/scm-step-runs/?scm_pipeline_run={my_scm_pipeline_run.pk}"
+        etag = client.get(url)["ETag"]
+
+        with username_on_model(models.SCMStepRun, "initial"):
+            models.SCMStepRun.objects.create(
+                slug="new-step", name="New step", stage="deploy", scm_pipeline_run=my_scm_pipeline_run
+            )
+
+        response = client.get(url, HTTP_IF_NONE_MATCH=etag)
+        assert response.status_code == 200
+        assert "new-step" in [step["slug"] for step in response.json()]
+
+    def test_deleted_step(self, client, logged_in_user, my_scm_pipeline_run, scm_step_run):
+        url = f"/scm-step-runs/?scm_pipeline_run={my_scm_pipeline_run.pk}"
+        etag = client.get(url)["ETag"]
+
+        response = client.delete(f"/scm-step-runs/{scm_step_run.public_identifier}/")
+        assert response.status_code == 204
+
+        response = client.get(url, HTTP_IF_NONE_MATCH=etag)
+        assert response.status_code == 200
+        assert response["ETag"] != etag
+
+    def test_pages(self, client, logged_in_user, scm_step_run):
+        response = client.get("/scm-step-runs/?page_size=1")
+        assert response.status_code == 200
+        etag = response["ETag"]
+
+        response = client.get("/scm-step-runs/?page_size=1", HTTP_IF_NONE_MATCH=etag)
+        assert response.status_code == 304
+
+        response = client.get("/scm-step-runs/?page_size=2", HTTP_IF_NONE_MATCH=etag)
+        assert response.status_code == 200
@@ -0,0 +1,154 @@
+import importlib
+
+from django.apps import apps
+from django.contrib.auth.models import User
+from django.db import connection
+from django.test import Client
+from django.test.utils import CaptureQueriesContext
+
+import pytest
+from katka import models
+from katka.fields import username_on_model
+
+backfill = importlib.import_module("katka.migrations.0038_backfill_pipeline_and_step_team")
+
+
+@pytest.mark.django_db
+class TestDenormalizedTeam:
+    def test_set_on_create(self, my_team, my_scm_pipeline_run, my_scm_step_run):
+        my_scm_pipeline_run.refresh_from_db()
+        my_scm_step_run.refresh_from_db()
+
+        assert my_scm_pipeline_run.team_id == my_team.pk
+        assert my_scm_step_run.team_id == my_team.pk
+
+    def test_application_moved_to_other_project(
+        self, my_application, my_other_project, my_other_team, my_scm_pipeline_run, my_scm_step_run
+    ):
+        my_application.project = my_other_project
+        with username_on_model(models.Application, "moved"):
+            my_application.save()
+
+        my_scm_pipeline_run.refresh_from_db()
+        my_scm_step_run.refresh_from_db()
+        assert my_scm_pipeline_run.team_id == my_other_team.pk
+        assert my_scm_step_run.team_id == my_other_team.pk
+
+    def test_project_moved_to_other_team(self, my_project, my_other_team, my_scm_pipeline_run, my_scm_step_run):
+        my_project.team = my_other_team
+        with username_on_model(models.Project, "moved"):
+            my_project.save()
+
+        my_scm_pipeline_run.refresh_from_db()
+        my_scm_step_run.refresh_from_db()
+        assert my_scm_pipeline_run.team_id == my_other_team.pk
+        assert my_scm_step_run.team_id == my_other_team.pk
+
+    def test_moved_runs_modified(self, my_project, my_other_team, my_scm_pipeline_run, my_scm_step_run):
+        my_scm_pipeline_run.refresh_from_db()
+        my_scm_step_run.refresh_from_db()
+        pipeline_modified_at, step_modified_at = my_scm_pipeline_run.modified_at, my_scm_step_run.modified_at
+        my_project.team = my_other_team
+        with username_on_model(models.Project, "moved"):
+            my_project.save()
+
+        # the changes feed reports the runs again
+        my_scm_pipeline_run.refresh_from_db()
+        my_scm_step_run.refresh_from_db()
+        assert my_scm_pipeline_run.modified_at > pipeline_modified_at
+        assert my_scm_step_run.modified_at > step_modified_at
+
+    def test_application_saved_in_same_project(self, my_application, my_scm_pipeline_run, my_scm_step_run):
+        application = models.Application.objects.get(pk=my_application.pk)
+        application.name = "Renamed"
+        with CaptureQueriesContext(connection) as queries, username_on_model(models.Application, "renamed"):
+            application.save()
+
+        assert not [query for query in queries if "katka_scmpipelinerun" in query["sql"]]
+        assert not [query for query in queries if "katka_scmsteprun" in query["sql"]]
+
+    def test_project_saved_in_same_team(self, my_project, my_scm_pipeline_run, my_scm_step_run):
+        project = models.Project.objects.get(pk=my_project.pk)
+        project.name = "Renamed"
+        with CaptureQueriesContext(connection) as queries, username_on_model(models.Project, "renamed"):
+            project.save()
+
+        assert not [query for query in queries if "katka_scmpipelinerun" in query["sql"]]
+        assert not [query for query in queries if "katka_scmsteprun" in query["sql"]]
+
+    def test_loaded_project_moved_twice(self, my_project, my_team, my_other_team, my_scm_pipeline_run):
+        project = models.Project.objects.get(pk=my_project.pk)
+        for team in (my_other_team, my_team):
+            project.team = team
+            with username_on_model(models.Project, "moved"):
+                project.save()
+
+            my_scm_pipeline_run.refresh_from_db()
+            assert my_scm_pipeline_run.team_id == team.pk
+
+    def test_pipeline_moved_to_other_application(
+        self,
+        client,
+        logged_in_user,
+        my_group,
+        my_other_group,
+        my_other_application,
+        my_scm_pipeline_run,
+        my_scm_step_run,
+    ):
+        response = client.patch(
+            f"/scm-pipeline-runs/{my_scm_pipeline_run.public_identifier}/",
+            {"application": str(my_other_application.pk)},
+            content_type="application/json",
+        )
+        assert response.status_code == 200
+
+        def visible_steps(group):
+            member = User.objects.create_user(f"member of {group.name}")
+            member.groups.add(group)
+            member_client = Client()
+            member_client.force_login(member)
+            return {step["public_identifier"] for step in member_client.get("/scm-step-runs/").json()}
+
+        assert str(my_scm_step_run.pk) not in visible_steps(my_group)
+        assert str(my_scm_step_run.pk) in visible_steps(my_other_group)
+
+    def test_step_moved_to_other_pipeline(self, my_scm_step_run, not_my_scm_pipeline_run, not_my_team):
+        my_scm_step_run.scm_pipeline_run = not_my_scm_pipeline_run
+        with username_on_model(models.SCMStepRun, "moved"):
+            my_scm_step_run.save()
+
+        my_scm_step_run.refresh_from_db()
+        assert my_scm_step_run.team_id == not_my_team.pk
+
+    def test_backfill(self, my_team, not_my_team, my_scm_step_run, not_my_scm_step_run):
+        models.SCMPipelineRun.objects.update(team=None)
+        models.SCMStepRun.objects.update(team=None)
+
+        backfill.backfill_team(apps, None)
+
+        assert models.SCMPipelineRun.objects.get(pk=my_scm_step_run.scm_pipeline_run_id).team_id == my_team.pk
+        assert models.SCMStepRun.objects.get(pk=my_scm_step_run.pk).team_id == my_team.pk
+        assert models.SCMStepRun.objects.get(pk=not_my_scm_step_run.pk).team_id == not_my_team.pk
+
+
+@pytest.mark.django_db
+class TestTeamRestrictedLists:
+    def test_step_list_does_not_join_projects(self, client, logged_in_user, scm_step_run):
+        with CaptureQueriesContext(connection) as queries:
+            response = client.get("/scm-step-runs/")
+
+        assert response.status_code == 200
+        assert len(response.json()) > 0
+        step_queries = [query["sql"] for query in queries if 'FROM "katka_scmsteprun"' in query["sql"]]
+        assert step_queries
+        assert all("katka_project" not in sql for sql in step_queries)
+
+    def test_pipeline_list_does_not_join_projects(self, client, logged_in_user, scm_pipeline_run):
+        with CaptureQueriesContext(connection) as queries:
+            response = client.get("/scm-pipeline-runs/")
+
+        assert response.status_code == 200
+        pipeline_queries = [query["sql"] for query in queries if 'FROM "katka_scmpipelinerun"' in query["sql"]]
+        assert pipeline_queries
+        assert all("katka_project" not in sql for sql in pipeline_queries)
@@ -0,0 +1,80 @@
+from django.db import transaction
+
+import pytest
+from katka import events, models
+from katka.fields import username_on_model
+from tests.integration.conftest import scoped_client
+
+
+@pytest.fixture(autouse=True)
+def short_streams(settings):
+    settings.EVENTS_STREAM_TIMEOUT = 0.1
+    settings.EVENTS_HEARTBEAT_INTERVAL = 0.02
+
+
+def read_events(response):
+    messages = [message.decode() for message in response.streaming_content]
+    response.close()
+    return [message for message in messages if message.startswith("event: ")]
+
+
+@pytest.mark.django_db
+class TestEventStreamView:
+    def test_events_of_teams_of_user(self, client, logged_in_user, my_team, not_my_team):
+        response = client.get("/events/", HTTP_ACCEPT="text/event-stream")
+        assert response.status_code == 200
+        assert response["Content-Type"] == "text/event-stream"
+
+        broker = events.get_broker()
+        broker.publish(events.Event("pipeline", my_team.pk, {"status": "mine"}))
+        broker.publish(events.Event("pipeline", not_my_team.pk, {"status": "not mine"}))
+
+        assert read_events(response) == ['event: pipeline\ndata: {"status":"mine"}\n\n']
+        assert not broker._subscriptions
+
+    def test_full_access_scope(self, team, my_team, not_my_team):
+        with scoped_client() as client:
+            response = client.get("/events/")
+            assert response.status_code == 200
+
+            broker = events.get_broker()
+            broker.publish(events.Event("step", my_team.pk, {}))
+            broker.publish(events.Event("step", not_my_team.pk, {}))
+
+            assert len(read_events(response)) == 2
+
+    def test_anonymous(self, client):
+        response = client.get("/events/")
+        assert response.status_code == 403
+
+
+@pytest.mark.django_db(transaction=True)
+class TestPublishedEvents:
+    def test_pipeline_and_step_changes(self, my_scm_pipeline_run):
+        with events.get_broker().subscribe([my_scm_pipeline_run.team_id], buffer_size=10) as subscription:
+            with username_on_model(models.SCMStepRun, "initial"):
+                step = models.SCMStepRun.objects.create(
+                    slug="build", name="Build", stage="build", scm_pipeline_run=my_scm_pipeline_run
+                )
+
+            published = {event.type: event for event in iter(lambda: subscription.get(timeout=0), None)}
+
+        assert published["step"].data == {
+            "public_identifier": str(step.pk),
+            "scm_pipeline_run": str(my_scm_pipeline_run.pk),
+            "slug": "build",
+            "status": "not started",
+        }
+        # the step counters of the pipeline changed as well
+        pipeline = models.SCMPipelineRun.objects.get(pk=my_scm_pipeline_run.pk)
+        assert published["pipeline"].data["steps_total"] == pipeline.steps_total
+
+    def test_not_published_when_rolled_back(self, my_scm_pipeline_run):
+        with events.get_broker().subscribe(None, buffer_size=10) as subscription:
+            with pytest.raises(RuntimeError):
+                with transaction.atomic(), username_on_model(models.SCMPipelineRun, "modified"):
+                    my_scm_pipeline_run.status = "in progress"
+                    my_scm_pipeline_run.save()
+                    raise RuntimeError
+
+            assert subscription.get(timeout=0) is None
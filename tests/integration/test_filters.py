@@ -0,0 +1,94 @@
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+
+import pytest
+from katka import models, views
+from katka.constants import PIPELINE_STATUS_QUEUED, PIPELINE_STATUS_SUCCESS
+from katka.fields import username_on_model
+
+
+def pipeline_queries(queries):
+    return [query["sql"] for query in queries if 'FROM "katka_scmpipelinerun"' in query["sql"]]
+
+
+class TestFilterMap:
+    def test_computed_once_per_class(self):
+        filter_map = views.SCMPipelineRunViewSet.get_filter_map()
+
+        assert views.SCMPipelineRunViewSet.get_filter_map() is filter_map
+        assert views.QueuedSCMPipelineRunViewSet.get_filter_map() is not filter_map
+        assert views.SCMStepRunViewSet.get_filter_map() is not filter_map
+
+    def test_lookups(self):
+        filter_map = views.SCMPipelineRunViewSet.get_filter_map()
+
+        assert filter_map["status"].lookup == "status"
+        assert not filter_map["status"].many
+        assert filter_map["application"].field is models.Application._meta.pk
+        assert not filter_map["application"].many
+        assert filter_map["release"].lookup == "scmrelease"
+        assert filter_map["release"].field is models.SCMRelease._meta.pk
+        assert filter_map["release"].many
+
+    def test_lookups_through_reverse_relations(self):
+        filter_map = views.TeamViewSet.get_filter_map()
+
+        assert filter_map["application"].lookup == "project__application"
+        assert filter_map["application"].many
+
+
+@pytest.mark.django_db
+class TestFilterViewMixin:
+    def test_in_filter(self, client, logged_in_user, my_scm_pipeline_run, next_scm_pipeline_run):
+        with username_on_model(models.SCMPipelineRun, "initial"):
+            next_scm_pipeline_run.status = PIPELINE_STATUS_QUEUED
+            next_scm_pipeline_run.save()
+
+        response = client.get(f"/scm-pipeline-runs/?status__in={PIPELINE_STATUS_QUEUED},{PIPELINE_STATUS_SUCCESS}")
+        assert response.status_code == 200
+        assert [run["public_identifier"] for run in response.json()] == [str(next_scm_pipeline_run.pk)]
+
+        response = client.get(
+            f"/scm-pipeline-runs/?status__in={PIPELINE_STATUS_QUEUED}&status__in={my_scm_pipeline_run.status}"
+        )
+        assert len(response.json()) == 2
+
+    def test_in_filter_on_relation(
+        self, client, logged_in_user, my_application, my_other_application, scm_pipeline_run
+    ):
+        response = client.get(f"/scm-pipeline-runs/?application__in={my_application.pk},{my_other_application.pk}")
+        assert response.status_code == 200
+        assert {run["application"] for run in response.json()} == {
+            str(my_application.pk),
+            str(my_other_application.pk),
+        }
+
+    def test_boolean_filter(self, client, logged_in_user, my_application, my_other_application):
+        with username_on_model(models.Application, "initial"):
+            my_other_application.active = False
+            my_other_application.save()
+
+        response = client.get("/applications/?active=false")
+        assert response.status_code == 200
+        assert [app["public_identifier"] for app in response.json()] == [str(my_other_application.pk)]
+
+    @pytest.mark.parametrize("query", ["application=12345", "application__in=12345", "deleted=maybe"])
+    def test_invalid_value(self, client, logged_in_user, scm_pipeline_run, query):
+        response = client.get(f"/scm-pipeline-runs/?{query}")
+        assert response.status_code == 400
+        assert query.split("=")[0] in response.json()
+
+    def test_no_distinct_for_single_valued_relation(self, client, logged_in_user, my_application, scm_pipeline_run):
+        with CaptureQueriesContext(connection) as queries:
+            response = client.get(f"/scm-pipeline-runs/?application={my_application.pk}")
+
+        assert response.status_code == 200
+        assert all("DISTINCT" not in sql for sql in pipeline_queries(queries))
+
+    def test_distinct_for_multi_valued_relation(self, client, logged_in_user, my_scm_pipeline_run, my_scm_release):
+        with CaptureQueriesContext(connection) as queries:
+            response = client.get(f"/scm-pipeline-runs/?release={my_scm_release.pk}")
+
+        assert response.status_code == 200
+        assert len(response.json()) == 1
+        assert any("DISTINCT" in sql for sql in pipeline_queries(queries))
@@ -0,0 +1,123 @@
+import re
+from unittest import mock
+
+from django.db import connection
+from django.test import modify_settings, override_settings
+from django.test.utils import CaptureQueriesContext
+
+import pytest
+from katka.instrumentation import PrometheusSink, get_sink
+
+
+class ListSink:
+    def __init__(self):
+        self.recorded = []
+
+    def record(self, metrics):
+        self.recorded.append(metrics)
+
+
+@pytest.fixture(autouse=True)
+def instrumentation():
+    with modify_settings(MIDDLEWARE={"append": "katka.instrumentation.InstrumentationMiddleware"}), mock.patch(
+        "katka.instrumentation._sink", None
+    ):
+        yield
+
+
+def server_timing(response):
+    return {
+        name: (float(duration), description)
+        for name, duration, description in re.findall(
+            r'(\w+);dur=([\d.]+)(?:;desc="([^"]*)")?', response["Server-Timing"]
+        )
+    }
+
+
+@pytest.mark.django_db
+class TestInstrumentationMiddleware:
+    def test_server_timing(self, client, logged_in_user, scm_step_run):
+        with CaptureQueriesContext(connection) as queries:
+            response = client.get("/scm-pipeline-runs/")
+
+        assert response.status_code == 200
+        timing = server_timing(response)
+        assert timing["db"][1] == f"{len(queries)} queries"
+        assert timing["serializer"][0] > 0
+        assert timing["runner"] == (0, "0 requests")
+        assert timing["total"][0] >= timing["db"][0]
+
+    @override_settings(INSTRUMENTATION_SERVER_TIMING=False)
+    def test_server_timing_disabled(self, client, logged_in_user, team):
+        response = client.get("/teams/")
+
+        assert response.status_code == 200
+        assert "Server-Timing" not in response
+        assert get_sink().render()
+
+    def test_tagged_by_viewset_and_action(self, client, logged_in_user, scm_pipeline_run):
+        with override_settings(INSTRUMENTATION_SINK="tests.integration.test_instrumentation.ListSink"):
+            client.get("/scm-pipeline-runs/")
+            response = client.get(f"/scm-pipeline-runs/{scm_pipeline_run.public_identifier}/")
+            client.get("/scm-pipeline-runs/changes/")
+
+            recorded = get_sink().recorded
+
+        assert [(metrics.viewset, metrics.action) for metrics in recorded] == [
+            ("SCMPipelineRunViewSet", "list"),
+            ("SCMPipelineRunViewSet", "retrieve"),
+            ("SCMPipelineRunViewSet", "changes"),
+        ]
+        assert recorded[1].response_bytes == len(response.content)
+        assert recorded[1].queries > 0
+
+    def test_runner_requests(self, client, logged_in_user, scm_step_run):
+        overrides = {"PIPELINE_RUNNER_BASE_URL": "http://runner/", "PIPELINE_UPDATE_STEP_EP": "update-step/"}
+        with override_settings(**overrides):
+            response = client.patch(
+                f"/update-scm-step-run/{scm_step_run.public_identifier}/",
+                {"status": "success"},
+                content_type="application/json",
+            )
+
+        assert response.status_code == 200
+        assert server_timing(response)["runner"][1] == "1 requests"
+
+    def test_prometheus_metrics(self, client, logged_in_user, scm_step_run):
+        overrides = {"PIPELINE_RUNNER_BASE_URL": "http://runner/", "PIPELINE_UPDATE_STEP_EP": "update-step/"}
+        with override_settings(**overrides):
+            client.patch(
+                f"/update-scm-step-run/{scm_step_run.public_identifier}/",
+                {"status": "success"},
+                content_type="application/json",
+            )
+        client.get("/teams/")
+
+        response = client.get("/metrics/")
+
+        assert response.status_code == 200
+        assert response["Content-Type"] == "text/plain; version=0.0.4; charset=utf-8"
+        metrics = response.content.decode()
+        assert "# TYPE katka_requests_total counter" in metrics
+        assert 'katka_requests_total{viewset="TeamViewSet",action="list"} 1\n' in metrics
+        assert (
+            'katka_runner_requests_total{viewset="SCMStepRunUpdateStatusView",action="partial_update"} 1\n' in metrics
+        )
+        assert 'katka_runner_request_duration_seconds_count{endpoint="update-step/"} 1\n' in metrics
+        assert 'katka_runner_request_duration_seconds_bucket{endpoint="update-step/",le="+Inf"} 1\n' in metrics
+
+    def test_prometheus_metrics_not_rendered_by_sink(self, client, logged_in_user):
+        with override_settings(INSTRUMENTATION_SINK="tests.integration.test_instrumentation.ListSink"):
+            response = client.get("/metrics/", HTTP_ACCEPT="application/json")
+
+        assert response.status_code == 404
+
+    def test_metrics_require_authentication(self, client):
+        response = client.get("/metrics/", HTTP_ACCEPT="application/json")
+
+        assert response.status_code == 403
+
+
+class TestPrometheusSink:
+    def test_render_without_requests(self):
+        assert PrometheusSink().render().startswith("# HELP katka_requests_total Number of requests\n")
@@ -0,0 +1,173 @@
+from datetime import timedelta
+from io import StringIO
+from unittest import mock
+
+from django.core.management import call_command
+from django.test import override_settings
+from django.utils import timezone
+
+import pytest
+from katka import constants, notifications
+from katka.fields import username_on_model
+from katka.models import PipelineNotification, SCMPipelineRun
+from requests import ConnectionError, HTTPError
+
+# the default connect and read timeouts of the pipeline runner client
+RUNNER_TIMEOUT = (3.05, 10)
+
+
+@pytest.fixture
+def runner_session():
+    session = mock.MagicMock()
+    overrides = {
+        "PIPELINE_RUNNER_SESSION": session,
+        "PIPELINE_RUNNER_BASE_URL": "http://override-url/",
+        "PIPELINE_CHANGE_NOTIFICATION_EP": "change/",
+        "PIPELINE_NOTIFICATION_OUTBOX": True,
+    }
+    with override_settings(**overrides), mock.patch("katka.notifications.transaction.on_commit") as on_commit:
+        session.on_commit = on_commit
+        yield session
+
+
+def _change(pipeline_run, status):
+    with username_on_model(SCMPipelineRun, "signal_tester"):
+        pipeline_run.status = status
+        pipeline_run.save()
+
+
+@pytest.mark.django_db
+class TestPipelineNotificationOutbox:
+    def test_notification_is_stored_instead_of_sent(self, runner_session, application):
+        with username_on_model(SCMPipelineRun, "signal_tester"):
+            pipeline_run = SCMPipelineRun.objects.create(application=application)
+
+        assert runner_session.post.call_args_list == []
+        assert PipelineNotification.objects.filter(scm_pipeline_run=pipeline_run).exists()
+        # the pipeline event is published on commit as well
+        assert runner_session.on_commit.call_args_list.count(mock.call(notifications.schedule_dispatch)) == 1
+
+    def test_dispatch_coalesces_notifications(self, runner_session, my_scm_pipeline_run):
+        _change(my_scm_pipeline_run, constants.PIPELINE_STATUS_IN_PROGRESS)
+        _change(my_scm_pipeline_run, constants.PIPELINE_STATUS_SUCCESS)
+
+        # creating the pipeline run and both changes are coalesced into one notification
+        notification = PipelineNotification.objects.get()
+        assert notification.version == 3
+
+        assert notifications.dispatch_pending_notifications() == 1
+        assert runner_session.post.call_args_list == [
+            mock.call(
+                "http://override-url/change/",
+                json={"public_identifier": str(my_scm_pipeline_run.pk)},
+                timeout=RUNNER_TIMEOUT,
+            ),
+        ]
+        assert not PipelineNotification.objects.exists()
+
+    def test_failed_notification_is_retried_later(self, runner_session, my_scm_pipeline_run, caplog):
+        runner_session.post.return_value.raise_for_status.side_effect = HTTPError("Error", 503)
+        _change(my_scm_pipeline_run, constants.PIPELINE_STATUS_IN_PROGRESS)
+
+        assert notifications.dispatch_pending_notifications() == 0
+
+        notification = PipelineNotification.objects.get()
+        assert notification.attempts == 1
+        assert "Error" in notification.last_error
+        assert notification.next_attempt_at > timezone.now()
+        assert "attempt 1" in caplog.text
+
+        # not due yet, so not retried
+        assert notifications.dispatch_pending_notifications() == 0
+        assert len(runner_session.post.call_args_list) == 1
+
+    def test_backoff_increases(self, runner_session, my_scm_pipeline_run):
+        runner_session.post.side_effect = ConnectionError("refused")
+        _change(my_scm_pipeline_run, constants.PIPELINE_STATUS_IN_PROGRESS)
+
+        delays = []
+        for _ in range(3):
+            PipelineNotification.objects.update(next_attempt_at=timezone.now())
+            before = timezone.now()
+            notifications.dispatch_pending_notifications()
+            delays.append(PipelineNotification.objects.get().next_attempt_at - before)
+
+        assert delays[0] >= timedelta(seconds=5)
+        assert delays[1] >= timedelta(seconds=10)
+        assert delays[2] >= timedelta(seconds=20)
+
+    @override_settings(PIPELINE_NOTIFICATION_MAX_ATTEMPTS=1)
+    def test_gives_up_after_max_attempts(self, runner_session, my_scm_pipeline_run, caplog):
+        runner_session.post.side_effect = ConnectionError("refused")
+        _change(my_scm_pipeline_run, constants.PIPELINE_STATUS_IN_PROGRESS)
+
+        notifications.dispatch_pending_notifications()
+
+        assert not PipelineNotification.objects.exists()
+        assert "Giving up notifying pipeline runner" in caplog.text
+
+    def test_change_during_dispatch_is_kept(self, runner_session, my_scm_pipeline_run):
+        _change(my_scm_pipeline_run, constants.PIPELINE_STATUS_IN_PROGRESS)
+
+        def change_while_sending(*args, **kwargs):
+            notifications.enqueue_notification(my_scm_pipeline_run)
+            return mock.MagicMock()
+
+        runner_session.post.side_effect = change_while_sending
+        assert notifications.dispatch_pending_notifications() == 1
+
+        # the new change still has to be sent
+        assert PipelineNotification.objects.get().version == 3
+
+    def test_concurrent_dispatchers_send_once(self, runner_session, my_scm_pipeline_run, next_scm_pipeline_run):
+        _change(my_scm_pipeline_run, constants.PIPELINE_STATUS_IN_PROGRESS)
+        _change(next_scm_pipeline_run, constants.PIPELINE_STATUS_IN_PROGRESS)
+        dispatched = []
+
+        def dispatch_concurrently(*args, **kwargs):
+            # another dispatcher runs while the first notification is being sent
+            if not dispatched:
+                dispatched.append(None)
+                dispatched[0] = notifications.dispatch_pending_notifications()
+            return mock.MagicMock()
+
+        runner_session.post.side_effect = dispatch_concurrently
+        sent = notifications.dispatch_pending_notifications()
+
+        assert sent + dispatched[0] == 2
+        sent_identifiers = [call[1]["json"]["public_identifier"] for call in runner_session.post.call_args_list]
+        assert sorted(sent_identifiers) == sorted([str(my_scm_pipeline_run.pk), str(next_scm_pipeline_run.pk)])
+        assert not PipelineNotification.objects.exists()
+
+    def test_command_once(self, runner_session, my_scm_pipeline_run):
+        _change(my_scm_pipeline_run, constants.PIPELINE_STATUS_IN_PROGRESS)
+        out = StringIO()
+
+        call_command("katka_dispatch_notifications", "--once", stdout=out)
+
+        assert "Sent 1 notification(s)" in out.getvalue()
+        assert not PipelineNotification.objects.exists()
+
+
+class TestScheduleDispatch:
+    def test_only_one_dispatch_waiting(self):
+        with mock.patch.object(notifications, "_executor") as executor:
+            notifications.schedule_dispatch()
+            notifications.schedule_dispatch()
+
+        executor.submit.assert_called_once_with(notifications._dispatch_in_background)
+        notifications._dispatch_pending = False
+
+    def test_one_retry_timer(self):
+        with mock.patch.object(notifications.threading, "Timer") as timer:
+            notifications.schedule_dispatch(delay=300)
+            notifications.schedule_dispatch(delay=300)
+            notifications.schedule_dispatch(delay=600)
+            assert timer.call_count == 1
+
+            # an earlier retry replaces the timer
+            notifications.schedule_dispatch(delay=10)
+            assert timer.call_count == 2
+            timer.return_value.cancel.assert_called_once_with()
+
+        notifications._dispatch_timer = notifications._dispatch_timer_at = None
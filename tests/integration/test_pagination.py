@@ -0,0 +1,91 @@
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+
+import pytest
+from katka import models
+from katka.fields import username_on_model
+from katka.pagination import encode_cursor
+
+
+@pytest.fixture
+def many_pipeline_runs(application):
+    with username_on_model(models.SCMPipelineRun, "initial"):
+        pipeline_runs = [
+            models.SCMPipelineRun.objects.create(application=application, commit_hash=f"{i:040x}") for i in range(7)
+        ]
+
+    # give some pipeline runs the same creation date, to check that the primary key is used as a tie-breaker
+    models.SCMPipelineRun.objects.filter(pk__in=[p.pk for p in pipeline_runs[2:5]]).update(
+        created_at=pipeline_runs[2].created_at
+    )
+    return pipeline_runs
+
+
+def _walk(client, url, direction):
+    seen = []
+    while url:
+        response = client.get(url)
+        assert response.status_code == 200
+        parsed = response.json()
+        seen.append([item["public_identifier"] for item in parsed["results"]])
+        url = parsed[direction]
+    return seen
+
+
+@pytest.mark.django_db
+class TestKeysetCursorPagination:
+    def test_not_paginated_by_default(self, client, logged_in_user, many_pipeline_runs):
+        response = client.get("/scm-pipeline-runs/")
+        assert response.status_code == 200
+        assert isinstance(response.json(), list)
+        assert len(response.json()) == 7
+
+    def test_walk_forward_and_back(self, client, logged_in_user, many_pipeline_runs):
+        expected = [
+            str(p.pk)
+            for p in models.SCMPipelineRun.objects.filter(pk__in=[p.pk for p in many_pipeline_runs]).order_by(
+                "-created_at", "-pk"
+            )
+        ]
+
+        pages = _walk(client, "/scm-pipeline-runs/?page_size=3", "next")
+        assert [len(page) for page in pages] == [3, 3, 1]
+        assert sum(pages, []) == expected
+
+        last_page = client.get("/scm-pipeline-runs/?page_size=3").json()
+        last_page = client.get(last_page["next"]).json()
+        last_page = client.get(last_page["next"]).json()
+        assert last_page["next"] is None
+
+        backwards = _walk(client, last_page["previous"], "previous")
+        assert sum(reversed(backwards), []) == expected[:6]
+
+    def test_first_page_has_no_previous(self, client, logged_in_user, many_pipeline_runs):
+        parsed = client.get("/scm-pipeline-runs/?page_size=10").json()
+        assert parsed["previous"] is None
+        assert parsed["next"] is None
+        assert len(parsed["results"]) == 7
+
+    def test_no_count_queries(self, client, logged_in_user, many_pipeline_runs):
+        cursor = encode_cursor(many_pipeline_runs[3].created_at, many_pipeline_runs[3].pk)
+        with CaptureQueriesContext(connection) as queries:
+            response = client.get(f"/scm-pipeline-runs/?cursor={cursor}&page_size=2")
+
+        assert response.status_code == 200
+        assert not [query for query in queries if "COUNT(" in query["sql"].upper()]
+
+    def test_invalid_cursor(self, client, logged_in_user, many_pipeline_runs):
+        response = client.get("/scm-pipeline-runs/?cursor=not-a-cursor")
+        assert response.status_code == 404
+
+    def test_filtered_step_runs(self, client, logged_in_user, scm_step_run, my_scm_pipeline_run):
+        response = client.get(f"/scm-step-runs/?scm_pipeline_run={my_scm_pipeline_run.pk}&page_size=1")
+        assert response.status_code == 200
+        parsed = response.json()
+        assert len(parsed["results"]) == 1
+        assert parsed["results"][0]["public_identifier"] == str(scm_step_run.pk)
+        assert parsed["next"] is None
+
+    def test_releases(self, client, logged_in_user, scm_release, another_scm_release):
+        pages = _walk(client, "/scm-releases/?page_size=1", "next")
+        assert sum(pages, []) == [str(another_scm_release.pk), str(scm_release.pk)]
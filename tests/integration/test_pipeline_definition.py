@@ -0,0 +1,112 @@
+import zlib
+
+from django.db import connection
+from django.db.migrations.executor import MigrationExecutor
+
+import pytest
+from katka.fields import username_on_model
+from katka.models import PipelineDefinition, SCMPipelineRun
+
+PIPELINE_YAML = """stages:
+  - deploy
+
+do-deploy:
+  stage: deploy"""
+
+
+@pytest.mark.django_db
+class TestPipelineDefinition:
+    def test_identical_yaml_stored_once(self, application):
+        with username_on_model(SCMPipelineRun, "initial"):
+            first = SCMPipelineRun.objects.create(application=application, commit_hash="1", pipeline_yaml=PIPELINE_YAML)
+            second = SCMPipelineRun.objects.create(
+                application=application, commit_hash="2", pipeline_yaml=PIPELINE_YAML
+            )
+
+        assert first.definition_id == second.definition_id
+        assert PipelineDefinition.objects.filter(pk=first.definition_id).count() == 1
+        assert zlib.decompress(PipelineDefinition.objects.get(pk=first.definition_id).data).decode() == PIPELINE_YAML
+        assert SCMPipelineRun.objects.get(pk=second.pk).pipeline_yaml == PIPELINE_YAML
+
+    def test_default(self, application):
+        with username_on_model(SCMPipelineRun, "initial"):
+            pipeline = SCMPipelineRun.objects.create(application=application, commit_hash="1")
+
+        assert pipeline.definition.yaml == SCMPipelineRun.DEFAULT_PIPELINE_YAML
+        assert SCMPipelineRun(application=application).pipeline_yaml == SCMPipelineRun.DEFAULT_PIPELINE_YAML
+
+    def test_changed_yaml(self, scm_pipeline_run):
+        old_definition_id = scm_pipeline_run.definition_id
+        scm_pipeline_run.pipeline_yaml = PIPELINE_YAML
+        with username_on_model(SCMPipelineRun, "modified"):
+            scm_pipeline_run.save()
+
+        assert scm_pipeline_run.definition_id != old_definition_id
+        assert SCMPipelineRun.objects.get(pk=scm_pipeline_run.pk).pipeline_yaml == PIPELINE_YAML
+        # the old definition is kept, it is still used by other pipeline runs
+        assert PipelineDefinition.objects.filter(pk=old_definition_id).exists()
+
+
+@pytest.mark.django_db
+class TestPipelineYamlAPI:
+    def test_create_and_update(self, client, logged_in_user, application):
+        response = client.post(
+            "/scm-pipeline-runs/",
+            {"application": str(application.pk), "commit_hash": "1234", "pipeline_yaml": PIPELINE_YAML},
+            content_type="application/json",
+        )
+        assert response.status_code == 201
+        assert response.json()["pipeline_yaml"] == PIPELINE_YAML
+        public_identifier = response.json()["public_identifier"]
+
+        response = client.patch(
+            f"/scm-pipeline-runs/{public_identifier}/", {"pipeline_yaml": "---"}, content_type="application/json",
+        )
+        assert response.status_code == 200
+        assert response.json()["pipeline_yaml"] == "---"
+
+        response = client.get(f"/scm-pipeline-runs/{public_identifier}/")
+        assert response.json()["pipeline_yaml"] == "---"
+
+    def test_list_without_query_per_pipeline(self, client, logged_in_user, application, django_assert_max_num_queries):
+        with username_on_model(SCMPipelineRun, "initial"):
+            for i in range(10):
+                SCMPipelineRun.objects.create(application=application, commit_hash=str(i), pipeline_yaml=f"{i}: x")
+
+        with django_assert_max_num_queries(6):
+            response = client.get("/scm-pipeline-runs/")
+
+        assert response.status_code == 200
+        assert sorted(pipeline["pipeline_yaml"] for pipeline in response.json()) == [f"{i}: x" for i in range(10)]
+
+
+@pytest.mark.django_db(transaction=True)
+def test_deduplicate_migration(application):
+    with username_on_model(SCMPipelineRun, "initial"):
+        for i in range(3):
+            SCMPipelineRun.objects.create(
+                application=application, commit_hash=str(i), pipeline_yaml=PIPELINE_YAML if i else "---"
+            )
+
+    # migrating backwards copies the YAML back to the pipeline runs
+    executor = MigrationExecutor(connection)
+    executor.migrate([("katka", "0042_pipelinedefinition")])
+    apps = executor.loader.project_state([("katka", "0042_pipelinedefinition")]).apps
+    OldSCMPipelineRun = apps.get_model("katka", "SCMPipelineRun")
+    assert list(OldSCMPipelineRun.objects.order_by("commit_hash").values_list("pipeline_yaml", flat=True)) == [
+        "---",
+        PIPELINE_YAML,
+        PIPELINE_YAML,
+    ]
+    OldSCMPipelineRun.objects.update(definition=None)
+    apps.get_model("katka", "PipelineDefinition").objects.all().delete()
+
+    executor = MigrationExecutor(connection)
+    executor.migrate(executor.loader.graph.leaf_nodes())
+
+    assert PipelineDefinition.objects.count() == 2
+    assert [pipeline.pipeline_yaml for pipeline in SCMPipelineRun.objects.order_by("commit_hash")] == [
+        "---",
+        PIPELINE_YAML,
+        PIPELINE_YAML,
+    ]
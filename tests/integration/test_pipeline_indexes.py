@@ -0,0 +1,115 @@
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+
+import pytest
+from katka import models
+from katka.constants import PIPELINE_STATUS_SUCCESS
+from katka.fields import username_on_model
+from katka.pagination import encode_cursor
+
+pytestmark = pytest.mark.skipif(connection.vendor != "sqlite", reason="query plans are checked with SQLite")
+
+
+def query_plan(sql):
+    with connection.cursor() as cursor:
+        cursor.execute(f"EXPLAIN QUERY PLAN {sql}")
+        return [row[-1] for row in cursor.fetchall()]
+
+
+def pipeline_queries(queries, condition):
+    return [
+        query["sql"]
+        for query in queries
+        if query["sql"].startswith("SELECT")
+        and 'FROM "katka_scmpipelinerun"' in query["sql"]
+        and condition in query["sql"]
+    ]
+
+
+@pytest.fixture(params=[500, 5000], ids=["history-500", "history-5000"])
+def pipeline_history(request, my_application):
+    """Finished pipeline runs of the application, which the queue lookups should not have to scan"""
+    pipelines = [
+        models.SCMPipelineRun(
+            application=my_application,
+            team_id=my_application.project.team_id,
+            commit_hash=f"{i:040X}",
+            first_parent_hash=f"{i - 1:040X}" if i else None,
+            status=PIPELINE_STATUS_SUCCESS,
+        )
+        for i in range(request.param)
+    ]
+    with username_on_model(models.SCMPipelineRun, "initial"):
+        models.SCMPipelineRun.objects.bulk_create(pipelines)
+    with connection.cursor() as cursor:
+        cursor.execute("ANALYZE")
+
+    return pipelines
+
+
+@pytest.mark.django_db
+class TestPipelineQueueIndexes:
+    def assert_index_used(self, sql, index_name, partial=False):
+        plan = query_plan(sql)
+        steps = [step for step in plan if "katka_scmpipelinerun " in step]
+        assert len(steps) == 1, plan
+        assert f"USING INDEX {index_name}" in steps[0], plan
+        if partial:
+            # the partial index only holds the matching rows, in the order they are returned
+            assert not any("TEMP B-TREE" in step for step in plan), plan
+        else:
+            # any other index has to be searched instead of scanned
+            assert steps[0].startswith("SEARCH"), plan
+
+    def test_queued_pipelines(self, client, logged_in_user, pipeline_history, queued_scm_pipeline_run):
+        with CaptureQueriesContext(connection) as queries:
+            response = client.get("/queued-scm-pipeline-runs/")
+
+        assert response.status_code == 200
+        assert len(response.json()) == 1
+        sql = pipeline_queries(queries, '"status" = ')
+        assert len(sql) == 1
+        self.assert_index_used(sql[0], "queued_pipeline_idx", partial=True)
+
+    def test_next_pipeline(self, client, logged_in_user, pipeline_history, scm_pipeline_run, next_scm_pipeline_run):
+        with CaptureQueriesContext(connection) as queries:
+            response = client.patch(
+                f"/scm-pipeline-runs/{scm_pipeline_run.public_identifier}/",
+                {"status": PIPELINE_STATUS_SUCCESS},
+                content_type="application/json",
+            )
+
+        assert response.status_code == 200
+        sql = pipeline_queries(queries, '"first_parent_hash" = ')
+        assert len(sql) == 1
+        self.assert_index_used(sql[0], "pipeline_first_parent_idx")
+
+    def test_parent_pipeline(self, client, logged_in_user, pipeline_history, scm_pipeline_run, next_scm_pipeline_run):
+        with CaptureQueriesContext(connection) as queries:
+            response = client.patch(
+                f"/scm-pipeline-runs/{next_scm_pipeline_run.public_identifier}/",
+                {"status": "in progress"},
+                content_type="application/json",
+            )
+
+        assert response.status_code == 200
+        sql = pipeline_queries(queries, '"commit_hash" = ')
+        assert len(sql) == 1
+        # the unique constraint on the commit hash and application
+        self.assert_index_used(sql[0], "sqlite_autoindex_katka_scmpipelinerun")
+
+    def test_changes_feed(self, settings, client, logged_in_user, pipeline_history):
+        settings.CHANGES_FEED_DELAY = 0
+        last = models.SCMPipelineRun.objects.order_by("modified_at", "pk")[100]
+        cursor = encode_cursor(last.modified_at, last.pk)
+        with CaptureQueriesContext(connection) as queries:
+            response = client.get(f"/scm-pipeline-runs/changes/?cursor={cursor}&page_size=10")
+
+        assert response.status_code == 200
+        assert len(response.json()["results"]) == 10
+        sql = pipeline_queries(queries, '"modified_at" > ')
+        assert len(sql) == 1
+        plan = query_plan(sql[0])
+        # the runs are read in order of modification from the index, without sorting all the changes
+        assert any("katka_scmpi_modifie_b8170e_idx" in step for step in plan), plan
+        assert not any("TEMP B-TREE" in step for step in plan), plan
@@ -0,0 +1,68 @@
+import logging
+
+from django.contrib.auth.models import User
+from django.test import override_settings
+
+import pytest
+from katka import views
+from katka.models import SCMPipelineRun, Team
+from katka.query_detector import detect_queries
+from katka.serializers import SCMPipelineRunSerializer
+from katka.utils import get_team_ids
+
+
+@pytest.fixture
+def caplog(caplog):
+    caplog.set_level(logging.WARNING, logger="katka")
+    return caplog
+
+
+@pytest.mark.django_db
+class TestQueryDetector:
+    def test_duplicate_queries_of_serializer_field(self, caplog, my_scm_pipeline_run, another_scm_pipeline_run):
+        # the pipeline runs share their pipeline definition, which is loaded for each of them without select_related
+        pipeline_runs = SCMPipelineRun.objects.filter(pk__in=[my_scm_pipeline_run.pk, another_scm_pipeline_run.pk])
+
+        with detect_queries(views.SCMPipelineRunViewSet()) as detector:
+            SCMPipelineRunSerializer(pipeline_runs, many=True).data
+
+        ((sql, count, origins),) = detector.duplicates()
+        assert 'FROM "katka_pipelinedefinition"' in sql
+        assert count == 2
+        assert origins == ["SCMPipelineRunSerializer.pipeline_yaml"]
+        assert caplog.messages == [
+            f"Identical query executed 2 times in SCMPipelineRunViewSet.unknown, "
+            f"from SCMPipelineRunSerializer.pipeline_yaml: {sql}"
+        ]
+
+    def test_origin_in_katka(self, user):
+        with detect_queries(views.TeamViewSet()) as detector:
+            get_team_ids(User.objects.get(pk=user.pk))
+
+        origins = [origin for _, origins in detector.executed.values() for origin in origins]
+        assert any(origin.startswith("katka.utils.get_team_ids:") for origin in origins)
+
+    def test_different_parameters_are_no_duplicates(self, caplog, team):
+        with detect_queries(views.TeamViewSet()) as detector:
+            Team.objects.filter(slug="one").exists()
+            Team.objects.filter(slug="two").exists()
+
+        assert detector.duplicates() == []
+        assert caplog.messages == []
+
+    @override_settings(QUERY_DETECTOR=True, QUERY_DETECTOR_SLOW_MS=0)
+    def test_slow_queries_of_view(self, caplog, client, logged_in_user, scm_pipeline_run):
+        response = client.get("/scm-pipeline-runs/")
+
+        assert response.status_code == 200
+        assert caplog.messages
+        assert all(message.startswith("Slow query of ") for message in caplog.messages)
+        assert all(" in SCMPipelineRunViewSet.list, from " in message for message in caplog.messages)
+        assert any("from katka.utils.get_team_ids:" in message for message in caplog.messages)
+
+    def test_disabled_by_default(self, caplog, client, logged_in_user, scm_pipeline_run):
+        with override_settings(QUERY_DETECTOR_SLOW_MS=0):
+            response = client.get("/scm-pipeline-runs/")
+
+        assert response.status_code == 200
+        assert caplog.messages == []
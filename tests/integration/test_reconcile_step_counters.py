@@ -0,0 +1,47 @@
+from io import StringIO
+
+from django.core.management import call_command
+
+import pytest
+from katka import constants
+from katka.counters import reconcile_step_counters
+from katka.models import SCMPipelineRun
+
+
+@pytest.mark.django_db
+class TestReconcileStepCounters:
+    def test_fixes_out_of_sync_counters(self, scm_step_run, my_scm_pipeline_run, another_scm_pipeline_run):
+        SCMPipelineRun.objects.filter(pk=my_scm_pipeline_run.pk).update(steps_total=10, steps_completed=3)
+        scm_step_run.__class__.objects.filter(pk=scm_step_run.pk).update(status=constants.STEP_STATUS_SUCCESS)
+
+        assert reconcile_step_counters(batch_size=1) == 1
+
+        my_scm_pipeline_run.refresh_from_db()
+        another_scm_pipeline_run.refresh_from_db()
+        # scm_step_run and deactivated_scm_step_run both belong to this pipeline
+        assert (my_scm_pipeline_run.steps_total, my_scm_pipeline_run.steps_completed) == (2, 1)
+        assert (another_scm_pipeline_run.steps_total, another_scm_pipeline_run.steps_completed) == (1, 0)
+
+    def test_sets_modified_at(self, scm_step_run, my_scm_pipeline_run):
+        SCMPipelineRun.objects.filter(pk=my_scm_pipeline_run.pk).update(steps_total=10)
+        my_scm_pipeline_run.refresh_from_db()
+        modified_at = my_scm_pipeline_run.modified_at
+
+        reconcile_step_counters()
+
+        # the changes feed reports the pipeline run again
+        my_scm_pipeline_run.refresh_from_db()
+        assert my_scm_pipeline_run.modified_at > modified_at
+
+    def test_nothing_to_fix(self, scm_step_run):
+        assert reconcile_step_counters() == 0
+
+    def test_command(self, scm_step_run, my_scm_pipeline_run):
+        SCMPipelineRun.objects.filter(pk=my_scm_pipeline_run.pk).update(steps_total=10)
+        out = StringIO()
+
+        call_command("katka_reconcile_step_counters", "--batch-size=10", stdout=out)
+
+        assert "Updated the step counters of 1 pipeline run(s)" in out.getvalue()
+        my_scm_pipeline_run.refresh_from_db()
+        assert my_scm_pipeline_run.steps_total == 2
@@ -25,6 +25,23 @@ class TestSCMPipelineRunViewSet:
         UUID(parsed[0]["public_identifier"])  # should not raise
         assert len(parsed[0]["scmrelease_set"]) == 1
 
+    def test_list_query_budget(
+        self,
+        client,
+        logged_in_user,
+        scm_pipeline_run,
+        scm_release,
+        scm_releases_with_multi_pipeline_runs,
+        django_assert_num_queries,
+    ):
+        # session, user, teams of the user, pipeline runs and the prefetched releases; regardless of the number of
+        # pipeline runs
+        with django_assert_num_queries(5):
+            response = client.get("/scm-pipeline-runs/")
+
+        assert len(response.json()) == 4
+        assert sum(len(p["scmrelease_set"]) for p in response.json()) == 4
+
     def test_filtered_list(
         self,
         client,
@@ -19,6 +19,17 @@ class TestSCMReleaseViewSet:
         assert UUID(parsed[0]["scm_pipeline_runs"][0]) == my_scm_pipeline_run.public_identifier
         UUID(parsed[0]["public_identifier"])  # should not raise
 
+    def test_list_query_budget(
+        self, client, logged_in_user, scm_release, multiple_scm_releases, django_assert_num_queries
+    ):
+        # session, user, teams of the user, releases and the prefetched pipeline runs; regardless of the number of
+        # releases
+        with django_assert_num_queries(5):
+            response = client.get("/scm-releases/")
+
+        assert len(response.json()) == 4
+        assert sum(len(r["scm_pipeline_runs"]) for r in response.json()) == 5
+
     def test_filtered_list(
         self, client, logged_in_user, my_scm_pipeline_run, my_scm_release, another_scm_pipeline_run, another_scm_release
     ):
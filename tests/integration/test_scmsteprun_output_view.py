@@ -0,0 +1,111 @@
+import pytest
+from katka import models
+from katka.step_output import append_output, read_output
+
+
+def output_url(step):
+    return f"/scm-step-runs/{step.public_identifier}/output/"
+
+
+@pytest.mark.django_db
+class TestSCMStepRunOutputView:
+    def test_append(self, client, logged_in_user, my_scm_step_run):
+        response = client.post(output_url(my_scm_step_run), {"data": "line 1\n"}, content_type="application/json")
+        assert response.status_code == 201
+        assert response.json() == {"sequence": 0, "offset": 0, "next_offset": 7}
+
+        response = client.post(output_url(my_scm_step_run), {"data": "line 2\n"}, content_type="application/json")
+        assert response.status_code == 201
+        assert response.json() == {"sequence": 1, "offset": 7, "next_offset": 14}
+
+        response = client.get(output_url(my_scm_step_run))
+        assert response.status_code == 200
+        assert response.json() == {"offset": 0, "next_offset": 14, "data": "line 1\nline 2\n"}
+
+    def test_read_from_offset(self, client, logged_in_user, my_scm_step_run):
+        for text in ("first\n", "second\n", "third\n"):
+            append_output(my_scm_step_run, text)
+
+        response = client.get(output_url(my_scm_step_run) + "?offset=9")
+        assert response.status_code == 200
+        assert response.json() == {"offset": 9, "next_offset": 19, "data": "ond\nthird\n"}
+
+        response = client.get(output_url(my_scm_step_run) + "?offset=19")
+        assert response.json() == {"offset": 19, "next_offset": 19, "data": ""}
+
+    def test_read_with_limit(self, client, logged_in_user, my_scm_step_run):
+        for text in ("first\n", "second\n", "third\n"):
+            append_output(my_scm_step_run, text)
+
+        response = client.get(output_url(my_scm_step_run) + "?offset=2&limit=10")
+        assert response.json() == {"offset": 2, "next_offset": 12, "data": "rst\nsecond"}
+
+    def test_max_limit(self, client, logged_in_user, my_scm_step_run, settings):
+        settings.STEP_OUTPUT_READ_LIMIT = 4
+        append_output(my_scm_step_run, "first\n")
+
+        response = client.get(output_url(my_scm_step_run) + "?limit=10")
+        assert response.json() == {"offset": 0, "next_offset": 4, "data": "firs"}
+
+    @pytest.mark.parametrize("query", ["offset=-1", "offset=abc", "limit=0"])
+    def test_invalid_read_parameters(self, client, logged_in_user, my_scm_step_run, query):
+        response = client.get(output_url(my_scm_step_run) + f"?{query}")
+        assert response.status_code == 400
+
+    def test_append_empty(self, client, logged_in_user, my_scm_step_run):
+        response = client.post(output_url(my_scm_step_run), {"data": ""}, content_type="application/json")
+        assert response.status_code == 400
+        assert not models.SCMStepRunOutputChunk.objects.exists()
+
+    def test_other_team(self, client, logged_in_user, not_my_scm_step_run):
+        response = client.post(output_url(not_my_scm_step_run), {"data": "line"}, content_type="application/json")
+        assert response.status_code == 404
+
+        response = client.get(output_url(not_my_scm_step_run))
+        assert response.status_code == 404
+
+    def test_append_does_not_read_previous_chunks(
+        self, client, logged_in_user, my_scm_step_run, django_assert_num_queries
+    ):
+        # lock the step, get the last chunk and insert the new chunk, plus the savepoint queries of the transaction
+        append_output(my_scm_step_run, "first\n")
+        with django_assert_num_queries(5):
+            append_output(my_scm_step_run, "second\n")
+
+        for i in range(50):
+            append_output(my_scm_step_run, f"line {i}\n")
+        with django_assert_num_queries(5):
+            append_output(my_scm_step_run, "last\n")
+
+
+@pytest.mark.django_db
+class TestCompression:
+    @pytest.fixture(autouse=True)
+    def compression(self, settings):
+        settings.STEP_OUTPUT_COMPRESSION = True
+        settings.STEP_OUTPUT_COMPRESSION_MIN_SIZE = 100
+
+    def test_compressed(self, my_scm_step_run):
+        text = "a line of output that repeats\n" * 100
+        chunk = append_output(my_scm_step_run, text)
+
+        assert chunk.compressed
+        assert len(chunk.data) < len(text)
+        assert chunk.end_offset == len(text)
+        assert read_output(my_scm_step_run) == (text, len(text))
+
+    def test_small_chunks_not_compressed(self, my_scm_step_run):
+        chunk = append_output(my_scm_step_run, "short\n")
+
+        assert not chunk.compressed
+        assert read_output(my_scm_step_run) == ("short\n", 6)
+
+    def test_mixed_chunks(self, my_scm_step_run):
+        text = "a line of output that repeats\n" * 100
+        append_output(my_scm_step_run, "short\n")
+        append_output(my_scm_step_run, text)
+        append_output(my_scm_step_run, "ünïcode\n")
+
+        output, next_offset = read_output(my_scm_step_run, offset=3)
+        assert output == "rt\n" + text + "ünïcode\n"
+        assert next_offset == 6 + len(text) + 8
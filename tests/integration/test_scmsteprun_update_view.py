@@ -3,7 +3,7 @@ from unittest import mock
 from django.test import override_settings
 
 import pytest
-from requests import HTTPError
+from requests import ConnectionError, HTTPError
 
 
 @pytest.mark.django_db
@@ -56,3 +56,15 @@ class TestUpdateStatusSCMStepRunView:
             response = client.patch(url, data, content_type="application/json")
 
         assert response.status_code == 503
+
+    def test_pipeline_runner_unreachable(self, client, logged_in_user, scm_step_run):
+        url = f"/update-scm-step-run/{scm_step_run.public_identifier}/"
+
+        session = mock.Mock()
+        session.post = mock.Mock(side_effect=ConnectionError)
+        overrides = {"PIPELINE_RUNNER_SESSION": session, "PIPELINE_RUNNER_RETRIES": 1}
+        with override_settings(**overrides):
+            response = client.patch(url, {"status": "success"}, content_type="application/json")
+
+        assert response.status_code == 503
+        assert session.post.call_count == 2
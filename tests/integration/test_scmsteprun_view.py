@@ -1,9 +1,13 @@
+from unittest import mock
 from uuid import UUID
 
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
 from django.utils.dateparse import parse_datetime
 
 import pytest
 from katka import models
+from katka.fields import username_on_model
 
 
 @pytest.mark.django_db
@@ -137,3 +141,197 @@ class TestSCMStepRunViewSet:
         assert response.status_code == 201
         assert models.SCMStepRun.objects.filter(name="Release product").exists()
         assert models.SCMStepRun.objects.count() == initial_count + 1
+
+
+def bulk_steps(pipeline, statuses):
+    return [
+        {
+            "slug": f"step-{i}",
+            "name": f"Step {i}",
+            "stage": "Production",
+            "status": status,
+            "sequence_id": i,
+            "scm_pipeline_run": str(pipeline.public_identifier),
+        }
+        for i, status in enumerate(statuses)
+    ]
+
+
+@pytest.mark.django_db
+class TestSCMStepRunBulkCreate:
+    def test_bulk_create(self, client, logged_in_user, my_team, my_scm_pipeline_run):
+        data = bulk_steps(my_scm_pipeline_run, ["not started", "not started", "success"])
+        response = client.post("/scm-step-runs/bulk/", data=data, content_type="application/json")
+
+        assert response.status_code == 201
+        parsed = response.json()
+        assert [step["slug"] for step in parsed] == ["step-0", "step-1", "step-2"]
+        steps = models.SCMStepRun.objects.filter(scm_pipeline_run=my_scm_pipeline_run)
+        assert steps.count() == 3
+        for step in steps:
+            assert step.team_id == my_team.pk
+            assert step.created_username == "test_user"
+            assert str(step.public_identifier) in [step["public_identifier"] for step in parsed]
+
+        my_scm_pipeline_run.refresh_from_db()
+        assert my_scm_pipeline_run.steps_total == 3
+        assert my_scm_pipeline_run.steps_completed == 1
+        assert my_scm_pipeline_run.modified_username == "test_user"
+
+    def test_single_insert_and_pipeline_update(self, client, logged_in_user, my_scm_pipeline_run):
+        data = bulk_steps(my_scm_pipeline_run, ["not started"] * 20)
+        with CaptureQueriesContext(connection) as queries:
+            response = client.post("/scm-step-runs/bulk/", data=data, content_type="application/json")
+
+        assert response.status_code == 201
+        statements = [query["sql"] for query in queries]
+        assert len([sql for sql in statements if sql.startswith('INSERT INTO "katka_scmsteprun"')]) == 1
+        assert len([sql for sql in statements if sql.startswith('UPDATE "katka_scmpipelinerun"')]) == 1
+        assert len([sql for sql in statements if sql.startswith('SELECT "katka_scmpipelinerun"')]) == 1
+
+    def test_incremental_counters(self, client, logged_in_user, my_scm_pipeline_run, settings):
+        settings.INCREMENTAL_STEP_COUNTERS = True
+        data = bulk_steps(my_scm_pipeline_run, ["not started", "success", "failed"])
+        response = client.post("/scm-step-runs/bulk/", data=data, content_type="application/json")
+
+        assert response.status_code == 201
+        my_scm_pipeline_run.refresh_from_db()
+        assert my_scm_pipeline_run.steps_total == 5 + 3
+        assert my_scm_pipeline_run.steps_completed == 2
+
+    def test_invalid_step(self, client, logged_in_user, my_scm_pipeline_run):
+        data = bulk_steps(my_scm_pipeline_run, ["not started", "not a status"])
+        response = client.post("/scm-step-runs/bulk/", data=data, content_type="application/json")
+
+        assert response.status_code == 400
+        assert "status" in response.json()[1]
+        assert not models.SCMStepRun.objects.filter(scm_pipeline_run=my_scm_pipeline_run).exists()
+
+    def test_pipeline_of_other_team(self, client, logged_in_user, my_scm_pipeline_run, not_my_scm_pipeline_run):
+        data = bulk_steps(my_scm_pipeline_run, ["not started"]) + bulk_steps(not_my_scm_pipeline_run, ["not started"])
+        response = client.post("/scm-step-runs/bulk/", data=data, content_type="application/json")
+
+        assert response.status_code == 403
+        assert not models.SCMStepRun.objects.exists()
+
+    def test_not_a_list(self, client, logged_in_user, my_scm_pipeline_run):
+        data = bulk_steps(my_scm_pipeline_run, ["not started"])[0]
+        response = client.post("/scm-step-runs/bulk/", data=data, content_type="application/json")
+
+        assert response.status_code == 400
+        assert not models.SCMStepRun.objects.exists()
+
+
+@pytest.mark.django_db
+class TestSCMStepRunBulkUpdate:
+    def test_bulk_update(self, client, logged_in_user, my_scm_step_run, another_scm_step_run):
+        data = [
+            {
+                "public_identifier": str(my_scm_step_run.public_identifier),
+                "status": "success",
+                "ended_at": "2018-11-11T09:05:00Z",
+                "output": '{"release.version": "1.0.0"}',
+            },
+            {"public_identifier": str(another_scm_step_run.public_identifier), "status": "failed"},
+        ]
+        response = client.patch("/scm-step-runs/bulk/", data=data, content_type="application/json")
+
+        assert response.status_code == 200
+        parsed = {step["public_identifier"]: step for step in response.json()}
+        assert parsed[str(my_scm_step_run.public_identifier)]["status"] == "success"
+        assert parsed[str(another_scm_step_run.public_identifier)]["status"] == "failed"
+
+        my_scm_step_run.refresh_from_db()
+        assert my_scm_step_run.status == "success"
+        assert my_scm_step_run.ended_at == parse_datetime("2018-11-11T09:05:00Z")
+        assert my_scm_step_run.output == '{"release.version": "1.0.0"}'
+        assert my_scm_step_run.modified_username == "test_user"
+        another_scm_step_run.refresh_from_db()
+        assert another_scm_step_run.status == "failed"
+        assert another_scm_step_run.ended_at is None
+        assert another_scm_step_run.modified_username == "test_user"
+
+        for step in (my_scm_step_run, another_scm_step_run):
+            pipeline = models.SCMPipelineRun.objects.get(pk=step.scm_pipeline_run_id)
+            assert pipeline.steps_total == 1
+            assert pipeline.steps_completed == 1
+            assert pipeline.modified_username == "test_user"
+
+    def test_single_update_per_table(self, client, logged_in_user, my_scm_pipeline_run):
+        with username_on_model(models.SCMStepRun, "initial"):
+            steps = [
+                models.SCMStepRun.objects.create(slug=f"step-{i}", scm_pipeline_run=my_scm_pipeline_run)
+                for i in range(20)
+            ]
+
+        data = [{"public_identifier": str(step.public_identifier), "status": "success"} for step in steps]
+        with CaptureQueriesContext(connection) as queries:
+            response = client.patch("/scm-step-runs/bulk/", data=data, content_type="application/json")
+
+        assert response.status_code == 200
+        statements = [query["sql"] for query in queries]
+        assert len([sql for sql in statements if sql.startswith('UPDATE "katka_scmsteprun"')]) == 1
+        assert len([sql for sql in statements if sql.startswith('UPDATE "katka_scmpipelinerun"')]) == 1
+        my_scm_pipeline_run.refresh_from_db()
+        assert my_scm_pipeline_run.steps_completed == 20
+
+    def test_incremental_counters(self, client, logged_in_user, my_scm_pipeline_run, my_scm_step_run, settings):
+        settings.INCREMENTAL_STEP_COUNTERS = True
+        my_scm_pipeline_run.refresh_from_db()
+        steps_total = my_scm_pipeline_run.steps_total
+
+        data = [{"public_identifier": str(my_scm_step_run.public_identifier), "status": "success"}]
+        response = client.patch("/scm-step-runs/bulk/", data=data, content_type="application/json")
+
+        assert response.status_code == 200
+        my_scm_pipeline_run.refresh_from_db()
+        assert my_scm_pipeline_run.steps_total == steps_total
+        assert my_scm_pipeline_run.steps_completed == 1
+
+    def test_release_checked_once_per_pipeline(self, client, logged_in_user, my_scm_pipeline_run):
+        with username_on_model(models.SCMStepRun, "initial"):
+            steps = [
+                models.SCMStepRun.objects.create(slug=f"step-{i}", scm_pipeline_run=my_scm_pipeline_run)
+                for i in range(3)
+            ]
+
+        data = [{"public_identifier": str(step.public_identifier), "status": "success"} for step in steps]
+        with mock.patch("katka.signals.close_release_if_pipeline_finished") as close_from_signal, mock.patch(
+            "katka.views.close_release_if_pipeline_finished"
+        ) as close_from_view:
+            response = client.patch("/scm-step-runs/bulk/", data=data, content_type="application/json")
+
+        assert response.status_code == 200
+        assert close_from_signal.call_count + close_from_view.call_count == 1
+
+    def test_release_checked_when_counters_unchanged(self, client, logged_in_user, my_scm_step_run):
+        data = [{"public_identifier": str(my_scm_step_run.public_identifier), "output": "{}"}]
+        with mock.patch("katka.views.close_release_if_pipeline_finished") as close_release:
+            response = client.patch("/scm-step-runs/bulk/", data=data, content_type="application/json")
+
+        assert response.status_code == 200
+        close_release.assert_called_once()
+        assert close_release.call_args[0][0].pk == my_scm_step_run.scm_pipeline_run_id
+
+    def test_unknown_step(self, client, logged_in_user, my_scm_step_run, not_my_scm_step_run):
+        data = [
+            {"public_identifier": str(my_scm_step_run.public_identifier), "status": "success"},
+            {"public_identifier": str(not_my_scm_step_run.public_identifier), "status": "success"},
+        ]
+        response = client.patch("/scm-step-runs/bulk/", data=data, content_type="application/json")
+
+        assert response.status_code == 404
+        assert str(not_my_scm_step_run.public_identifier) in response.json()["detail"]
+        my_scm_step_run.refresh_from_db()
+        assert my_scm_step_run.status == "not started"
+
+    def test_duplicate_step(self, client, logged_in_user, my_scm_step_run):
+        data = [
+            {"public_identifier": str(my_scm_step_run.public_identifier), "status": "success"},
+            {"public_identifier": str(my_scm_step_run.public_identifier), "status": "failed"},
+        ]
+        response = client.patch("/scm-step-runs/bulk/", data=data, content_type="application/json")
+
+        assert response.status_code == 400
+        my_scm_step_run.refresh_from_db()
+        assert my_scm_step_run.status == "not started"
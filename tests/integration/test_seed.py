@@ -0,0 +1,97 @@
+from datetime import timedelta
+from io import StringIO
+
+from django.core.management import call_command
+from django.db import transaction
+
+import pytest
+from katka import constants
+from katka.models import Application, ApplicationMetadata, SCMPipelineRun, SCMRelease, SCMStepRun, Team
+from katka.seed import EPOCH, STEPS, seed
+
+
+@pytest.mark.django_db
+class TestSeed:
+    def test_counts(self):
+        counts = seed(teams=2, applications_per_team=3, pipeline_runs_per_application=5, batch_size=7)
+
+        assert counts["auth.Group"] == 2
+        assert counts["katka.Team"] == Team.objects.count() == 2
+        assert counts["katka.Application"] == Application.objects.count() == 6
+        assert counts["katka.SCMPipelineRun"] == SCMPipelineRun.objects.count() == 30
+        assert counts["katka.SCMStepRun"] == SCMStepRun.objects.count() == 30 * len(STEPS)
+        assert counts["katka.SCMRelease"] == SCMRelease.objects.count()
+        assert counts["katka.SCMRelease_scm_pipeline_runs"] == 30
+
+    def test_commit_chains(self):
+        seed(teams=1, applications_per_team=2, pipeline_runs_per_application=20)
+
+        for application in Application.objects.all():
+            parents = dict(application.scmpipelinerun_set.values_list("commit_hash", "first_parent_hash"))
+            (first,) = [commit for commit, parent in parents.items() if parent is None]
+            # following the children from the first commit visits all pipeline runs once
+            children = {parent: commit for commit, parent in parents.items()}
+            chain = [first]
+            while chain[-1] in children:
+                chain.append(children[chain[-1]])
+            assert len(chain) == 20
+
+    def test_consistent(self):
+        seed(teams=1, applications_per_team=2, pipeline_runs_per_application=20)
+
+        for pipeline_run in SCMPipelineRun.objects.all():
+            steps = pipeline_run.scmsteprun_set.all()
+            assert pipeline_run.team_id == pipeline_run.application.project.team_id
+            assert pipeline_run.steps_total == len(steps)
+            assert pipeline_run.steps_completed == len(
+                [step for step in steps if step.status in constants.STEP_FINAL_STATUSES]
+            )
+            assert pipeline_run.pipeline_yaml.startswith("stages:")
+
+        in_progress = SCMPipelineRun.objects.filter(status=constants.PIPELINE_STATUS_IN_PROGRESS)
+        assert in_progress.count() == 2
+        assert (
+            SCMRelease.objects.filter(
+                status=constants.RELEASE_STATUS_IN_PROGRESS, scm_pipeline_runs__in=in_progress
+            ).count()
+            == 2
+        )
+        assert SCMStepRun.objects.filter(tags__contains=constants.TAG_PRODUCTION_CHANGE_STARTED).exists()
+
+    def test_deterministic(self):
+        with transaction.atomic():
+            seed(teams=1, applications_per_team=2, pipeline_runs_per_application=10, seed=42)
+            first = list(SCMStepRun.objects.order_by("pk").values_list("pk", "status", "output", "started_at"))
+            transaction.set_rollback(True)
+
+        assert not SCMStepRun.objects.exists()
+        seed(teams=1, applications_per_team=2, pipeline_runs_per_application=10, seed=42)
+
+        assert list(SCMStepRun.objects.order_by("pk").values_list("pk", "status", "output", "started_at")) == first
+
+    def test_deterministic_audit_timestamps(self):
+        with transaction.atomic():
+            seed(teams=1, applications_per_team=2, pipeline_runs_per_application=10, seed=42)
+            first = {
+                model: list(
+                    model.objects.order_by("created_at", "modified_at").values_list("created_at", "modified_at")
+                )
+                for model in (Team, ApplicationMetadata, SCMPipelineRun, SCMStepRun, SCMRelease)
+            }
+            transaction.set_rollback(True)
+
+        seed(teams=1, applications_per_team=2, pipeline_runs_per_application=10, seed=42)
+
+        for model, timestamps in first.items():
+            assert list(
+                model.objects.order_by("created_at", "modified_at").values_list("created_at", "modified_at")
+            ) == (timestamps)
+        assert not SCMStepRun.objects.filter(created_at__gt=EPOCH + timedelta(days=365)).exists()
+
+    def test_command(self):
+        out = StringIO()
+
+        call_command("katka_seed", "--teams=1", "--applications=2", "--pipeline-runs=3", "--seed=1", stdout=out)
+
+        assert "katka.SCMPipelineRun: 6" in out.getvalue()
+        assert SCMPipelineRun.objects.count() == 6
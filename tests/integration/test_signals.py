@@ -8,6 +8,9 @@ from katka.fields import username_on_model
 from katka.models import SCMPipelineRun, SCMRelease, SCMStepRun
 from requests import HTTPError
 
+# the default connect and read timeouts of the pipeline runner client
+RUNNER_TIMEOUT = (3.05, 10)
+
 
 @pytest.mark.django_db
 class TestSCMStepsRunSignals:
@@ -26,6 +29,95 @@ class TestSCMStepsRunSignals:
         assert my_scm_pipeline_run.modified_username == "signal_tester"
 
 
+@pytest.mark.django_db
+class TestIncrementalStepCounters:
+    @pytest.fixture(autouse=True)
+    def incremental_counters(self, settings):
+        settings.INCREMENTAL_STEP_COUNTERS = True
+
+    def test_created_steps_are_added(self, my_scm_pipeline_run):
+        assert my_scm_pipeline_run.steps_total == 5
+
+        with username_on_model(SCMStepRun, "signal_tester"):
+            SCMStepRun.objects.create(slug="s1", name="s1", stage="build", scm_pipeline_run=my_scm_pipeline_run)
+            SCMStepRun.objects.create(
+                slug="s2",
+                name="s2",
+                stage="build",
+                scm_pipeline_run=my_scm_pipeline_run,
+                status=constants.STEP_STATUS_SKIPPED,
+            )
+
+        my_scm_pipeline_run.refresh_from_db()
+        # the counters are adjusted instead of recounted, so the initial (incorrect) total is kept
+        assert my_scm_pipeline_run.steps_total == 7
+        assert my_scm_pipeline_run.steps_completed == 1
+        assert my_scm_pipeline_run.modified_username == "signal_tester"
+
+    def test_status_transitions(self, my_scm_step_run, my_scm_pipeline_run):
+        step = SCMStepRun.objects.get(pk=my_scm_step_run.pk)
+        pipeline = SCMPipelineRun.objects.get(pk=my_scm_pipeline_run.pk)
+        # the fixture starts with 5 steps, the created step was added to it
+        assert (pipeline.steps_total, pipeline.steps_completed) == (6, 0)
+
+        with username_on_model(SCMStepRun, "signal_tester"):
+            for status, expected_completed in (
+                (constants.STEP_STATUS_IN_PROGRESS, 0),
+                (constants.STEP_STATUS_FAILED, 1),
+                (constants.STEP_STATUS_SUCCESS, 1),
+                (constants.STEP_STATUS_IN_PROGRESS, 0),
+                (constants.STEP_STATUS_SUCCESS, 1),
+            ):
+                step.status = status
+                step.save()
+                pipeline.refresh_from_db()
+                assert (pipeline.steps_total, pipeline.steps_completed) == (6, expected_completed)
+
+    def test_no_counting_queries(self, my_scm_step_run, django_assert_num_queries):
+        step = SCMStepRun.objects.select_related("scm_pipeline_run").get(pk=my_scm_step_run.pk)
+        step.status = constants.STEP_STATUS_SUCCESS
+        with username_on_model(SCMStepRun, "signal_tester"):
+            # savepoint, lock the step, save it, atomic counter update, refresh counters, save the pipeline audit fields
+            # and release the savepoint
+            with django_assert_num_queries(7):
+                step.save()
+
+    def test_repeated_transition_is_counted_once(self, my_scm_step_run, my_scm_pipeline_run):
+        # two concurrent requests that loaded the step before either of them saved it
+        first = SCMStepRun.objects.get(pk=my_scm_step_run.pk)
+        second = SCMStepRun.objects.get(pk=my_scm_step_run.pk)
+
+        with username_on_model(SCMStepRun, "signal_tester"):
+            for step in (first, second):
+                step.status = constants.STEP_STATUS_SUCCESS
+                step.save()
+
+        my_scm_pipeline_run.refresh_from_db()
+        assert my_scm_pipeline_run.steps_completed == 1
+
+    def test_unchanged_counters_do_not_save_pipeline(self, my_scm_step_run, my_scm_pipeline_run):
+        step = SCMStepRun.objects.get(pk=my_scm_step_run.pk)
+        before = SCMPipelineRun.objects.get(pk=my_scm_pipeline_run.pk).modified_at
+
+        step.status = constants.STEP_STATUS_IN_PROGRESS
+        with username_on_model(SCMStepRun, "signal_tester"):
+            step.save()
+
+        assert SCMPipelineRun.objects.get(pk=my_scm_pipeline_run.pk).modified_at == before
+
+    def test_moved_step_recounts_both_pipelines(self, my_scm_step_run, my_scm_pipeline_run, next_scm_pipeline_run):
+        step = SCMStepRun.objects.get(pk=my_scm_step_run.pk)
+        step.scm_pipeline_run = next_scm_pipeline_run
+        with username_on_model(SCMStepRun, "signal_tester"):
+            step.save()
+
+        my_scm_pipeline_run.refresh_from_db()
+        next_scm_pipeline_run.refresh_from_db()
+        # moving steps between pipelines falls back to counting the steps
+        assert my_scm_pipeline_run.steps_total == 0
+        assert next_scm_pipeline_run.steps_total == 1
+
+
 @pytest.mark.django_db
 class TestSCMPipelineRunSignals:
     def test_notify_post(self, scm_step_run, my_scm_pipeline_run):
@@ -57,10 +149,12 @@ class TestSCMPipelineRunSignals:
                 mock.call(
                     "http://override-url/change/",
                     json={"public_identifier": str(my_scm_pipeline_run.public_identifier)},
+                    timeout=RUNNER_TIMEOUT,
                 ),
                 mock.call(
                     "http://override-url/change/",
                     json={"public_identifier": str(my_scm_pipeline_run.public_identifier)},
+                    timeout=RUNNER_TIMEOUT,
                 ),
             ]
 
@@ -94,7 +188,11 @@ class TestSCMPipelineRunSignals:
 
         # should not be called because the pipeline is still initializing
         assert session.post.call_args_list == [
-            mock.call("http://override-url/change/", json={"public_identifier": str(pipeline_run.public_identifier)}),
+            mock.call(
+                "http://override-url/change/",
+                json={"public_identifier": str(pipeline_run.public_identifier)},
+                timeout=RUNNER_TIMEOUT,
+            ),
         ]
 
         with override_settings(**overrides), username_on_model(SCMPipelineRun, "signal_tester"):
@@ -126,7 +224,11 @@ class TestSCMPipelineRunSignals:
 
         # should not be called because the pipeline is still initializing
         assert session.post.call_args_list == [
-            mock.call("http://override-url/change/", json={"public_identifier": str(pipeline_run.public_identifier)}),
+            mock.call(
+                "http://override-url/change/",
+                json={"public_identifier": str(pipeline_run.public_identifier)},
+                timeout=RUNNER_TIMEOUT,
+            ),
         ]
 
         with override_settings(**overrides), username_on_model(SCMPipelineRun, "signal_tester"):
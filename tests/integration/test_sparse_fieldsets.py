@@ -0,0 +1,89 @@
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+
+import pytest
+
+
+def pipeline_select(queries):
+    selects = [query["sql"] for query in queries if query["sql"].startswith('SELECT "katka_scmpipelinerun"')]
+    assert len(selects) == 1
+    return selects[0].split(" FROM ")[0]
+
+
+@pytest.mark.django_db
+class TestSparseFieldsets:
+    def test_fields(self, client, logged_in_user, scm_pipeline_run):
+        with CaptureQueriesContext(connection) as queries:
+            response = client.get("/scm-pipeline-runs/?fields=public_identifier,status,steps_total,steps_completed")
+
+        assert response.status_code == 200
+        parsed = response.json()
+        assert len(parsed) > 0
+        for pipeline in parsed:
+            assert set(pipeline) == {"public_identifier", "status", "steps_total", "steps_completed"}
+
+        columns = pipeline_select(queries)
+        assert '"status"' in columns
+        assert '"katka_pipelinedefinition"' not in columns
+        assert '"output"' not in columns
+        # the releases are not prefetched when they are not requested
+        assert not [query for query in queries if 'FROM "katka_scmrelease"' in query["sql"]]
+
+    def test_omit(self, client, logged_in_user, scm_pipeline_run):
+        with CaptureQueriesContext(connection) as queries:
+            response = client.get("/scm-pipeline-runs/?omit=pipeline_yaml,output")
+
+        assert response.status_code == 200
+        parsed = response.json()
+        assert len(parsed) > 0
+        for pipeline in parsed:
+            assert "pipeline_yaml" not in pipeline
+            assert "output" not in pipeline
+            assert "status" in pipeline
+            assert "scmrelease_set" in pipeline
+
+        columns = pipeline_select(queries)
+        assert '"katka_pipelinedefinition"' not in columns
+        assert '"output"' not in columns
+
+    def test_detail(self, client, logged_in_user, scm_pipeline_run):
+        response = client.get(f"/scm-pipeline-runs/{scm_pipeline_run.public_identifier}/?fields=status,application")
+
+        assert response.status_code == 200
+        assert response.json() == {
+            "status": scm_pipeline_run.status,
+            "application": str(scm_pipeline_run.application_id),
+        }
+
+    def test_fields_and_omit(self, client, logged_in_user, scm_step_run):
+        response = client.get("/scm-step-runs/?fields=slug,status,output&omit=output")
+
+        assert response.status_code == 200
+        for step in response.json():
+            assert set(step) == {"slug", "status"}
+
+    def test_unknown_fields_ignored(self, client, logged_in_user, team):
+        response = client.get("/teams/?fields=name,unknown")
+
+        assert response.status_code == 200
+        for team in response.json():
+            assert set(team) == {"name"}
+
+    def test_all_fields_by_default(self, client, logged_in_user, scm_pipeline_run):
+        with CaptureQueriesContext(connection) as queries:
+            response = client.get("/scm-pipeline-runs/")
+
+        assert "pipeline_yaml" in response.json()[0]
+        # the pipeline definition is joined to serialize the pipeline_yaml
+        assert '"katka_pipelinedefinition"."data"' in pipeline_select(queries)
+
+    def test_not_applied_to_updates(self, client, logged_in_user, scm_pipeline_run):
+        response = client.patch(
+            f"/scm-pipeline-runs/{scm_pipeline_run.public_identifier}/?fields=status",
+            {"output": "new output"},
+            content_type="application/json",
+        )
+
+        assert response.status_code == 200
+        assert response.json()["output"] == "new output"
+        assert "pipeline_yaml" in response.json()
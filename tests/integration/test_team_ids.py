@@ -0,0 +1,94 @@
+from django.contrib.auth.models import AnonymousUser, User
+from django.core.cache import cache
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+
+import pytest
+from katka import models
+from katka.fields import username_on_model
+from katka.utils import get_team_ids, get_teams
+
+
+def _team_membership_queries(queries):
+    return [query for query in queries if 'FROM "katka_team"' in query["sql"] and "auth_user_groups" in query["sql"]]
+
+
+@pytest.mark.django_db
+class TestGetTeamIds:
+    def test_groups_and_sys_users(self, user, sys_user, my_team, my_other_team, not_my_team):
+        my_team.sys_users.add(user)
+
+        assert sorted(get_team_ids(User.objects.get(pk=user.pk))) == sorted([my_team.pk, my_other_team.pk])
+        assert sorted(get_team_ids(User.objects.get(pk=sys_user.pk))) == sorted([my_team.pk, my_other_team.pk])
+
+    def test_get_teams(self, user, my_team, my_other_team, not_my_team):
+        assert set(get_teams(user)) == {my_team, my_other_team}
+
+    def test_memoized_per_user_object(self, user, team, django_assert_num_queries):
+        get_team_ids(user)
+        with django_assert_num_queries(0):
+            get_team_ids(user)
+
+    def test_anonymous(self, django_assert_num_queries):
+        with django_assert_num_queries(0):
+            assert get_team_ids(AnonymousUser()) == []
+
+    def test_invalidated_on_group_change(self, user, team, not_my_team, not_my_group):
+        assert not_my_team.pk not in get_team_ids(user)
+
+        user.groups.add(not_my_group)
+
+        assert not_my_team.pk in get_team_ids(user)
+
+    def test_evaluated_once_per_request(self, client, logged_in_user, team, project):
+        data = {"name": "Project X", "slug": "PRJX", "team": str(team.public_identifier)}
+        with CaptureQueriesContext(connection) as queries:
+            response = client.post("/projects/", data=data, content_type="application/json")
+
+        assert response.status_code == 201
+        assert len(_team_membership_queries(queries)) == 1
+
+
+@pytest.mark.django_db
+class TestTeamIdsCache:
+    @pytest.fixture(autouse=True)
+    def enable_cache(self, settings):
+        settings.TEAMS_CACHE_TIMEOUT = 60
+        yield
+        cache.clear()
+
+    def test_cached_across_requests(self, user, team, django_assert_num_queries):
+        get_team_ids(User.objects.get(pk=user.pk))
+
+        fresh_user = User.objects.get(pk=user.pk)
+        with django_assert_num_queries(0):
+            get_team_ids(fresh_user)
+
+    def test_invalidated_on_group_change(self, user, team, not_my_team, not_my_group):
+        assert not_my_team.pk not in get_team_ids(User.objects.get(pk=user.pk))
+
+        not_my_group.user_set.add(user)
+
+        assert not_my_team.pk in get_team_ids(User.objects.get(pk=user.pk))
+
+    def test_invalidated_on_sys_user_change(self, user, team, not_my_team):
+        assert not_my_team.pk not in get_team_ids(User.objects.get(pk=user.pk))
+
+        not_my_team.sys_users.add(user)
+        assert not_my_team.pk in get_team_ids(User.objects.get(pk=user.pk))
+
+        not_my_team.sys_users.clear()
+        assert not_my_team.pk not in get_team_ids(User.objects.get(pk=user.pk))
+
+    def test_invalidated_on_team_change(self, user, group, not_my_group):
+        get_team_ids(User.objects.get(pk=user.pk))
+
+        team = models.Team(name="New team", slug="NEW", group=group)
+        with username_on_model(models.Team, "initial"):
+            team.save()
+        assert team.pk in get_team_ids(User.objects.get(pk=user.pk))
+
+        team.group = not_my_group
+        with username_on_model(models.Team, "initial"):
+            team.save()
+        assert team.pk not in get_team_ids(User.objects.get(pk=user.pk))
@@ -16,6 +16,13 @@ class TestTeamViewSet:
         assert parsed[0]["group"] == "group1"
         UUID(parsed[0]["public_identifier"])  # should not raise
 
+    def test_list_query_budget(self, client, logged_in_user, team, my_other_team, django_assert_num_queries):
+        # session, user, teams of the user and the teams joined with their groups; regardless of the number of teams
+        with django_assert_num_queries(4):
+            response = client.get("/teams/")
+
+        assert len(response.json()) == 2
+
     def test_filtered_list(self, client, logged_in_user, my_team, group, my_other_team, my_other_group):
         """Note: Can only filter teams that logged_in_user belongs to"""
         # TODO: Filter on group name rather than id
@@ -52,3 +52,4 @@ PIPELINE_RUNNER_SESSION = session.Session()
 PIPELINE_RUNNER_BASE_URL = None
 PIPELINE_CHANGE_NOTIFICATION_EP = None
 PIPELINE_UPDATE_STEP_EP = None
+PIPELINE_RUNNER_RETRY_BACKOFF = 0
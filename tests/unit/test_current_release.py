@@ -0,0 +1,43 @@
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+
+import pytest
+from katka import constants, releases
+from katka.fields import username_on_model
+from katka.models import SCMPipelineRun, SCMRelease
+
+
+@pytest.fixture
+def release_history(scm_pipeline_run):
+    """A single pipeline run that is part of many finished releases and of two open releases"""
+    with username_on_model(SCMPipelineRun, "initial"), username_on_model(SCMRelease, "initial"):
+        for i in range(20):
+            status = constants.RELEASE_STATUS_SUCCESS if i < 18 else constants.RELEASE_STATUS_IN_PROGRESS
+            release = SCMRelease.objects.create(name=f"Version {i}", status=status)
+            release.scm_pipeline_runs.add(scm_pipeline_run)
+            for j in range(3):
+                release.scm_pipeline_runs.add(
+                    SCMPipelineRun.objects.create(application=scm_pipeline_run.application, commit_hash=f"{i}-{j}")
+                )
+
+    return release
+
+
+@pytest.mark.django_db
+class TestGetCurrentRelease:
+    def test_single_query(self, scm_pipeline_run, scm_release_with_pipeline_run, django_assert_num_queries):
+        with django_assert_num_queries(1):
+            assert releases._get_current_release(scm_pipeline_run) == scm_release_with_pipeline_run
+
+    def test_no_open_release(self, scm_pipeline_run):
+        assert releases._get_current_release(scm_pipeline_run) is None
+
+    def test_newest_of_multiple_open_releases(self, scm_pipeline_run, release_history, caplog):
+        with CaptureQueriesContext(connection) as queries:
+            release = releases._get_current_release(scm_pipeline_run)
+
+        assert release == release_history
+        assert release.name == "Version 19"
+        assert len(queries) == 1
+        assert "LIMIT 2" in queries[0]["sql"]
+        assert "Multiple open releases found" in caplog.text
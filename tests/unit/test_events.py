@@ -0,0 +1,99 @@
+import threading
+
+from katka.events import Event, EventStream, InProcessBroker
+
+
+def event(team_id, number=0):
+    return Event("pipeline", team_id, {"number": number})
+
+
+class TestInProcessBroker:
+    def test_only_events_of_subscribed_teams(self):
+        broker = InProcessBroker()
+        subscription = broker.subscribe([1, 2], buffer_size=10)
+
+        broker.publish(event(1))
+        broker.publish(event(3))
+        broker.publish(event(2))
+
+        assert [subscription.get(timeout=0).team_id for _ in range(2)] == [1, 2]
+        assert subscription.get(timeout=0) is None
+
+    def test_subscribed_to_all_teams(self):
+        broker = InProcessBroker()
+        subscription = broker.subscribe(None, buffer_size=10)
+
+        broker.publish(event(3))
+
+        assert subscription.get(timeout=0).team_id == 3
+
+    def test_unsubscribe(self):
+        broker = InProcessBroker()
+        with broker.subscribe([1], buffer_size=10) as subscription:
+            pass
+
+        broker.publish(event(1))
+        assert subscription.get(timeout=0) is None
+
+    def test_bounded_buffer_drops_oldest(self):
+        broker = InProcessBroker()
+        subscription = broker.subscribe([1], buffer_size=3)
+
+        for number in range(10):
+            broker.publish(event(1, number))
+
+        assert subscription.dropped == 7
+        assert [subscription.get(timeout=0).data["number"] for _ in range(3)] == [7, 8, 9]
+
+    def test_concurrent_publishers(self):
+        broker = InProcessBroker()
+        subscription = broker.subscribe([1], buffer_size=50)
+
+        def publish():
+            for number in range(100):
+                broker.publish(event(1, number))
+
+        threads = [threading.Thread(target=publish) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        assert subscription.dropped == 350
+        assert subscription._queue.qsize() == 50
+
+
+class TestEventStream:
+    def test_events_and_heartbeats(self):
+        broker = InProcessBroker()
+        subscription = broker.subscribe([1], buffer_size=10)
+        broker.publish(event(1, 42))
+
+        stream = EventStream(subscription, heartbeat_interval=0.01, timeout=0.1)
+        messages = list(stream)
+
+        assert messages[0] == "retry: 1000\n\n"
+        assert messages[1] == 'event: pipeline\ndata: {"number":42}\n\n'
+        assert set(messages[2:]) == {": keep-alive\n\n"}
+
+    def test_dropped_events_reported(self):
+        broker = InProcessBroker()
+        subscription = broker.subscribe([1], buffer_size=2)
+        for number in range(5):
+            broker.publish(event(1, number))
+
+        messages = list(EventStream(subscription, heartbeat_interval=0.01, timeout=0.05))
+
+        assert messages[1:4] == [
+            "event: dropped\ndata: 3\n\n",
+            'event: pipeline\ndata: {"number":3}\n\n',
+            'event: pipeline\ndata: {"number":4}\n\n',
+        ]
+
+    def test_close_unsubscribes(self):
+        broker = InProcessBroker()
+        stream = EventStream(broker.subscribe([1], buffer_size=10))
+
+        stream.close()
+
+        assert not broker._subscriptions
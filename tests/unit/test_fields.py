@@ -1,4 +1,9 @@
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
 import pytest
+from katka import models
 from katka.exceptions import MissingUsername
 from katka.fields import username_on_model
 
@@ -37,3 +42,70 @@ class TestAutoUsername:
             model.save()
 
         assert model.field == "test_user"
+
+    def test_nested_contexts(self):
+        field = AlwaysUpdate._meta.get_field("field")
+        with username_on_model(AlwaysUpdate, "outer"):
+            with username_on_model(AlwaysUpdate, "inner"):
+                with username_on_model(OnlyOnCreate, "other model"):
+                    assert field.get_username() == "inner"
+
+                assert field.get_username() == "inner"
+
+            assert field.get_username() == "outer"
+
+        assert field.get_username() is None
+
+    def test_fields_of_same_abstract_model(self):
+        with username_on_model(models.Team, "team user"):
+            assert models.Team._meta.get_field("modified_username").get_username() == "team user"
+            assert models.Project._meta.get_field("modified_username").get_username() is None
+
+
+class TestAutoUsernameConcurrency:
+    """The usernames of concurrent requests must not leak into each other"""
+
+    def _save_username(self, username, wait):
+        instance = AlwaysUpdate()
+        field = AlwaysUpdate._meta.get_field("field")
+        with username_on_model(AlwaysUpdate, username):
+            wait()
+            value = field.pre_save(instance, add=True)
+
+        return value
+
+    def test_threads(self):
+        thread_count = 20
+        barrier = threading.Barrier(thread_count)
+        with ThreadPoolExecutor(max_workers=thread_count) as executor:
+            futures = [
+                executor.submit(self._save_username, f"user-{i}", lambda: barrier.wait(timeout=10))
+                for i in range(thread_count)
+            ]
+            results = [future.result() for future in futures]
+
+        assert results == [f"user-{i}" for i in range(thread_count)]
+
+    def test_threads_do_not_inherit_usernames(self):
+        field = AlwaysUpdate._meta.get_field("field")
+        with username_on_model(AlwaysUpdate, "request user"):
+            with ThreadPoolExecutor(max_workers=1) as executor:
+                assert executor.submit(field.get_username).result() is None
+
+            assert field.get_username() == "request user"
+
+    def test_asyncio_tasks(self):
+        async def save_username(username):
+            instance = AlwaysUpdate()
+            field = AlwaysUpdate._meta.get_field("field")
+            with username_on_model(AlwaysUpdate, username):
+                for _ in range(5):
+                    await asyncio.sleep(0)  # let the other tasks run while the context is active
+                    assert field.get_username() == username
+
+                return field.pre_save(instance, add=True)
+
+        async def main():
+            return await asyncio.gather(*(save_username(f"user-{i}") for i in range(50)))
+
+        assert asyncio.run(main()) == [f"user-{i}" for i in range(50)]
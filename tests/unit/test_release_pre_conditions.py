@@ -0,0 +1,95 @@
+import json
+from unittest import mock
+
+from django.utils import timezone
+
+import pytest
+from katka import constants, releases
+from katka.fields import username_on_model
+from katka.models import SCMStepRun
+
+
+def create_steps(pipeline, count):
+    """Executed steps, with the production change starting halfway and ending at the last step"""
+    steps = [
+        SCMStepRun(
+            slug=f"step-{i}",
+            name=f"Step {i}",
+            stage="deploy",
+            scm_pipeline_run=pipeline,
+            team_id=pipeline.team_id,
+            sequence_id=f"{i:04}",
+            status=constants.STEP_STATUS_SUCCESS,
+            output=json.dumps({"release.version": f"1.0.{i}", f"step-{i}": "x" * 100}),
+            tags="production_change_start" if i == count // 2 else "",
+            started_at=timezone.now(),
+            ended_at=timezone.now(),
+        )
+        for i in range(count)
+    ]
+    steps[-1].tags = "docker production_change_end"
+    with username_on_model(SCMStepRun, "initial"):
+        return SCMStepRun.objects.bulk_create(steps)
+
+
+@pytest.mark.django_db
+@pytest.mark.parametrize("step_count", [10, 100, 500])
+class TestGatherStepsPreConditions:
+    def test_pre_conditions(self, scm_pipeline_run, step_count):
+        steps = create_steps(scm_pipeline_run, step_count)
+
+        pre_conditions = releases._gather_steps_pre_conditions(scm_pipeline_run)
+
+        assert pre_conditions.version_number == f"1.0.{step_count - 1}"
+        assert pre_conditions.success_status_between_start_end == [True] * (step_count - step_count // 2)
+        assert pre_conditions.prod_change_start_date == steps[step_count // 2].started_at
+        assert pre_conditions.prod_change_end_date == steps[-1].ended_at
+
+    def test_outputs_parsed_once(self, scm_pipeline_run, step_count, django_assert_num_queries):
+        create_steps(scm_pipeline_run, step_count)
+
+        with mock.patch("katka.releases.json.loads", wraps=json.loads) as loads:
+            with django_assert_num_queries(2):
+                releases._gather_steps_pre_conditions(scm_pipeline_run)
+            assert loads.call_count == step_count
+
+            loads.reset_mock()
+            with django_assert_num_queries(1):  # the outputs are not loaded again
+                pre_conditions = releases._gather_steps_pre_conditions(scm_pipeline_run)
+            assert loads.call_count == 0
+
+        assert pre_conditions.version_number == f"1.0.{step_count - 1}"
+
+    def test_modified_step_parsed_again(self, scm_pipeline_run, step_count):
+        steps = create_steps(scm_pipeline_run, step_count)
+        releases._gather_steps_pre_conditions(scm_pipeline_run)
+
+        last_step = steps[-1]
+        last_step.output = json.dumps({"release.version": "2.0.0"})
+        with username_on_model(SCMStepRun, "modified"):
+            last_step.save()
+
+        with mock.patch("katka.releases.json.loads", wraps=json.loads) as loads:
+            pre_conditions = releases._gather_steps_pre_conditions(scm_pipeline_run)
+
+        loads.assert_called_once_with(last_step.output)
+        assert pre_conditions.version_number == "2.0.0"
+
+
+@pytest.mark.django_db
+class TestReleaseVersionsCache:
+    def test_size_limited(self, scm_pipeline_run, settings):
+        settings.RELEASE_OUTPUT_CACHE_SIZE = 5
+        create_steps(scm_pipeline_run, 10)
+
+        releases._gather_steps_pre_conditions(scm_pipeline_run)
+
+        assert len(releases._release_versions) == 5
+        # only the versions are kept, not the outputs
+        assert {version for _, version in releases._release_versions.values()} <= {f"1.0.{i}" for i in range(10)}
+
+    def test_invalid_output_logged_every_time(self, scm_pipeline_run, scm_step_run_with_broken_output, caplog):
+        releases._gather_steps_pre_conditions(scm_pipeline_run)
+        releases._gather_steps_pre_conditions(scm_pipeline_run)
+
+        assert caplog.messages.count("Invalid JSON in step output") == 2
@@ -0,0 +1,228 @@
+from unittest import mock
+
+import pytest
+from katka.exceptions import PipelineRunnerError
+from katka.runner import LATENCY_BUCKETS, EndpointMetrics, PipelineRunnerClient, render_prometheus
+from requests import ConnectionError, ConnectTimeout, ReadTimeout, Session
+from requests.adapters import HTTPAdapter
+
+
+def response(status_code=200):
+    return mock.Mock(status_code=status_code)
+
+
+@pytest.fixture
+def session(settings):
+    session = mock.Mock()
+    session.post.return_value = response()
+    settings.PIPELINE_RUNNER_SESSION = session
+    settings.PIPELINE_RUNNER_BASE_URL = "http://runner/"
+    settings.PIPELINE_RUNNER_RETRIES = 2
+    settings.PIPELINE_RUNNER_CIRCUIT_BREAKER_THRESHOLD = 3
+    settings.PIPELINE_RUNNER_CIRCUIT_BREAKER_RESET = 30
+    return session
+
+
+@pytest.fixture
+def client():
+    return PipelineRunnerClient()
+
+
+class TestPipelineRunnerClient:
+    def test_timeouts(self, settings, session, client):
+        settings.PIPELINE_RUNNER_CONNECT_TIMEOUT = 1
+        settings.PIPELINE_RUNNER_READ_TIMEOUT = 5
+
+        assert client.post("change/", json={"a": 1}) is session.post.return_value
+
+        session.post.assert_called_once_with("http://runner/change/", json={"a": 1}, timeout=(1, 5))
+
+    def test_retries_connection_errors(self, session, client):
+        session.post.side_effect = [ConnectionError(), ConnectTimeout(), response()]
+
+        assert client.post("change/", json={}).status_code == 200
+        assert session.post.call_count == 3
+
+    def test_read_timeouts_not_retried(self, session, client):
+        # the runner may have received the request already
+        session.post.side_effect = [ReadTimeout(), response()]
+
+        with pytest.raises(PipelineRunnerError):
+            client.post("change/", json={})
+        assert session.post.call_count == 1
+        assert client.circuit_breaker.failures == 1
+
+    def test_retries_unavailable_responses(self, session, client):
+        session.post.side_effect = [response(503), response(502), response(503)]
+
+        # the last response is returned, so the caller can raise for its status
+        assert client.post("change/", json={}).status_code == 503
+        assert session.post.call_count == 3
+
+    def test_gateway_timeouts_not_retried(self, session, client):
+        # the runner may have processed the request already
+        session.post.return_value = response(504)
+
+        assert client.post("change/", json={}).status_code == 504
+        assert session.post.call_count == 1
+
+    def test_server_errors_not_retried(self, session, client):
+        session.post.return_value = response(500)
+
+        assert client.post("change/", json={}).status_code == 500
+        assert session.post.call_count == 1
+        assert client.circuit_breaker.failures == 1
+        assert client.metrics()["change/"].failures == 1
+
+    def test_client_errors_not_retried(self, session, client):
+        session.post.return_value = response(400)
+
+        assert client.post("change/", json={}).status_code == 400
+        assert session.post.call_count == 1
+
+    def test_gives_up(self, session, client):
+        session.post.side_effect = ConnectionError()
+
+        with pytest.raises(PipelineRunnerError):
+            client.post("change/", json={})
+        assert session.post.call_count == 3
+
+    def test_backoff_with_jitter(self, settings, session, client):
+        settings.PIPELINE_RUNNER_RETRY_BACKOFF = 0.5
+        session.post.side_effect = ConnectionError()
+
+        with mock.patch("katka.runner.time.sleep") as sleep, mock.patch("katka.runner.random.uniform") as uniform:
+            uniform.side_effect = lambda low, high: high
+            with pytest.raises(PipelineRunnerError):
+                client.post("change/", json={})
+
+        assert uniform.call_args_list == [mock.call(0, 0.5), mock.call(0, 1.0)]
+        assert sleep.call_args_list == [mock.call(0.5), mock.call(1.0)]
+
+
+class TestCircuitBreaker:
+    def fail(self, client, times):
+        for _ in range(times):
+            with pytest.raises(PipelineRunnerError):
+                client.post("change/", json={})
+
+    def test_opens_after_consecutive_failures(self, session, client):
+        session.post.side_effect = ConnectionError()
+        self.fail(client, 3)
+        session.post.reset_mock()
+
+        self.fail(client, 10)
+
+        assert session.post.call_count == 0
+
+    def test_opens_after_server_errors(self, session, client):
+        session.post.return_value = response(500)
+        for _ in range(3):
+            client.post("change/", json={})
+        session.post.reset_mock()
+
+        self.fail(client, 1)
+
+        assert session.post.call_count == 0
+
+    def test_success_resets_failures(self, session, client):
+        session.post.side_effect = [ConnectionError()] * 6 + [response()] + [ConnectionError()] * 6
+        self.fail(client, 2)
+        client.post("change/", json={})
+        self.fail(client, 2)
+
+        assert client.circuit_breaker.opened_at is None
+
+    def test_trial_after_reset_timeout(self, session, client):
+        session.post.side_effect = ConnectionError()
+        with mock.patch("katka.runner.time.monotonic", return_value=100):
+            self.fail(client, 3)
+
+        session.post.side_effect = None
+        with mock.patch("katka.runner.time.monotonic", return_value=120):
+            self.fail(client, 1)  # still open
+        with mock.patch("katka.runner.time.monotonic", return_value=131):
+            assert client.post("change/", json={}).status_code == 200
+
+        assert client.circuit_breaker.opened_at is None
+
+    def test_failed_trial_opens_again(self, session, client):
+        session.post.side_effect = ConnectionError()
+        with mock.patch("katka.runner.time.monotonic", return_value=100):
+            self.fail(client, 3)
+        with mock.patch("katka.runner.time.monotonic", return_value=131):
+            self.fail(client, 1)  # the trial
+
+        session.post.reset_mock()
+        with mock.patch("katka.runner.time.monotonic", return_value=140):
+            self.fail(client, 1)
+        assert session.post.call_count == 0
+
+
+class TestMetrics:
+    def test_per_endpoint(self, session, client):
+        session.post.side_effect = [response(), ConnectionError(), response()]
+
+        client.post("change/", json={})
+        client.post("updatestep/", json={})
+
+        metrics = client.metrics()
+        assert metrics["change/"].requests == 1
+        assert metrics["change/"].failures == 0
+        assert metrics["updatestep/"].requests == 2
+        assert metrics["updatestep/"].failures == 1
+        assert sum(metrics["updatestep/"].buckets) == 2
+        assert len(metrics["updatestep/"].buckets) == len(LATENCY_BUCKETS) + 1
+
+    def test_snapshot(self, session, client):
+        client.post("change/", json={})
+        snapshot = client.metrics()
+
+        client.post("change/", json={})
+
+        assert snapshot["change/"].requests == 1
+
+    def test_render_prometheus(self):
+        metrics = EndpointMetrics()
+        metrics.observe(0.01, failed=False)
+        metrics.observe(0.3, failed=True)
+        metrics.observe(60, failed=True)
+
+        lines = render_prometheus({"change/": metrics}).splitlines()
+
+        assert 'katka_runner_request_duration_seconds_bucket{endpoint="change/",le="0.05"} 1' in lines
+        assert 'katka_runner_request_duration_seconds_bucket{endpoint="change/",le="0.25"} 1' in lines
+        assert 'katka_runner_request_duration_seconds_bucket{endpoint="change/",le="0.5"} 2' in lines
+        assert 'katka_runner_request_duration_seconds_bucket{endpoint="change/",le="10"} 2' in lines
+        assert 'katka_runner_request_duration_seconds_bucket{endpoint="change/",le="+Inf"} 3' in lines
+        assert 'katka_runner_request_duration_seconds_count{endpoint="change/"} 3' in lines
+        assert 'katka_runner_request_failures_total{endpoint="change/"} 2' in lines
+
+
+class TestSession:
+    def test_pooled_session(self, settings, client):
+        settings.PIPELINE_RUNNER_SESSION = None
+        settings.PIPELINE_RUNNER_POOL_SIZE = 25
+
+        session = client.session
+
+        assert client.session is session
+        assert session.get_adapter("http://runner/")._pool_maxsize == 25
+
+    def test_configured_session_pooled(self, settings, client):
+        session = Session()
+        session.mount("https://", HTTPAdapter(max_retries=2))
+        settings.PIPELINE_RUNNER_SESSION = session
+        settings.PIPELINE_RUNNER_POOL_SIZE = 25
+
+        assert client.session is session
+        assert session.get_adapter("http://runner/")._pool_maxsize == 25
+        assert session.get_adapter("https://runner/")._pool_maxsize == 25
+        assert session.get_adapter("https://runner/").max_retries.total == 2
+
+    def test_configured_session_pooled_once(self, settings, client):
+        settings.PIPELINE_RUNNER_SESSION = Session()
+
+        adapter = client.session.get_adapter("http://runner/")
+
+        assert client.session.get_adapter("http://runner/") is adapter
@@ -0,0 +1,261 @@
+"""
+An in-process stand-in for the pipeline runner, to drive complete pipeline lifecycles through the katka API
+
+Set the runner as the PIPELINE_RUNNER_SESSION: the notifications that katka sends to the runner are queued, and the
+runner reacts to them like the real one does. It creates the steps of an initializing pipeline run and starts it,
+then runs its steps one by one and finishes the pipeline run, which makes katka start the next queued pipeline run of
+the application.
+
+The queued notifications are handled by run_until_idle() on the calling thread, or by worker threads after start().
+Worker threads need a database that supports concurrent writes (not SQLite) and the PIPELINE_NOTIFICATION_OUTBOX
+setting, so notifications only arrive after the changes were committed.
+"""
+import queue
+import random
+import threading
+import time
+from dataclasses import dataclass, field
+
+from django.conf import settings
+from django.db import connection
+
+from katka import constants
+from katka.notifications import dispatch_pending_notifications, outbox_enabled
+from requests import HTTPError, Session
+
+# (stage, slug) of the steps the runner creates for every pipeline run
+DEFAULT_STEPS = (("prepare", "checkout"), ("build", "compile"), ("test", "unit-tests"), ("deploy", "deploy"))
+
+
+class Response:
+    def __init__(self, status_code):
+        self.status_code = status_code
+
+    def raise_for_status(self):
+        if self.status_code >= 400:
+            raise HTTPError(f"{self.status_code} response from fake pipeline runner", response=self)
+
+
+class HttpApi:
+    """Calls the katka API of a running server, with the same interface as the Django test client"""
+
+    def __init__(self, base_url, session=None):
+        self.base_url = base_url.rstrip("/")
+        self.session = session or Session()
+
+    def get(self, path):
+        return self.session.get(self.base_url + path)
+
+    def post(self, path, data, content_type="application/json"):
+        return self.session.post(self.base_url + path, json=data)
+
+    def patch(self, path, data, content_type="application/json"):
+        return self.session.patch(self.base_url + path, json=data)
+
+
+@dataclass
+class RunnerStats:
+    notifications: int = 0
+    rejected_notifications: int = 0  # answered with a 503, to be retried by katka
+    api_calls: int = 0
+    api_seconds: float = 0.0
+    finished: dict = field(default_factory=dict)  # number of finished pipeline runs per final status
+    durations: list = field(default_factory=list)  # seconds from the first notification until the run finished
+
+    @property
+    def finished_total(self):
+        return sum(self.finished.values())
+
+
+class FakeRunner:
+    """
+    A fake pipeline runner that uses 'api' to call katka, e.g. a logged in django.test.Client or an HttpApi
+
+    Args:
+        steps: the (stage, slug) of the steps to create for every pipeline run
+        step_duration: seconds every step is in progress
+        response_latency: seconds before a notification is answered, which katka waits for
+        step_failure_rate: chance that a step fails, which fails its pipeline run and skips the other steps
+        notification_failure_rate: chance that a notification is answered with a 503
+        seed: seed of the random generator of the failures
+    """
+
+    def __init__(
+        self,
+        api,
+        steps=DEFAULT_STEPS,
+        step_duration=0,
+        response_latency=0,
+        step_failure_rate=0,
+        notification_failure_rate=0,
+        seed=0,
+    ):
+        self.api = api
+        self.steps = steps
+        self.step_duration = step_duration
+        self.response_latency = response_latency
+        self.step_failure_rate = step_failure_rate
+        self.notification_failure_rate = notification_failure_rate
+        self.stats = RunnerStats()
+        self._random = random.Random(seed)
+        self._queue = queue.Queue()
+        self._lock = threading.Lock()
+        self._busy = set()  # the pipeline runs that are being handled
+        self._notified_while_busy = set()  # the pipeline runs that have to be handled again when they are done
+        self._first_seen = {}
+        self._workers = []
+
+    # The session interface that katka.runner uses
+
+    def post(self, url, json=None, timeout=None):
+        if self.response_latency:
+            time.sleep(self.response_latency)
+
+        if not url.endswith(settings.PIPELINE_CHANGE_NOTIFICATION_EP):
+            return Response(200)  # a step update, e.g. an approval, which the fake runner does not act on
+
+        with self._lock:
+            self.stats.notifications += 1
+            if self._random.random() < self.notification_failure_rate:
+                self.stats.rejected_notifications += 1
+                return Response(503)
+
+            self._first_seen.setdefault(json["public_identifier"], time.monotonic())
+
+        self._queue.put(json["public_identifier"])
+        return Response(200)
+
+    # Handling the notifications
+
+    def run_until_idle(self):
+        """
+        Handle the queued notifications on this thread, including the ones that are sent while handling them
+
+        With the PIPELINE_NOTIFICATION_OUTBOX setting, the due notifications in the outbox are dispatched as well.
+        """
+        while True:
+            try:
+                public_identifier = self._queue.get_nowait()
+            except queue.Empty:
+                if outbox_enabled() and dispatch_pending_notifications():
+                    continue
+                return
+
+            self._handle(public_identifier)
+
+    def start(self, workers=4):
+        """Handle the notifications in worker threads, until stop() is called"""
+        for _ in range(workers):
+            worker = threading.Thread(target=self._work, daemon=True)
+            worker.start()
+            self._workers.append(worker)
+
+    def stop(self):
+        for _ in self._workers:
+            self._queue.put(None)
+        for worker in self._workers:
+            worker.join()
+        self._workers = []
+
+    def wait_until_finished(self, count, timeout=60):
+        """Wait until 'count' pipeline runs finished, return whether they did within the timeout"""
+        deadline = time.monotonic() + timeout
+        while self.stats.finished_total < count:
+            if time.monotonic() > deadline:
+                return False
+            time.sleep(0.01)
+        return True
+
+    def _work(self):
+        try:
+            while True:
+                public_identifier = self._queue.get()
+                if public_identifier is None:
+                    return
+                self._handle(public_identifier)
+        finally:
+            connection.close()
+
+    def _handle(self, public_identifier):
+        with self._lock:
+            if public_identifier in self._busy:
+                # handled by another worker, which looks at the pipeline run again when it is done
+                self._notified_while_busy.add(public_identifier)
+                return
+            self._busy.add(public_identifier)
+
+        try:
+            while True:
+                pipeline = self._call("get", f"/scm-pipeline-runs/{public_identifier}/")
+                if pipeline["status"] == constants.PIPELINE_STATUS_INITIALIZING and not pipeline["steps_total"]:
+                    self._initialize(pipeline)
+                elif pipeline["status"] == constants.PIPELINE_STATUS_IN_PROGRESS:
+                    self._run(pipeline)
+
+                with self._lock:
+                    if public_identifier not in self._notified_while_busy:
+                        return
+                    self._notified_while_busy.discard(public_identifier)
+        finally:
+            with self._lock:
+                self._busy.discard(public_identifier)
+                self._notified_while_busy.discard(public_identifier)
+
+    def _initialize(self, pipeline):
+        steps = [
+            {
+                "scm_pipeline_run": pipeline["public_identifier"],
+                "slug": slug,
+                "name": slug,
+                "stage": stage,
+                "sequence_id": f"{number}.1-1",
+            }
+            for number, (stage, slug) in enumerate(self.steps, start=1)
+        ]
+        self._call("post", "/scm-step-runs/bulk/", steps)
+        # katka queues the pipeline run when the previous commit is still running, and starts it later
+        self._call("patch", f"/scm-pipeline-runs/{pipeline['public_identifier']}/", {"status": "in progress"})
+
+    def _run(self, pipeline):
+        steps = self._call("get", f"/scm-step-runs/?scm_pipeline_run={pipeline['public_identifier']}")
+        pipeline_status = constants.PIPELINE_STATUS_SUCCESS
+        for step in sorted(steps, key=lambda step: step["sequence_id"]):
+            if step["status"] in constants.STEP_FINAL_STATUSES:
+                continue
+
+            path = f"/scm-step-runs/{step['public_identifier']}/"
+            if pipeline_status != constants.PIPELINE_STATUS_SUCCESS:
+                self._call("patch", path, {"status": constants.STEP_STATUS_SKIPPED})
+                continue
+
+            self._call("patch", path, {"status": constants.STEP_STATUS_IN_PROGRESS})
+            if self.step_duration:
+                time.sleep(self.step_duration)
+
+            with self._lock:
+                failed = self._random.random() < self.step_failure_rate
+            if failed:
+                pipeline_status = constants.PIPELINE_STATUS_FAILED
+            status = constants.STEP_STATUS_FAILED if failed else constants.STEP_STATUS_SUCCESS
+            self._call("patch", path, {"status": status})
+
+        self._call("patch", f"/scm-pipeline-runs/{pipeline['public_identifier']}/", {"status": pipeline_status})
+        with self._lock:
+            self.stats.finished[pipeline_status] = self.stats.finished.get(pipeline_status, 0) + 1
+            first_seen = self._first_seen.pop(pipeline["public_identifier"], None)
+            if first_seen is not None:
+                self.stats.durations.append(time.monotonic() - first_seen)
+
+    def _call(self, method, path, data=None):
+        start = time.monotonic()
+        if method == "get":
+            response = self.api.get(path)
+        else:
+            response = getattr(self.api, method)(path, data, content_type="application/json")
+
+        with self._lock:
+            self.stats.api_calls += 1
+            self.stats.api_seconds += time.monotonic() - start
+
+        assert response.status_code < 400, f"{method.upper()} {path} failed: {response.status_code}"
+        return response.json()
@@ -7,5 +7,7 @@ class Session:
 
 
 class Response:
+    status_code = 200
+
     def raise_for_status(self):
         pass